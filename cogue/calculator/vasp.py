@@ -11,9 +11,9 @@ __all__ = [
     "phonon_relax",
     "band_structure",
     "density_of_states",
+    "compress_outputs",
 ]
 
-import io
 import numbers
 import os
 import shutil
@@ -23,12 +23,20 @@ import numpy as np
 from cogue.crystal.cell import Cell
 from cogue.crystal.converter import atoms2cell
 from cogue.crystal.utility import klength2mesh
+from cogue.interface.compression import (
+    compress_file,
+    compression_suffixes,
+    find_file,
+    open_file,
+)
+from cogue.interface.sidecar import get_sidecar_filename, read_sidecar, write_sidecar
 from cogue.interface.vasp_io import (
     Incar,
     Outcar,
     VaspCell,
     Vasprunxml,
     VasprunxmlExpat,
+    VasprunxmlTail,
     change_point_order,
     get_atom_order_from_poscar_yaml,
     read_poscar,
@@ -855,7 +863,77 @@ def phonon_relax(
     return phr
 
 
+def compress_outputs(compression="gz", min_size=1 << 20):
+    """Compress large output files of VASP tasks once collected.
+
+    After results are extracted by each VASP task, its vasprun.xml and
+    OUTCAR larger than ``min_size`` bytes are replaced by compressed
+    files, which are read transparently by cogue later. This applies
+    to all VASP tasks made afterwards and before in this process unless
+    set otherwise by TaskVasp.set_output_compression.
+
+    Parameters
+    ----------
+    compression : str or None
+        "gz", "xz" or "zst" (requires zstandard). None disables.
+    min_size : int
+        Files smaller than this are left uncompressed.
+
+    """
+    if compression is not None and compression not in compression_suffixes:
+        print("Compression has to be one of %s." % list(compression_suffixes))
+        raise RuntimeError
+    TaskVasp._output_compression = compression
+    TaskVasp._output_compression_min_size = min_size
+
+
 class TaskVasp:
+    # Files read by _collect. Large files such as WAVECAR and CHGCAR are
+    # left in remote directories.
+    _collect_files = ("vasprun.xml", "OUTCAR", "CONTCAR", "OSZICAR")
+
+    # Compression of output files after _collect (see compress_outputs)
+    _output_files = ("vasprun.xml", "OUTCAR")
+    _output_compression = None
+    _output_compression_min_size = 1 << 20
+
+    def set_output_compression(self, compression, min_size=None):
+        """Compress vasprun.xml and OUTCAR of this task after collection.
+
+        See compress_outputs.
+
+        """
+        self._output_compression = compression
+        if min_size is not None:
+            self._output_compression_min_size = min_size
+
+    def get_output_compression(self):
+        return self._output_compression
+
+    def _compress_outputs(self):
+        """Compress large output files in place after collection.
+
+        Caches of parsed vasprun.xml are moved to the compressed file.
+
+        """
+        if self._output_compression is None:
+            return
+        for name in self._output_files:
+            filename = self._path(name)
+            if not os.path.isfile(filename):
+                continue
+            if os.path.getsize(filename) < self._output_compression_min_size:
+                continue
+            sidecar_names = (None, VasprunxmlExpat._sidecar_name)
+            caches = [
+                read_sidecar(filename, mmap_mode=None, name=n) for n in sidecar_names
+            ]
+            compressed = compress_file(filename, self._output_compression)
+            for sidecar_name, arrays in zip(sidecar_names, caches):
+                if arrays is not None:
+                    write_sidecar(compressed, arrays, name=sidecar_name)
+                    os.remove(get_sidecar_filename(filename, sidecar_name))
+
     def set_configurations(
         self,
         cell=None,
@@ -922,19 +1000,22 @@ class TaskVasp:
         """
         Create input files for VASP
 
-        We can suppose we are in the calculation directory.
+        Files are written in the working directory of the task.
         """
-        if os.path.exists("vasprun.xml"):
-            os.remove("vasprun.xml")
-        if os.path.exists("CONTCAR"):
-            os.remove("CONTCAR")
+        for filename in ("vasprun.xml", "CONTCAR"):
+            if os.path.exists(self._path(filename)):
+                os.remove(self._path(filename))
+        for filename in ("vasprun.xml", "OUTCAR"):
+            for suffix in compression_suffixes.values():
+                if os.path.exists(self._path(filename + suffix)):
+                    os.remove(self._path(filename + suffix))
 
         self._vasp_cell = VaspCell(self._cell)
-        self._vasp_cell.write(filename="POSCAR")
-        self._vasp_cell.write_yaml(filename="POSCAR.yaml")
+        self._vasp_cell.write(filename=self._path("POSCAR"))
+        self._vasp_cell.write_yaml(filename=self._path("POSCAR.yaml"))
 
         ps_set = [self._pseudo_potential_map[x] for x in self._cell.get_symbols()]
-        write_potcar(ps_set)
+        write_potcar(ps_set, filename=self._path("POTCAR"))
 
         if self._k_length:  # Overwrite k_mesh if k_length is given.
             k_mesh = klength2mesh(self._k_length, self._cell.lattice)
@@ -945,11 +1026,17 @@ class TaskVasp:
             k_gamma = self._k_gamma
             k_shift = self._k_shift
 
-        write_kpoints(mesh=k_mesh, shift=k_shift, gamma=k_gamma, kpoint=self._k_point)
-        self._incar.write()
+        write_kpoints(
+            filename=self._path("KPOINTS"),
+            mesh=k_mesh,
+            shift=k_shift,
+            gamma=k_gamma,
+            kpoint=self._k_point,
+        )
+        self._incar.write(filename=self._path("INCAR"))
 
         for (fsrc, fdst) in self._copy_files:
-            shutil.copy(fsrc, fdst)
+            shutil.copy(self._path(fsrc), self._path(fdst))
 
     def _choose_configuration(self, index=0):
         # incar
@@ -1105,18 +1192,68 @@ class TaskVasp:
             incar=incar,
         )
         task.set_job(job.copy("%s-%s" % (job.get_jobname(), directory)))
+        # CHGCAR is copied to following tasks.
+        task.set_collect_files(task.get_collect_files() + ("CHGCAR",))
 
         return task
 
 
 class ElectronicStructure(TaskVasp, ElectronicStructureBase):
-    """ """
+    """Single point calculation by VASP
+
+    Parameters
+    ----------
+    properties : tuple of str, optional
+        Names of properties collected, e.g., ("forces",) for displacement
+        tasks of phonon calculations. Only elements of vasprun.xml needed
+        for them are parsed and only values of the last ionic step are
+        kept. All properties of all ionic steps are collected when None.
+    backend : str, optional
+        Output file parsed, "vasprun" (vasprun.xml) or "outcar" (OUTCAR).
+        OUTCAR is smaller and faster to parse but gives only "forces",
+        "energies" and "stress".
+
+    """
 
-    def __init__(self, directory="electronic_structure", name=None, traverse=False):
+    # Fields of Vasprunxml.parse needed for each property
+    _property_fields = {
+        "stress": "stress",
+        "forces": "forces",
+        "energies": "energies",
+        "eigenvalues": "eigenvalues",
+        "occupancies": "eigenvalues",
+        "kpoints": "eigenvalues",
+        "kpoint-weights": "eigenvalues",
+        "fermi-energy": "efermi",
+        "nbands": "nbands",
+    }
+    _outcar_properties = ("forces", "energies", "stress")
+
+    def __init__(
+        self,
+        directory="electronic_structure",
+        name=None,
+        traverse=False,
+        properties=None,
+        backend="vasprun",
+    ):
 
         ElectronicStructureBase.__init__(
             self, directory=directory, name=name, traverse=traverse
         )
+        if backend == "outcar":
+            known_properties = self._outcar_properties
+        elif backend == "vasprun":
+            known_properties = self._property_fields
+        else:
+            print("Backend %s is not supported." % backend)
+            raise RuntimeError
+        for property_name in properties or ():
+            if property_name not in known_properties:
+                print("Property %s is not collected by %s." % (property_name, backend))
+                raise RuntimeError
+        self._property_names = properties
+        self._backend = backend
 
         self._pseudo_potential_map = None
         self._k_mesh = None
@@ -1133,46 +1270,98 @@ class ElectronicStructure(TaskVasp, ElectronicStructureBase):
 
         """
 
-        if os.path.exists("POSCAR.yaml"):
-            atom_order = get_atom_order_from_poscar_yaml("POSCAR.yaml")
+        if os.path.exists(self._path("POSCAR.yaml")):
+            atom_order = get_atom_order_from_poscar_yaml(self._path("POSCAR.yaml"))
         else:
             atom_order = None
 
-        if not os.path.exists("vasprun.xml"):
-            self._log += "    vasprun.xml not exists.\n"
+        if self._backend == "outcar":
+            filename = "OUTCAR"
+        else:
+            filename = "vasprun.xml"
+
+        if find_file(self._path(filename)) is None:
+            self._log += "    %s not exists.\n" % filename
             self._status = "terminate"
+            return
+
+        if self._backend == "outcar":
+            parser, properties = self._parse_outcar()
         else:
-            vxml = Vasprunxml("vasprun.xml")
-            if (
-                vxml.parse_calculation()
-                and vxml.parse_eigenvalues()
-                and vxml.parse_efermi()
-                and vxml.parse_parameters()
-            ):
-                kpoints, weights = vxml.get_kpoints()
-                if atom_order:
-                    force_sets = vxml.get_forces()[:, atom_order, :]
-                else:
-                    force_sets = vxml.get_forces()
-                self._properties = {
-                    "stress": vxml.get_stress(),
-                    "forces": force_sets,
-                    "energies": vxml.get_energies()[:, 1],
-                    "eigenvalues": vxml.get_eigenvalues(),
-                    "occupancies": vxml.get_occupancies(),
-                    "kpoints": kpoints,
-                    "kpoint-weights": weights,
-                    "fermi-energy": vxml.get_efermi(),
-                    "nbands": vxml.get_nbands(),
-                }
-                self._status = "done"
-            else:
-                self._log += vxml.log
-                self._log += "    Failed to parse vasprun.xml.\n"
-                self._status = "terminate"
+            parser, properties = self._parse_vasprunxml()
+
+        if properties is None:
+            self._log += parser.log
+            self._log += "    Failed to parse %s.\n" % filename
+            self._status = "terminate"
+        else:
+            if properties.get("forces") is not None and atom_order:
+                properties["forces"] = properties["forces"][:, atom_order, :]
+            self._properties = properties
+            self._status = "done"
+
+    def _get_steps(self):
+        if self._property_names is None:
+            return "all"
+        else:
+            return "last"
+
+    def _parse_vasprunxml(self):
+        vxml = Vasprunxml(self._path("vasprun.xml"))
+        if self._property_names is None:
+            fields = None
+        else:
+            fields = []
+            for property_name in self._property_names:
+                if self._property_fields[property_name] not in fields:
+                    fields.append(self._property_fields[property_name])
+        if not vxml.parse(fields=fields, steps=self._get_steps()):
+            return vxml, None
+
+        kpoints, weights = vxml.get_kpoints()
+        if vxml.get_energies() is None:
+            energies = None
+        else:
+            energies = vxml.get_energies()[:, 1]
+        properties = {
+            "stress": vxml.get_stress(),
+            "forces": vxml.get_forces(),
+            "energies": energies,
+            "eigenvalues": vxml.get_eigenvalues(),
+            "occupancies": vxml.get_occupancies(),
+            "kpoints": kpoints,
+            "kpoint-weights": weights,
+            "fermi-energy": vxml.get_efermi(),
+            "nbands": vxml.get_nbands(),
+        }
+        if self._property_names is None:
+            return vxml, properties
+        else:
+            return vxml, dict([(k, properties[k]) for k in self._property_names])
+
+    def _parse_outcar(self):
+        outcar = Outcar(self._path("OUTCAR"))
+        if self._property_names is None:
+            fields = self._outcar_properties
+        else:
+            fields = self._property_names
+        if not outcar.parse(fields=fields, steps=self._get_steps()):
+            return outcar, None
+
+        properties = {}
+        if "forces" in fields:
+            properties["forces"] = outcar.get_forces()
+        if "stress" in fields:
+            properties["stress"] = outcar.get_stress()
+        if "energies" in fields:
+            # Shape (steps, 1) as energies of vasprun.xml
+            properties["energies"] = outcar.get_energies()[:, 1:2]
+        return outcar, properties
 
 
 class StructureOptimizationElement(TaskVasp, StructureOptimizationElementBase):
+    _requires_monitoring = True
+
     def __init__(
         self,
         directory="structure_optimization_element",
@@ -1204,6 +1393,55 @@ class StructureOptimizationElement(TaskVasp, StructureOptimizationElementBase):
         self._incar = None
         self._copy_files = []
         self._atom_order = None
+        self._vasprun_tail = None
+
+    def set_status(self):
+        StructureOptimizationElementBase.set_status(self)
+        if self._status and "running" in self._status:
+            self._monitor()
+        else:
+            self._vasprun_tail = None
+
+    def _monitor(self):
+        """Follow vasprun.xml of running VASP.
+
+        Only ionic steps appended after the previous cycle are parsed.
+        Convergence of the latest step is logged. When the volume has
+        already expanded beyond max_increase, which terminates this task
+        after the job, VASP is asked to stop by STOPCAR.
+
+        """
+        if self._vasprun_tail is None:
+            self._vasprun_tail = VasprunxmlTail(self._path("vasprun.xml"))
+        vxml = self._vasprun_tail
+        if not vxml.update():
+            self._log += vxml.log
+            return
+
+        lattice = vxml.get_lattice()
+        forces = vxml.get_forces()
+        stress = vxml.get_stress()
+        num_steps = min(len(lattice), len(forces), len(stress))
+        if num_steps == 0:
+            return
+        d_stress = stress[num_steps - 1] / 10
+        if self._pressure_target is not None:
+            d_stress = d_stress - np.eye(3) * self._pressure_target
+        self._log += "    step %d: max force %.2e, max stress %.2e\n" % (
+            num_steps,
+            abs(forces[num_steps - 1]).max(),
+            abs(d_stress).max(),
+        )
+
+        if self._max_increase is not None:
+            vol_last = np.linalg.det(lattice[num_steps - 1])
+            vol_init = np.linalg.det(self.get_current_cell().lattice)
+            if vol_last > self._max_increase * vol_init and not os.path.exists(
+                self._path("STOPCAR")
+            ):
+                self._log += "    Too large volume expansion, stop VASP.\n"
+                with open(self._path("STOPCAR"), "w") as w:
+                    w.write("LSTOP = .TRUE.\n")
 
     def _collect(self):
         """Collect information from output files of VASP.
@@ -1214,25 +1452,27 @@ class StructureOptimizationElement(TaskVasp, StructureOptimizationElementBase):
 
         """
 
-        if os.path.exists("POSCAR.yaml"):
-            self._atom_order = get_atom_order_from_poscar_yaml("POSCAR.yaml")
+        if os.path.exists(self._path("POSCAR.yaml")):
+            self._atom_order = get_atom_order_from_poscar_yaml(
+                self._path("POSCAR.yaml")
+            )
         else:
             self._atom_order = None
 
-        if os.path.exists("POSCAR"):
+        if os.path.exists(self._path("POSCAR")):
             masses = self.get_current_cell().get_masses()
-            cell = read_poscar("POSCAR")
+            cell = read_poscar(self._path("POSCAR"))
             if self._atom_order:
                 self._current_cell = change_point_order(cell, self._atom_order)
             else:
                 self._current_cell = cell
             self._current_cell.set_masses(masses)
 
-        if not os.path.exists("vasprun.xml"):
+        if find_file(self._path("vasprun.xml")) is None:
             self._log += "    vasprun.xml not exists.\n"
             self._status = "terminate"
         else:
-            with io.open("vasprun.xml", "rb") as f:
+            with open_file(find_file(self._path("vasprun.xml"))) as f:
                 vxml = VasprunxmlExpat(f)
                 is_success = vxml.parse()
 
@@ -1295,9 +1535,9 @@ class StructureOptimizationElement(TaskVasp, StructureOptimizationElementBase):
             masses=masses,
         )
 
-        if os.path.exists("CONTCAR"):
+        if os.path.exists(self._path("CONTCAR")):
             try:
-                self._current_cell = read_poscar("CONTCAR")
+                self._current_cell = read_poscar(self._path("CONTCAR"))
                 if self._atom_order:
                     self._current_cell = change_point_order(cell, self._atom_order)
                 else:
@@ -1687,7 +1927,13 @@ class TaskVaspPhonon:
                     job_disp = job[1]
             job = job_disp
 
-        task = ElectronicStructure(directory=directory, traverse=self._traverse)
+        # Only forces of the last ionic step are used. Energy and stress
+        # are kept for the yaml output.
+        task = ElectronicStructure(
+            directory=directory,
+            traverse=self._traverse,
+            properties=("forces", "energies", "stress"),
+        )
         task.set_configurations(
             cell=cell,
             pseudo_potential_map=self._pseudo_potential_map,
@@ -2039,15 +2285,16 @@ class ElasticConstantsElement(TaskVasp, ElasticConstantsElementBase):
 
         """
 
-        if not os.path.exists("OUTCAR"):
+        if find_file(self._path("OUTCAR")) is None:
             self._log += "    OUTCAR not exists.\n"
             self._status = "terminate"
         else:
-            outcar = Outcar("OUTCAR")
+            outcar = Outcar(self._path("OUTCAR"))
             if outcar.parse_elastic_constants():
                 self._elastic_constants = outcar.get_elastic_constants()
                 self._status = "done"
             else:
+                self._log += outcar.log
                 self._log += "    Failed to parse OUTCAR.\n"
                 self._status = "terminate"
 
@@ -2111,13 +2358,30 @@ class BornEffectiveCharge(TaskVasp, BornEffectiveChargeBase):
 
 
 class BornEffectiveChargeElement(TaskVasp, BornEffectiveChargeElementBase):
-    """ """
+    """Calculation of Born effective charges and dielectric constant by VASP
 
-    def __init__(self, directory="born_effective_charge", name=None, traverse=False):
+    Parameters
+    ----------
+    backend : str, optional
+        Output file parsed, "vasprun" (vasprun.xml) or "outcar" (OUTCAR).
+
+    """
+
+    def __init__(
+        self,
+        directory="born_effective_charge",
+        name=None,
+        traverse=False,
+        backend="vasprun",
+    ):
 
         BornEffectiveChargeElementBase.__init__(
             self, directory=directory, name=name, traverse=traverse
         )
+        if backend not in ("vasprun", "outcar"):
+            print("Backend %s is not supported." % backend)
+            raise RuntimeError
+        self._backend = backend
 
         self._pseudo_potential_map = None
         self._k_mesh = None
@@ -2128,34 +2392,50 @@ class BornEffectiveChargeElement(TaskVasp, BornEffectiveChargeElementBase):
         self._copy_files = []
 
     def _collect(self):
-        """Collect information from vasprun.xml
+        """Collect information from vasprun.xml or OUTCAR
 
         self._status of "done" or "terminate"  is stored.
         self._log: Terminate log is stored.
 
         """
 
-        if not os.path.exists("vasprun.xml"):
-            self._log += "    vasprun.xml not exists.\n"
+        if self._backend == "outcar":
+            filename = "OUTCAR"
+        else:
+            filename = "vasprun.xml"
+
+        if find_file(self._path(filename)) is None:
+            self._log += "    %s not exists.\n" % filename
             self._status = "terminate"
         else:
-            with io.open("vasprun.xml", "rb") as f:
-                vxml = VasprunxmlExpat(f)
-                is_success = vxml.parse()
-            if is_success:
-                born = vxml.get_born()
-                epsilon = vxml.get_epsilon()
+            if self._backend == "outcar":
+                outcar = Outcar(self._path("OUTCAR"))
+                is_success = outcar.parse(fields=("born_charges", "epsilon"))
+                if is_success:
+                    born = outcar.get_born_charges()
+                    epsilon = outcar.get_epsilon()
+                else:
+                    self._log += outcar.log
+            else:
+                with open_file(find_file(self._path("vasprun.xml"))) as f:
+                    vxml = VasprunxmlExpat(f)
+                    is_success = vxml.parse()
+                if is_success:
+                    born = vxml.get_born()
+                    epsilon = vxml.get_epsilon()
 
             if is_success and born is not None and epsilon is not None:
-                if os.path.exists("POSCAR.yaml"):
-                    atom_order = get_atom_order_from_poscar_yaml("POSCAR.yaml")
+                if os.path.exists(self._path("POSCAR.yaml")):
+                    atom_order = get_atom_order_from_poscar_yaml(
+                        self._path("POSCAR.yaml")
+                    )
                     self._born = born[atom_order]
                 else:
                     self._born = born
                 self._epsilon = epsilon
                 self._status = "done"
             else:
-                self._log += "    Failed to parse vasprun.xml for\n"
+                self._log += "    Failed to parse %s for\n" % filename
                 self._log += "    Born effective charge and dielectric constant"
                 self._log += ".\n"
                 self._status = "terminate"
@@ -1,9 +1,14 @@
+import concurrent.futures
 import datetime
+import heapq
+import json
 import os
-import time
 
 import yaml
 
+from cogue.controller.poller import AdaptivePoller
+from cogue.controller.state_store import StateStore
+from cogue.controller.writers import EventLog, write_atomically
 from cogue.qsystem.queue import EmptyQueue
 from cogue.task import TaskSet
 
@@ -12,6 +17,19 @@ def date():
     return datetime.datetime.today().strftime("%Y-%m-%d %H:%M:%S")
 
 
+def _finish_task(task):
+    """Set status of task whose job finished and collect its results.
+
+    This is executed in a worker of thread or process pool.
+
+    """
+    task.set_status()
+    if task.done():
+        for _ in task:
+            pass
+    return task
+
+
 class AutoCalc:
     def __init__(self, name=None, log_name=None, verbose=False):
         if name is None:
@@ -31,11 +49,49 @@ class AutoCalc:
         self._cwd = None
         self._verbose = verbose
         self._dot_count = 1
-        self._log = []
+        self._log = EventLog()
+        self._tid2status = {}
+        self._is_status_changed = True
+        self._num_status_changes = 0
+        self._poller = None
+
+        # Index of task tree used by event driven mode
+        self._tid2task = {}
+        self._tid2parent = {}
+        self._tid2depth = {}
+        self._tid2dir = {}
+        self._tid2key = {}
+        self._dirty_tids = set()
+        self._monitored_tids = set()
+
+        self._state_store = None
+        self._num_resumed = 0
+
+        self._executor = None
+        self._finished_tasks = []
 
     def set_queue(self, queue):
         self._queue = queue
 
+    def set_state_store(self, filename=None):
+        """Record state of tasks in SQLite database to resume later
+
+        When AutoCalc is restarted with the same task tree and the same
+        database, tasks whose jobs were already submitted are not
+        prepared again. They are reattached to the jobs in queueing
+        system, or collected when their jobs have finished. Cycles are
+        repeated without waiting until no more tasks are resumed.
+
+        Parameters
+        ----------
+        filename : str
+            Database file. Default is "%s.sqlite" % name.
+
+        """
+        if filename is None:
+            filename = "%s.sqlite" % self._name
+        self._state_store = StateStore(os.path.abspath(filename))
+
     def append(self, directory, task):
         """Append task to autocalc instance
 
@@ -60,55 +116,203 @@ class AutoCalc:
     def get_tasks(self):
         return [x.get_tasks()[0] for x in self._taskset.get_tasks()]
 
-    def run(self, check_period=10):  # in second
+    def set_parallel_collection(self, max_workers=None, executor="thread"):
+        """Collect results of finished jobs in parallel
+
+        Execution tasks whose jobs finished in a cycle are not collected
+        when they are visited. Their ``set_status`` and ``next`` (where
+        output files are parsed) are executed in a pool after the visit
+        of tasks, and the results are merged back in the order of tids.
+        Then their parents are visited again.
+
+        Parameters
+        ----------
+        max_workers : int
+            Number of workers. See concurrent.futures.
+        executor : str
+            "thread" or "process". With "process", tasks are pickled to
+            and from worker processes.
+
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+        if executor == "thread":
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers
+            )
+        elif executor == "process":
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers
+            )
+        else:
+            print("Executor has to be 'thread' or 'process'.")
+            raise RuntimeError
+
+    def run(
+        self,
+        check_period=10,
+        event_driven=False,
+        max_check_period=None,
+        backoff=2.0,
+        wake_on_signal=False,
+    ):  # in second
+        """Run tasks until all of them are done or terminated.
+
+        Parameters
+        ----------
+        check_period : int or float
+            Interval in seconds between cycles.
+        event_driven : bool
+            When True, only tasks whose job state changed in the latest
+            qstat, tasks that have just begun, running tasks requiring
+            monitoring (see TaskBase), and parents of tasks whose
+            status changed are revisited in each cycle instead of walking
+            the whole task tree. ``.coguerc`` files are read only when
+            the task in the directory is revisited.
+        max_check_period : int or float
+            When given, the interval is extended by ``backoff`` after each
+            cycle where no task changed status, up to this value, and
+            reset to ``check_period`` after a cycle with changes. Waiting
+            is interrupted when file "%s.wake" % name is created in the
+            current directory. See AdaptivePoller.
+        backoff : float
+            Factor to extend interval.
+        wake_on_signal : bool
+            Waiting is also interrupted by SIGUSR1.
+
+        """
+        self._poller = AdaptivePoller(
+            min_period=check_period,
+            max_period=max_check_period,
+            backoff=backoff,
+            wake_file=os.path.abspath("%s.wake" % self._name),
+            use_signal=wake_on_signal,
+        )
         self._begin()
 
         while True:
+            if self._num_resumed:
+                self._num_resumed = 0
+            else:
+                self._poller.wait()
             self._queue.qstat()
-            time.sleep(check_period)
             self._log.append("-" * 40 + "> %s" % date())
-            self._deep_run(self._taskset)
+            self._num_status_changes = 0
+            if event_driven:
+                self._run_dirty_tasks()
+            else:
+                self._deep_run(self._taskset)
+            self._collect_finished_tasks()
+            self._submit_queued_tasks()
             self._overwrite_settings()
+            self._poller.notify(self._num_status_changes)
+            self._log.append(
+                "%d status changes, next check in %s s, poll rate %s /min"
+                % (
+                    self._num_status_changes,
+                    self._poller.get_period(),
+                    self._get_poll_rate_str(),
+                )
+            )
             self._log.append("<" + "-" * 40 + " %s" % date())
             self._write_log()
             self._write_dot()
             self._write_qstatus()
+            if self._state_store is not None:
+                self._state_store.commit()
             if self._taskset.done():
                 break
 
         self._end()
 
+    def get_poll_rate(self):
+        """Return number of qstat polls per minute over recent cycles."""
+        if self._poller is None:
+            return None
+        else:
+            return self._poller.get_poll_rate()
+
+    def _get_poll_rate_str(self):
+        poll_rate = self.get_poll_rate()
+        if poll_rate is None:
+            return "-"
+        else:
+            return "%.2f" % poll_rate
+
     def _begin(self):
         self._cwd = os.getcwd()
+        if self._verbose > 1:
+            self._log = EventLog("%s.log" % self._log_name)
+        if self._state_store is not None:
+            self._tid_count = self._state_store.get_max_tid() + 1
         self._deep_begin(self._taskset)
 
     def _end(self):
-        os.chdir(self._cwd)
+        self._log.close()
+        self._poller.close()
+        if self._state_store is not None:
+            self._state_store.close()
+            self._state_store = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _deep_begin(self, task, parent=None, index=0):
+        """Begin task and its subtasks.
+
+        Directories of tasks are given to tasks explicitly by
+        ``set_work_dir`` as absolute paths. The current directory is
+        changed only while ``begin`` of a task requiring it is called.
 
-    def _deep_begin(self, task):
+        """
         directory = task.get_directory()
-        if directory is not None:
-            if not os.path.exists(directory):
-                os.mkdir(directory)
-
-        cwd = self._chdir_in(directory)
-
-        task.set_tid(self._tid_count)
+        if parent is None:
+            parent_dir = "."
+        else:
+            parent_dir = self._tid2dir[parent.get_tid()]
+        if directory is None:
+            task_dir = parent_dir
+        else:
+            task_dir = os.path.normpath(os.path.join(parent_dir, directory))
+        work_dir = os.path.join(self._cwd, task_dir)
+        if not os.path.exists(work_dir):
+            os.mkdir(work_dir)
+
+        key = self._get_task_key(directory, parent, index)
+        jobid = None
+        tid = None
+        if self._state_store is not None:
+            jobid = self._state_store.get_jobid(key)
+            tid = self._state_store.get_tid(key)
+        if tid is None:
+            tid = self._tid_count
+            self._tid_count += 1
+        task.set_tid(tid)
+        task.set_work_dir(work_dir)
+        self._tid2key[tid] = key
+        self._register_tid(task, parent, task_dir)
+        self._log_in(task)
         task.overwrite_settings()
 
-        self._tid_count += 1
-        task.begin()
-        subtasks = task.get_tasks()
-        if subtasks:  # Task-set
-            for subtask in task.get_tasks():
-                self._deep_begin(subtask)
-        else:  # Execution task
-            self._queue.register(task)
+        if jobid is not None and task.get_traverse() is False:
+            # Job was submitted before restart. Input files are kept.
+            self._call_in_work_dir(task, task.resume)
+            self._queue.reattach(task, jobid)
+            self._num_resumed += 1
+        else:
+            self._call_in_work_dir(task, task.begin)
+            subtasks = task.get_tasks()
+            if subtasks:  # Task-set
+                for i, subtask in enumerate(task.get_tasks()):
+                    self._deep_begin(subtask, parent=task, index=i)
+            else:  # Execution task
+                self._queue.register(task)
 
-        self._chdir_out(cwd, task.get_status())
+        self._log_out(task)
+        self._record_state(task)
 
     def _deep_run(self, task):
-        orig_cwd = self._chdir_in(task.get_directory())
+        self._log_in(task)
         task.overwrite_settings()
 
         subtasks = task.get_tasks()
@@ -118,38 +322,211 @@ class AutoCalc:
                     self._deep_run(subtask)
         else:  # Execution task
             self._queue.submit(task)
+            if self._defer_collection(task):
+                self._log_out(task)
+                return
 
         task.set_status()
         if task.done():
-            for next_taskset in task:
-                for next_task in next_taskset:
-                    self._deep_begin(next_task)
-                break
+            self._begin_next_tasks(task)
 
         log = task.get_log().rstrip()
         if log:
             self._log.append(log)
             task.set_log("")
 
-        self._chdir_out(orig_cwd, task.get_status())
+        self._log_out(task)
+        self._record_state(task)
+
+    def _defer_collection(self, task):
+        """Put task whose job finished to pool of collection if exists."""
+        if self._executor is None or task.requires_cwd():
+            return False
+        if task.get_traverse() is not False:
+            return False
+        if task.get_job().get_status() != "done":
+            return False
+        self._finished_tasks.append(task)
+        return True
+
+    def _collect_finished_tasks(self):
+        if not self._finished_tasks:
+            return
+        tasks = sorted(self._finished_tasks, key=lambda t: t.get_tid())
+        self._finished_tasks = []
+        self._log.append("Collect results of %d tasks." % len(tasks))
+        parent_tids = set()
+        for task, result in zip(tasks, self._executor.map(_finish_task, tasks)):
+            if result is not task:  # Returned from other process
+                task.__dict__.update(result.__dict__)
+            tid = task.get_tid()
+            self._log.append("    %s [ %s ]" % (self._tid2dir[tid], task.get_status()))
+            log = task.get_log().rstrip()
+            if log:
+                self._log.append(log)
+                task.set_log("")
+            self._record_state(task)
+            if self._tid2parent[tid] is not None:
+                parent_tids.add(self._tid2parent[tid])
+        self._run_tasks(parent_tids)
+
+    def _begin_next_tasks(self, task):
+        try:
+            next_taskset = self._call_in_work_dir(task, lambda: next(task))
+        except StopIteration:
+            return
+        for i, next_task in enumerate(next_taskset):
+            self._deep_begin(next_task, parent=task, index=i)
+
+    def _call_in_work_dir(self, task, method):
+        if not task.requires_cwd():
+            return method()
+        os.chdir(task.get_work_dir())
+        try:
+            return method()
+        finally:
+            os.chdir(self._cwd)
+
+    def _submit_queued_tasks(self):
+        """Submit jobs waiting in queue at once and update their tasks."""
+        for tid in self._queue.flush():
+            task = self._tid2task[tid]
+            self._log_in(task)
+            self._call_in_work_dir(task, task.set_status)
+            self._log_out(task)
+            self._record_state(task)
+
+    def _get_task_key(self, directory, parent, index):
+        """Return key of task stable over restarts of AutoCalc.
+
+        Directory path relative to the project directory is used. Tasks
+        without directory are distinguished by their order among siblings.
 
-    def _chdir_in(self, directory_in):
-        if directory_in is None:
-            return None
+        """
+        if parent is None:
+            parent_key = "."
+        else:
+            parent_key = self._tid2key[parent.get_tid()]
+        if directory is None:
+            return "%s/[%d]" % (parent_key, index)
+        else:
+            return os.path.normpath(os.path.join(parent_key, directory))
+
+    def _record_state(self, task):
+        tid = task.get_tid()
+        status = task.get_status()
+        if tid not in self._tid2status or self._tid2status[tid] != status:
+            self._tid2status[tid] = status
+            self._is_status_changed = True
+            self._num_status_changes += 1
+            if status and "running" in status and task.requires_monitoring():
+                self._monitored_tids.add(tid)
+            else:
+                self._monitored_tids.discard(tid)
+
+        if self._state_store is None:
+            return
+        key = self._tid2key[tid]
+        self._state_store.set_status(key, tid, status)
+        jobid = self._queue.get_jobid(tid)
+        if jobid is not None:
+            self._state_store.set_jobid(key, tid, jobid)
+
+    def _register_tid(self, task, parent, task_dir):
+        """Store the place of task in task tree.
+
+        ``task_dir`` is the directory of task relative to the project
+        directory.
+
+        """
+        tid = task.get_tid()
+        self._tid2task[tid] = task
+        self._tid2dir[tid] = task_dir
+        if parent is None:
+            self._tid2parent[tid] = None
+            self._tid2depth[tid] = 0
         else:
-            cwd = os.getcwd()
-            os.chdir(directory_in)
-            self._log.append("--> %s" % os.getcwd().replace(self._cwd, "").lstrip("/"))
-            return cwd
-
-    def _chdir_out(self, cwd, status):
-        if cwd is not None:
-            self._log.append("        [ %s ]" % status)
-            directory = cwd.replace(self._cwd, "").lstrip("/")
-            if directory == "":
-                directory = "."
-            self._log.append("    %s <--" % directory)
-            os.chdir(cwd)
+            parent_tid = parent.get_tid()
+            self._tid2parent[tid] = parent_tid
+            self._tid2depth[tid] = self._tid2depth[parent_tid] + 1
+        self._dirty_tids.add(tid)
+
+    def _run_dirty_tasks(self):
+        """Revisit only tasks whose state can have changed.
+
+        Dirty tasks are visited from the deepest in the task tree so that
+        parents are evaluated after their children in the same cycle.
+        Each task is visited at most once per cycle. Tasks begun or
+        marked dirty again during this cycle are visited in the next one.
+        Running tasks requiring monitoring are visited in every cycle.
+
+        """
+        dirty_tids = (
+            self._dirty_tids | self._queue.get_changed_tids() | self._monitored_tids
+        )
+        self._dirty_tids = set()
+        self._run_tasks(dirty_tids)
+
+    def _run_tasks(self, tids):
+        """Visit tasks and their ancestors whose status can change."""
+        heap = [(-self._tid2depth[tid], tid) for tid in tids]
+        heapq.heapify(heap)
+        visited = set()
+        while heap:
+            _, tid = heapq.heappop(heap)
+            if tid in visited:
+                continue
+            visited.add(tid)
+            task = self._tid2task[tid]
+            if task.done() and self._tid2parent[tid] is not None:
+                continue
+
+            status = task.get_status()
+            self._run_task(task)
+            parent_tid = self._tid2parent[tid]
+            if parent_tid is None:
+                continue
+            if task.get_status() != status or task.done():
+                if parent_tid in visited:
+                    self._dirty_tids.add(parent_tid)
+                else:
+                    heapq.heappush(heap, (-self._tid2depth[parent_tid], parent_tid))
+
+    def _run_task(self, task):
+        """Visit one task without descending into its subtasks."""
+        self._log_in(task)
+        task.overwrite_settings()
+
+        if not task.get_tasks():  # Execution task
+            self._queue.submit(task)
+            if self._defer_collection(task):
+                self._log_out(task)
+                return
+
+        task.set_status()
+        if task.done():
+            self._begin_next_tasks(task)
+
+        log = task.get_log().rstrip()
+        if log:
+            self._log.append(log)
+            task.set_log("")
+
+        self._log_out(task)
+        self._record_state(task)
+
+    def _log_in(self, task):
+        if task.get_directory() is not None:
+            self._log.append("--> %s" % self._tid2dir[task.get_tid()])
+
+    def _log_out(self, task):
+        if task.get_directory() is not None:
+            self._log.append("        [ %s ]" % task.get_status())
+            parent_tid = self._tid2parent[task.get_tid()]
+            if parent_tid is None:
+                self._log.append("    . <--")
+            else:
+                self._log.append("    %s <--" % self._tid2dir[parent_tid])
 
     def _overwrite_settings(self):
         """'max_jobs' is updated by making a file.
@@ -178,15 +555,18 @@ class AutoCalc:
             os.rename("%s" % filename, "%s.done" % filename)
 
     def _write_log(self):
-        if self._verbose > 1:
-            with open("%s.log" % self._log_name, "a") as w:
-                w.write("\n".join(self._log))
-                w.write("\n")
-                self._log = []
+        self._log.flush()
 
     def _write_dot(self):
-        if self._verbose:
-            with open("%s.dot" % self._log_name, "w") as f_dot:
+        """Write dot file and status snapshot when status of a task changed.
+
+        The status snapshot "%s.status.jsonl" % log_name has one JSON
+        object per task in each line.
+
+        """
+        if self._verbose and self._is_status_changed:
+            filename = "%s.dot" % self._log_name
+            with open("%s.tmp" % filename, "w") as f_dot:
                 self._dot_count += 1
                 f_dot.write(
                     "digraph %s {\n" % self._name.replace("-", "_").replace(".", "_")
@@ -196,6 +576,25 @@ class AutoCalc:
                     self._write_dot_labels(task, f_dot)
                     self._write_dot_tids(task, f_dot)
                 f_dot.write("}\n")
+            os.replace("%s.tmp" % filename, filename)
+            write_atomically(
+                "%s.status.jsonl" % self._log_name, self._get_status_lines()
+            )
+        self._is_status_changed = False
+
+    def _get_status_lines(self):
+        for tid in sorted(self._tid2task):
+            task = self._tid2task[tid]
+            yield json.dumps(
+                {
+                    "tid": tid,
+                    "parent": self._tid2parent[tid],
+                    "directory": self._tid2dir[tid],
+                    "name": task.get_name(),
+                    "status": task.get_status(),
+                    "jobid": self._queue.get_jobid(tid),
+                }
+            )
 
     def _write_dot_labels(self, task, f_dot):
         tid = task.get_tid()
@@ -0,0 +1,104 @@
+"""Polling interval control of AutoCalc."""
+import collections
+import os
+import signal
+import threading
+import time
+
+
+class AdaptivePoller:
+    """Wait between AutoCalc cycles with adaptive interval
+
+    The interval is reset to ``min_period`` after a cycle where something
+    changed (submission, completion, or any status change of tasks), and
+    multiplied by ``backoff`` after each cycle without change up to
+    ``max_period``. Waiting is interrupted when ``wake_file`` appears
+    (the file is removed), or when SIGUSR1 is received if
+    ``use_signal`` is True. These can be triggered by epilogue of jobs.
+
+    Parameters
+    ----------
+    min_period : float
+        Shortest interval in seconds.
+    max_period : float
+        Longest interval in seconds. Default is ``min_period``, i.e.,
+        fixed interval.
+    backoff : float
+        Factor to extend interval.
+    wake_file : str
+        Path of file to wake up.
+    use_signal : bool
+        Wake up by SIGUSR1.
+
+    """
+
+    def __init__(
+        self,
+        min_period=10,
+        max_period=None,
+        backoff=2.0,
+        wake_file=None,
+        use_signal=False,
+    ):
+        self._min_period = min_period
+        if max_period is None:
+            self._max_period = min_period
+        else:
+            self._max_period = max(max_period, min_period)
+        self._backoff = backoff
+        self._wake_file = wake_file
+        self._period = min_period
+        self._poll_times = collections.deque(maxlen=100)
+        self._woken = threading.Event()
+        self._orig_handler = None
+        if use_signal:
+            self._orig_handler = signal.signal(signal.SIGUSR1, self._handle_signal)
+
+    def get_period(self):
+        return self._period
+
+    def get_poll_rate(self):
+        """Return number of polls per minute over recent polls."""
+        if len(self._poll_times) < 2:
+            return None
+        duration = self._poll_times[-1] - self._poll_times[0]
+        if duration <= 0:
+            return None
+        return (len(self._poll_times) - 1) * 60.0 / duration
+
+    def notify(self, num_changes):
+        """Update interval by number of changes in the last cycle."""
+        if num_changes:
+            self._period = self._min_period
+        else:
+            self._period = min(self._period * self._backoff, self._max_period)
+
+    def wait(self):
+        """Sleep for current interval unless woken up earlier."""
+        end = time.time() + self._period
+        while True:
+            if self._is_woken():
+                self._period = self._min_period
+                break
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            self._woken.wait(min(remaining, 1.0))
+        self._poll_times.append(time.time())
+
+    def close(self):
+        if self._orig_handler is not None:
+            signal.signal(signal.SIGUSR1, self._orig_handler)
+            self._orig_handler = None
+
+    def _is_woken(self):
+        if self._woken.is_set():
+            self._woken.clear()
+            return True
+        if self._wake_file is not None and os.path.exists(self._wake_file):
+            os.remove(self._wake_file)
+            return True
+        return False
+
+    def _handle_signal(self, signum, frame):
+        self._woken.set()
@@ -0,0 +1,134 @@
+"""Persistent store of AutoCalc state."""
+import datetime
+import re
+import sqlite3
+
+from cogue.qsystem.job import get_jobid_str
+
+
+class StateStore:
+    """SQLite database recording task status and job-ids
+
+    Tasks are identified by keys made of their directory paths relative
+    to the AutoCalc project directory so that a task tree rebuilt by a
+    restarted controller can be matched to the records. Job-ids are
+    committed as soon as they are recorded because they refer to jobs
+    living outside of this process. Status changes are committed at the
+    end of each AutoCalc cycle.
+
+    Tables
+    ------
+    tasks : key, tid, status, jobid
+        Latest state of each task.
+    transitions : key, tid, status, time
+        Append-only history of status changes.
+
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._connection = sqlite3.connect(filename)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks "
+            "(key TEXT PRIMARY KEY, tid INTEGER, status TEXT, jobid TEXT)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS transitions "
+            "(key TEXT, tid INTEGER, status TEXT, time TEXT)"
+        )
+        self._connection.commit()
+
+        self._records = {}
+        for key, tid, status, jobid in self._connection.execute(
+            "SELECT key, tid, status, jobid FROM tasks"
+        ):
+            self._records[key] = [tid, status, _str2jobid(jobid)]
+
+    def get_filename(self):
+        return self._filename
+
+    def get_tid(self, key):
+        if key in self._records:
+            return self._records[key][0]
+        else:
+            return None
+
+    def get_status(self, key):
+        if key in self._records:
+            return self._records[key][1]
+        else:
+            return None
+
+    def get_jobid(self, key):
+        if key in self._records:
+            return self._records[key][2]
+        else:
+            return None
+
+    def get_max_tid(self):
+        if self._records:
+            return max([r[0] for r in self._records.values()])
+        else:
+            return -1
+
+    def set_status(self, key, tid, status):
+        record = self._get_record(key, tid)
+        if record[1] == status:
+            return
+        record[1] = status
+        self._connection.execute(
+            "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?)",
+            (key, tid, status, _jobid2str(record[2])),
+        )
+        self._connection.execute(
+            "INSERT INTO transitions VALUES (?, ?, ?, ?)",
+            (key, tid, status, _now()),
+        )
+
+    def set_jobid(self, key, tid, jobid):
+        record = self._get_record(key, tid)
+        if record[2] == jobid:
+            return
+        record[2] = jobid
+        self._connection.execute(
+            "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?)",
+            (key, tid, record[1], _jobid2str(jobid)),
+        )
+        self._connection.commit()
+
+    def commit(self):
+        self._connection.commit()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+    def _get_record(self, key, tid):
+        if key not in self._records or self._records[key][0] != tid:
+            self._records[key] = [tid, None, None]
+        return self._records[key]
+
+
+def _now():
+    return datetime.datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _jobid2str(jobid):
+    if jobid is None:
+        return None
+    else:
+        return get_jobid_str(jobid)
+
+
+def _str2jobid(text):
+    if text is None:
+        return None
+    elif text.isdigit():
+        return int(text)
+    else:
+        m = re.match(r"^(\d+)\[(\d+)\]$", text)
+        if m:
+            return (int(m.group(1)), int(m.group(2)))
+        return text
@@ -0,0 +1,45 @@
+"""Writers of AutoCalc output files."""
+import os
+
+
+class EventLog:
+    """Append-only log file
+
+    Lines are written to the file as they are appended instead of being
+    accumulated in memory. When filename is None, lines are discarded.
+
+    """
+
+    def __init__(self, filename=None):
+        if filename is None:
+            self._file = None
+        else:
+            self._file = open(filename, "a")
+
+    def append(self, line):
+        if self._file is not None:
+            self._file.write(line)
+            self._file.write("\n")
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def write_atomically(filename, lines):
+    """Write lines to a temporary file and rename it to filename
+
+    Readers of the file never see partially written contents.
+
+    """
+    tmp_filename = "%s.tmp" % filename
+    with open(tmp_filename, "w") as w:
+        for line in lines:
+            w.write(line)
+            w.write("\n")
+    os.replace(tmp_filename, filename)
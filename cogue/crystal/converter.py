@@ -4,6 +4,7 @@ import sys
 import numpy as np
 
 from cogue.crystal.cell import Cell
+from cogue.crystal.neighbor_list import NeighborList
 from cogue.crystal.symmetry import get_crystallographic_cell, get_symmetry_dataset
 
 
@@ -11,41 +12,48 @@ from cogue.crystal.symmetry import get_crystallographic_cell, get_symmetry_datas
 # Generally usable functions #
 ##############################
 def reduce_points(tmat, cell, tolerance=1e-5):
-    """Reduce overlapping atomic points."""
-    lattice = cell.lattice
-    points_prim = []
-    symbols_prim = []
-    masses_prim = []
-    points = cell.get_points()
+    """Reduce overlapping atomic points.
+
+    Points are transformed to the basis of lattice * tmat and a point is
+    removed when one of the points kept before it is at a distance
+    shorter than tolerance. Overlapping pairs are found on a grid of
+    bins by NeighborList, so the cost grows linearly with the number of
+    points.
+
+    """
+    points = np.dot(np.linalg.inv(tmat), cell.get_points())
+    num_points = points.shape[1]
+    neighbor_list = NeighborList(
+        Cell(lattice=cell.lattice, points=points, symbols=cell.get_symbols()),
+        tolerance,
+    )
+    pairs, distances, _ = neighbor_list.get_pairs()
+    # Pairs of points and points before them, sorted by the former
+    pairs = pairs[(pairs[:, 1] < pairs[:, 0]) & (distances < tolerance)]
+
+    # Points overlapping with a point that overlaps nothing before it
+    # are removed. The rest is decided in order of points.
+    has_overlap = np.zeros(num_points, dtype=bool)
+    has_overlap[pairs[:, 0]] = True
+    is_kept = ~has_overlap
+    is_removed = np.zeros(num_points, dtype=bool)
+    is_removed[pairs[~has_overlap[pairs[:, 1]], 0]] = True
+    starts = np.searchsorted(pairs[:, 0], np.arange(num_points + 1))
+    for i in np.nonzero(has_overlap & ~is_removed)[0]:
+        is_kept[i] = not is_kept[pairs[starts[i] : starts[i + 1], 1]].any()
+
+    kept = np.nonzero(is_kept)[0]
     symbols = cell.get_symbols()
-    masses = cell.get_masses()
     magmoms = cell.get_magnetic_moments()
-    if magmoms is None:
-        magmoms_prim = None
-    else:
-        magmoms_prim = []
-
-    for i, p in enumerate(np.dot(np.linalg.inv(tmat), points).T):
-        is_different = True
-        for p_prim in points_prim:
-            diff = p_prim - p
-            diff -= diff.round()
-            if (np.linalg.norm(np.dot(lattice, diff)) < tolerance).all():
-                is_different = False
-                break
-        if is_different:
-            points_prim.append(p - np.floor(p))
-            symbols_prim.append(symbols[i])
-            masses_prim.append(masses[i])
-            if magmoms is not None:
-                magmoms_prim.append(magmoms[i])
+    if magmoms is not None:
+        magmoms = magmoms[kept]
 
     return Cell(
         lattice=np.dot(cell.lattice, tmat),
-        points=np.transpose(points_prim),
-        symbols=symbols_prim,
-        magmoms=magmoms_prim,
-        masses=masses_prim,
+        points=points[:, kept] - np.floor(points[:, kept]),
+        symbols=[symbols[i] for i in kept],
+        magmoms=magmoms,
+        masses=cell.get_masses()[kept],
     )
 
 
@@ -38,19 +38,13 @@ def reduce_bases(extended_bases, tolerance):
 
 
 def get_shortest_bases(extended_bases, tolerance):
-    def _cmp(a, b):
-        return (a > b) - (a < b)
-
-    def mycmp(x, y):
-        return _cmp(np.vdot(x, x), np.vdot(y, y))
-
     basis = np.zeros((7, 3), dtype=float)
     basis[:4] = extended_bases
     basis[4] = extended_bases[0] + extended_bases[1]
     basis[5] = extended_bases[1] + extended_bases[2]
     basis[6] = extended_bases[2] + extended_bases[0]
     # Sort bases by the lengthes (shorter is earlier)
-    basis = sorted(basis, cmp=mycmp)
+    basis = sorted(basis, key=lambda x: np.vdot(x, x))
 
     # Choose shortest and linearly independent three bases
     # This algorithm may not be perfect.
@@ -0,0 +1,181 @@
+"""Neighbor list of atoms under periodic boundary conditions
+
+Atoms are sorted into bins of a grid of fractional coordinates. The
+thickness of each bin is at least the cutoff distance, so neighbors of
+an atom are found in the bins next to its bin. A bin next to the edge
+of the grid is the bin at the other edge in the neighboring image of
+the cell, and images are replicated as far as the cutoff reaches for
+cells thinner than the cutoff. Candidates of pairs are collected for
+all atoms at once for each relative position of bins, so the cost grows
+linearly with the number of atoms at constant density.
+
+"""
+import numpy as np
+
+
+class NeighborList(object):
+    """Pairs of atoms within cutoff distance
+
+    Pairs are searched once and kept, so they are reused by calls of
+    get_pairs and get_neighbors with the same or smaller cutoff.
+
+    Parameters
+    ----------
+    cell : Cell
+        Crystal structure.
+    cutoff : float
+        Pairs at distances smaller than or equal to this are listed.
+
+    """
+
+    def __init__(self, cell, cutoff):
+        self._lattice = cell.get_lattice()
+        self._points = np.array(cell.get_points().T, dtype="double", order="C")
+        self._cutoff = cutoff
+        self._pairs = None
+        self._distances = None
+        self._offsets = None
+        self._first_atom_starts = None
+
+    def get_cutoff(self):
+        return self._cutoff
+
+    def get_pairs(self, cutoff=None):
+        """Return pairs of atoms within cutoff.
+
+        Each pair is listed in both orders, and an atom is paired with its
+        own images when they are within cutoff.
+
+        Parameters
+        ----------
+        cutoff : float, optional
+            Smaller than or equal to the cutoff given at initialization,
+            which is used when None.
+
+        Returns
+        -------
+        pairs : ndarray
+            Indices of first and second atoms sorted by first atoms,
+            shape=(pairs, 2), dtype=int.
+        distances : ndarray
+            Distances of pairs, shape=(pairs,).
+        offsets : ndarray
+            Lattice translations of second atoms. Vector from first atom i
+            to second atom j is lattice * (points[j] + offset - points[i]).
+            shape=(pairs, 3), dtype=int.
+
+        """
+        if self._pairs is None:
+            self._search()
+        if cutoff is None or cutoff >= self._cutoff:
+            self._check_cutoff(cutoff)
+            return self._pairs, self._distances, self._offsets
+        selected = self._distances <= cutoff
+        return (
+            self._pairs[selected],
+            self._distances[selected],
+            self._offsets[selected],
+        )
+
+    def get_neighbors(self, index, cutoff=None):
+        """Return neighbors of an atom.
+
+        Returns
+        -------
+        indices : ndarray
+            Indices of neighboring atoms, shape=(neighbors,), dtype=int.
+        distances : ndarray
+            Distances to neighbors, shape=(neighbors,).
+        offsets : ndarray
+            Lattice translations of neighbors, shape=(neighbors, 3).
+
+        """
+        if self._pairs is None:
+            self._search()
+        self._check_cutoff(cutoff)
+        start = self._first_atom_starts[index]
+        stop = self._first_atom_starts[index + 1]
+        distances = self._distances[start:stop]
+        if cutoff is None:
+            selected = slice(None)
+        else:
+            selected = distances <= cutoff
+        return (
+            self._pairs[start:stop, 1][selected],
+            distances[selected],
+            self._offsets[start:stop][selected],
+        )
+
+    def _check_cutoff(self, cutoff):
+        if cutoff is not None and cutoff > self._cutoff:
+            print("Cutoff has to be smaller than %f." % self._cutoff)
+            raise RuntimeError
+
+    def _search(self):
+        num_atom = len(self._points)
+        floors = np.floor(self._points)
+        points = self._points - floors
+
+        # Numbers of bins are chosen so that bins are thicker than cutoff
+        # and are not many more than atoms. Neighbors are within the range
+        # of bins "reach" along each axis.
+        thickness = 1.0 / np.sqrt((np.linalg.inv(self._lattice) ** 2).sum(axis=1))
+        mesh = np.maximum(np.floor(thickness / self._cutoff), 1)
+        if np.prod(mesh) > 8 * num_atom:
+            scale = (8.0 * num_atom / np.prod(mesh)) ** (1.0 / 3)
+            mesh = np.maximum(np.floor(mesh * scale), 1)
+        mesh = mesh.astype(int)
+        reach = np.ceil(self._cutoff / thickness * mesh).astype(int)
+
+        bins = np.minimum((points * mesh).astype(int), mesh - 1)
+        bin_indices = np.ravel_multi_index(bins.T, mesh)
+        atom_order = np.argsort(bin_indices, kind="stable")
+        counts = np.bincount(bin_indices, minlength=np.prod(mesh))
+        bin_starts = np.cumsum(counts) - counts
+
+        pairs = []
+        distances = []
+        offsets = []
+        for shift in np.ndindex(*(2 * reach + 1)):
+            neighbor_bins = bins + (np.array(shift) - reach)
+            images = np.floor_divide(neighbor_bins, mesh)
+            neighbor_indices = np.ravel_multi_index(
+                (neighbor_bins - images * mesh).T, mesh
+            )
+            num_candidates = counts[neighbor_indices]
+            first = np.repeat(np.arange(num_atom), num_candidates)
+            if len(first) == 0:
+                continue
+            positions = np.arange(len(first)) - np.repeat(
+                np.cumsum(num_candidates) - num_candidates, num_candidates
+            )
+            second = atom_order[
+                np.repeat(bin_starts[neighbor_indices], num_candidates) + positions
+            ]
+            image = images[first]
+            vectors = np.dot(points[second] + image - points[first], self._lattice.T)
+            lengths = np.sqrt((vectors**2).sum(axis=1))
+            selected = lengths <= self._cutoff
+            selected &= (first != second) | (image != 0).any(axis=1)
+            first = first[selected]
+            second = second[selected]
+            pairs.append(np.transpose([first, second]))
+            distances.append(lengths[selected])
+            # Translations relative to points given without wrapping
+            offsets.append(image[selected] - floors[second] + floors[first])
+
+        if pairs:
+            pairs = np.vstack(pairs)
+            distances = np.hstack(distances)
+            offsets = np.rint(np.vstack(offsets)).astype(int)
+        else:
+            pairs = np.zeros((0, 2), dtype=int)
+            distances = np.zeros(0, dtype="double")
+            offsets = np.zeros((0, 3), dtype=int)
+        order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+        self._pairs = pairs[order]
+        self._distances = distances[order]
+        self._offsets = offsets[order]
+        self._first_atom_starts = np.searchsorted(
+            self._pairs[:, 0], np.arange(num_atom + 1)
+        )
@@ -1,31 +1,154 @@
+"""Shortest distances between atoms under periodic boundary conditions
+
+The lattice is Delaunay reduced once and the shortest distance of each
+pair is searched among the 27 images of its difference vector in the
+reduced basis. Pairs are processed by blocks of rows with numpy
+broadcasting, so memory use is bounded by ``max_block_size``.
+
+"""
 import numpy as np
 
 from cogue.crystal.delaunay import get_Delaunay_reduction
 
+# Lattice translations to neighboring cells, shape=(27, 3)
+_image_translations = np.array(
+    [[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)],
+    dtype=float,
+)
+
+# Number of image distances computed at once (rows * columns * 27)
+max_block_size = 1 << 22
+
 
 def get_pair_distances(cell, tolerance=1e-5):
-    positions = cell.get_points().T
-    num_atom = len(positions)
-    distances = np.zeros((num_atom, num_atom), dtype=float)
-    for i, p1 in enumerate(positions):
-        for j, p2 in enumerate(positions):
-            distances[i, j] = get_distance(cell.get_lattice(), p1, p2)
+    """Return shortest distances of all pairs of atoms.
+
+    Parameters
+    ----------
+    cell : Cell
+        Crystal structure.
+    tolerance : float
+        Tolerance of Delaunay reduction.
+
+    Returns
+    -------
+    ndarray
+        Distances, shape=(atoms, atoms).
+
+    """
+    reduced_lattice, points = _get_reduced_points(cell, tolerance)
+    num_atom = len(points)
+    distances = np.zeros((num_atom, num_atom), dtype="double")
+    for start, stop in _get_blocks(num_atom):
+        distances[start:stop] = _get_block_distances(
+            reduced_lattice, points[start:stop], points
+        )
     return distances
 
 
+def get_pair_distances_within(cell, cutoff, tolerance=1e-5):
+    """Return pairs of atoms whose shortest distances are within cutoff.
+
+    Only pairs of different atoms are returned once (first < second), so
+    memory use follows the number of pairs rather than atoms squared.
+    Computing time still grows with atoms squared. NeighborList in
+    cogue.crystal.neighbor_list scales linearly for large cells.
+
+    Parameters
+    ----------
+    cell : Cell
+        Crystal structure.
+    cutoff : float
+        Pairs at distances smaller than or equal to this are returned.
+    tolerance : float
+        Tolerance of Delaunay reduction.
+
+    Returns
+    -------
+    pairs : ndarray
+        Indices of atoms, shape=(pairs, 2), dtype=int.
+    distances : ndarray
+        Shortest distances of pairs, shape=(pairs,).
+
+    """
+    reduced_lattice, points = _get_reduced_points(cell, tolerance)
+    pairs = []
+    distances = []
+    for start, stop in _get_blocks(len(points)):
+        block = _get_block_distances(reduced_lattice, points[start:stop], points)
+        i, j = np.nonzero(block <= cutoff)
+        i += start
+        upper = i < j
+        pairs.append(np.transpose([i[upper], j[upper]]))
+        distances.append(block[i[upper] - start, j[upper]])
+    if pairs:
+        return np.vstack(pairs), np.hstack(distances)
+    else:
+        return np.zeros((0, 2), dtype=int), np.zeros(0, dtype="double")
+
+
 def get_distance(lattice, p1, p2, tolerance=1e-5):
     """Return shortest distance between a pair of atoms in PBC"""
-    shortest_bases = get_Delaunay_reduction(lattice, tolerance)
-    diff = np.dot(
-        np.dot(np.linalg.inv(shortest_bases), lattice), np.array(p1) - np.array(p2)
-    )
-    diff -= diff.round()
+    reduced_lattice = get_Delaunay_reduction(lattice, tolerance)
+    diff = np.linalg.solve(reduced_lattice, np.dot(lattice, np.subtract(p1, p2)))
+    distances = _get_block_distances(reduced_lattice, diff[None, :], np.zeros((1, 3)))
+    return distances[0, 0]
 
-    distances = []
-    for i in (-1, 0, 1):
-        for j in (-1, 0, 1):
-            for k in (-1, 0, 1):
-                distances.append(
-                    np.linalg.norm(np.dot(shortest_bases, diff + np.array([i, j, k])))
-                )
-    return min(distances)
+
+def get_distances(lattice, point, points, tolerance=1e-5):
+    """Return shortest distances from a point to points in PBC
+
+    Parameters
+    ----------
+    lattice : array_like
+        Basis vectors in columns, shape=(3, 3).
+    point : array_like
+        Fractional coordinates, shape=(3,).
+    points : array_like
+        Fractional coordinates, shape=(points, 3).
+
+    Returns
+    -------
+    ndarray
+        Distances, shape=(points,).
+
+    """
+    reduced_lattice = get_Delaunay_reduction(lattice, tolerance)
+    tmat = np.linalg.solve(reduced_lattice, lattice)
+    return _get_block_distances(
+        reduced_lattice,
+        np.dot(tmat, point)[None, :],
+        np.dot(np.reshape(points, (-1, 3)), tmat.T),
+    )[0]
+
+
+def _get_reduced_points(cell, tolerance):
+    """Return reduced lattice and points in its basis, shape=(atoms, 3)."""
+    lattice = cell.get_lattice()
+    reduced_lattice = get_Delaunay_reduction(lattice, tolerance)
+    points = np.linalg.solve(reduced_lattice, np.dot(lattice, cell.get_points()))
+    return reduced_lattice, np.array(points.T, dtype="double", order="C")
+
+
+def _get_blocks(num_atom):
+    num_rows = max(1, max_block_size // (27 * max(num_atom, 1)))
+    for start in range(0, num_atom, num_rows):
+        yield start, min(start + num_rows, num_atom)
+
+
+def _get_block_distances(reduced_lattice, points1, points2):
+    """Return shortest distances between points given in reduced basis.
+
+    Squared lengths of images |v + t|^2 are compared by expanding them to
+    |v|^2 + 2 v.t + |t|^2, and the shortest one is computed again from
+    its vector to avoid loss of digits of short distances.
+
+    """
+    diff = points1[:, None, :] - points2[None, :, :]
+    diff -= np.rint(diff)
+    vectors = np.dot(diff, reduced_lattice.T)
+    translations = np.dot(_image_translations, reduced_lattice.T)
+    lengths = 2 * np.dot(vectors, translations.T)
+    lengths += (translations**2).sum(axis=1)
+    shortest = vectors + translations[lengths.argmin(axis=2)]
+    return np.sqrt((shortest**2).sum(axis=2))
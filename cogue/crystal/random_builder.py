@@ -3,7 +3,7 @@ import random
 import numpy as np
 
 from cogue.crystal.cell import Cell
-from cogue.crystal.pair_distance import get_distance
+from cogue.crystal.pair_distance import get_distances
 
 
 class RandomBuilder:
@@ -51,7 +51,7 @@ class RandomBuilder:
         self._max_distance = max_distance
 
     def _shuffle(self, cell):
-        indices = range(len(cell.get_symbols()))
+        indices = list(range(len(cell.get_symbols())))
         random.shuffle(indices)
         points = np.zeros(cell.get_points().shape, dtype=float)
         for i, j in enumerate(indices):
@@ -81,14 +81,10 @@ class RandomBuilder:
         while True:
             x = [random.random(), random.random(), random.random()]
 
-            all_ok = True
-            for p in points:
-                d = get_distance(lattice, x, p)
-                if d < self._min_distance or d > self._max_distance:
-                    all_ok = False
-                    break
-
-            if all_ok:
+            distances = get_distances(lattice, x, points)
+            if (distances >= self._min_distance).all() and (
+                distances <= self._max_distance
+            ).all():
                 return x
 
             attempt += 1
@@ -2,91 +2,164 @@
 import numpy as np
 
 from cogue.crystal.cell import Cell
-from cogue.crystal.converter import reduce_points
 from cogue.crystal.symmetry import get_symmetry_dataset
 from cogue.crystal.utility import get_lattice_parameters
 
 
+class Supercell(Cell):
+    """Supercell with maps to atoms of unit cell
+
+    Point of atom i of supercell is the point of atom
+    unitcell_indices[i] of unit cell translated by lattice_points[i].
+
+    """
+
+    def __init__(
+        self,
+        lattice=None,
+        points=None,
+        symbols=None,
+        magmoms=None,
+        masses=None,
+        unitcell_indices=None,
+        lattice_points=None,
+    ):
+        Cell.__init__(
+            self,
+            lattice=lattice,
+            points=points,
+            symbols=symbols,
+            magmoms=magmoms,
+            masses=masses,
+        )
+        self._unitcell_indices = np.array(unitcell_indices, dtype="intc")
+        self._lattice_points = np.array(lattice_points, dtype="intc")
+
+    def get_unitcell_indices(self):
+        """Return indices of atoms of unit cell, shape=(atoms,)."""
+        return self._unitcell_indices
+
+    def get_lattice_points(self):
+        """Return translations in fractional coordinates of unit cell.
+
+        Returns
+        -------
+        ndarray
+            Integer vectors, shape=(atoms, 3).
+
+        """
+        return self._lattice_points
+
+
 def get_supercell(cell, supercell_matrix, tolerance=1e-5):
     """Build supercell with supercell matrix.
 
-    1) Create supercell with surrounding simple lattice.
-    2) Trim the surrounding supercell with the target lattice.
+    Lattice of supercell is lattice * supercell_matrix. Atoms are ordered
+    by atoms of unit cell and then by lattice points. For diagonal
+    supercell matrix, the first index of lattice points changes fastest.
+    Otherwise lattice points in supercell are enumerated by Hermite
+    normal form of supercell matrix and points are wrapped into
+    supercell.
+
+    Parameters
+    ----------
+    cell : Cell
+        Unit cell.
+    supercell_matrix : array_like
+        Non-singular integer matrix, shape=(3, 3).
+    tolerance : float
+        Not used. Overlapping points are not searched any more.
+
+    Returns
+    -------
+    Supercell
+        Supercell with maps to atoms of unit cell.
 
     """
     smat = np.array(supercell_matrix)
-    frame = _get_smallest_surrounding_lattice_multiplicities(smat)
-    surrounding_cell = _get_simple_supercell(frame, cell)
-    if (np.diag(np.diagonal(smat)) == smat).all():
-        return surrounding_cell
-
-    transformation_matrix = np.array(
-        [
-            smat[0] / float(frame[0]),
-            smat[1] / float(frame[1]),
-            smat[2] / float(frame[2]),
-        ]
-    )
-    supercell = reduce_points(transformation_matrix, surrounding_cell, tolerance)
-    return supercell
+    if (np.abs(smat - np.rint(smat)) > 1e-8).any():
+        print("Supercell matrix has to be an integer matrix.")
+        raise RuntimeError
+    smat = np.array(np.rint(smat), dtype=int)
+    if abs(np.linalg.det(smat)) < 0.5:
+        print("Supercell matrix is singular.")
+        raise RuntimeError
+
+    multi = np.diagonal(smat)
+    if (np.diag(multi) == smat).all() and (multi > 0).all():
+        return _get_simple_supercell(multi, cell)
+    hnf = _get_hermite_normal_form(smat)
+    return _get_supercell(cell, smat, _get_grid_points(np.diagonal(hnf)))
 
 
 def _get_simple_supercell(multi, cell):
-    lattice = cell.lattice
-    points = cell.get_points()
-    masses = cell.get_masses()
-    magmoms = cell.get_magnetic_moments()
-    symbols = cell.get_symbols()
+    smat = np.diag(np.array(multi, dtype=int))
+    return _get_supercell(cell, smat, _get_grid_points(multi), is_diagonal=True)
+
+
+def _get_supercell(cell, smat, lattice_points, is_diagonal=False):
+    """Return supercell of points of cell translated by lattice points.
 
-    points_scell = []
-    symbols_scell = []
-    masses_scell = []
-    if magmoms is None:
-        magmoms_scell = None
+    Lattice points are given in fractional coordinates of cell,
+    shape=(lattice points, 3). Points are wrapped into supercell unless
+    supercell matrix is diagonal.
+
+    """
+    points = cell.get_points().T
+    num_atom = len(points)
+    num_lattice_points = len(lattice_points)
+    unitcell_indices = np.repeat(np.arange(num_atom), num_lattice_points)
+    lattice_points = np.tile(lattice_points, (num_atom, 1))
+    unit_points = points[unitcell_indices] + lattice_points
+    if is_diagonal:
+        points_scell = unit_points / np.diagonal(smat)
     else:
-        magmoms_scell = []
-    for i_atom, pos in enumerate(points.T):
-        for i in range(multi[2]):
-            for j in range(multi[1]):
-                for k in range(multi[0]):
-                    points_scell.append(
-                        [
-                            (pos[0] + k) / multi[0],
-                            (pos[1] + j) / multi[1],
-                            (pos[2] + i) / multi[2],
-                        ]
-                    )
-                    symbols_scell.append(symbols[i_atom])
-                    masses_scell.append(masses[i_atom])
-                    if magmoms is not None:
-                        magmoms_scell.append(magmoms[i_atom])
-
-    return Cell(
-        lattice=np.dot(lattice, np.diag(multi)),
-        points=np.transpose(points_scell),
-        symbols=symbols_scell,
-        masses=masses_scell,
-        magmoms=magmoms_scell,
+        points_scell = np.dot(unit_points, np.linalg.inv(smat).T)
+        shifts = np.floor(points_scell)
+        points_scell -= shifts
+        lattice_points -= np.rint(np.dot(shifts, smat.T)).astype(int)
+
+    symbols = cell.get_symbols()
+    magmoms = cell.get_magnetic_moments()
+    if magmoms is not None:
+        magmoms = magmoms[unitcell_indices]
+
+    return Supercell(
+        lattice=np.dot(cell.lattice, smat),
+        points=points_scell.T,
+        symbols=[symbols[i] for i in unitcell_indices],
+        masses=cell.get_masses()[unitcell_indices],
+        magmoms=magmoms,
+        unitcell_indices=unitcell_indices,
+        lattice_points=lattice_points,
     )
 
 
-def _get_smallest_surrounding_lattice_multiplicities(supercell_matrix):
-    """Build a frame surrounding supercell lattice."""
-    m = np.array(supercell_matrix)
-    axes = np.array(
-        [
-            [0, 0, 0],
-            m[:, 0],
-            m[:, 1],
-            m[:, 2],
-            m[:, 1] + m[:, 2],
-            m[:, 2] + m[:, 0],
-            m[:, 0] + m[:, 1],
-            m[:, 0] + m[:, 1] + m[:, 2],
-        ]
-    )
-    frame = [max(axes[:, i]) - min(axes[:, i]) for i in (0, 1, 2)]
-    return frame
+def _get_grid_points(mesh):
+    """Return integer points of grid with the first index changing fastest."""
+    grid = np.indices(np.array(mesh)[::-1]).reshape(3, -1).T
+    return np.array(grid[:, ::-1], dtype=int, order="C")
+
+
+def _get_hermite_normal_form(smat):
+    """Return lower triangular H = smat * U with unimodular U.
+
+    Diagonal elements of H are positive. Integer points in the box of
+    the diagonal elements represent lattice points of supercell.
+
+    """
+    hnf = np.array(smat, dtype=int)
+    for i in range(3):
+        # Euclid's algorithm by operations of columns
+        while (hnf[i, i + 1 :] != 0).any():
+            nonzero = [j for j in range(i, 3) if hnf[i, j] != 0]
+            k = min(nonzero, key=lambda j: abs(hnf[i, j]))
+            hnf[:, [i, k]] = hnf[:, [k, i]]
+            for j in range(i + 1, 3):
+                hnf[:, j] -= (hnf[i, j] // hnf[i, i]) * hnf[:, i]
+        if hnf[i, i] < 0:
+            hnf[:, i] *= -1
+    return hnf
 
 
 def estimate_supercell_matrix(cell, max_num_atoms=120, symprec=1e-5):
@@ -0,0 +1,98 @@
+"""Transparent reading and in-place compression of output files
+
+Output files such as vasprun.xml and OUTCAR may be stored compressed
+by gzip (.gz), xz (.xz) or zstandard (.zst). ``find_file`` returns the
+plain file if it exists, otherwise its compressed version, and
+``open_file`` decompresses it on the fly while reading. zstandard
+requires the zstandard package.
+
+"""
+import gzip
+import io
+import lzma
+import os
+import shutil
+
+compression_suffixes = {"gz": ".gz", "xz": ".xz", "zst": ".zst"}
+
+
+def find_file(filename):
+    """Return path of file or of its compressed version, or None."""
+    if os.path.exists(filename):
+        return filename
+    for suffix in compression_suffixes.values():
+        if os.path.exists(filename + suffix):
+            return filename + suffix
+    return None
+
+
+def get_compression(filename):
+    """Return compression of file found by its suffix, or None."""
+    for compression, suffix in compression_suffixes.items():
+        if filename.endswith(suffix):
+            return compression
+    return None
+
+
+def open_file(filename, mode="rb"):
+    """Open plain or compressed file for reading.
+
+    Parameters
+    ----------
+    filename : str
+        Compression is chosen by suffix of the file name.
+    mode : str
+        "rb" or "r" (text).
+
+    """
+    compression = get_compression(filename)
+    if compression is None:
+        return open(filename, mode)
+
+    if compression == "gz":
+        f = gzip.open(filename, "rb")
+    elif compression == "xz":
+        f = lzma.open(filename, "rb")
+    else:
+        import zstandard
+
+        f = io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"))
+        )
+
+    if "b" in mode:
+        return f
+    else:
+        return io.TextIOWrapper(f)
+
+
+def compress_file(filename, compression="gz"):
+    """Replace file by its compressed version and return its path.
+
+    Modification time of the file is kept.
+
+    """
+    compressed = filename + compression_suffixes[compression]
+    tmp_filename = compressed + ".tmp"
+    if compression == "gz":
+        dst = gzip.open(tmp_filename, "wb")
+    elif compression == "xz":
+        dst = lzma.open(tmp_filename, "wb")
+    else:
+        import zstandard
+
+        dst = zstandard.ZstdCompressor().stream_writer(open(tmp_filename, "wb"))
+
+    try:
+        with open(filename, "rb") as src, dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    except:  # noqa E722
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+    st = os.stat(filename)
+    os.utime(tmp_filename, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp_filename, compressed)
+    os.remove(filename)
+    return compressed
@@ -0,0 +1,150 @@
+"""Binary cache of results parsed from output files
+
+Arrays parsed from a file, e.g., vasprun.xml, are stored in an
+uncompressed npz file next to it ("vasprun.xml.npz"). The cache is
+valid while size and modification time of the source file and SHA-1
+digest of its head and tail blocks are unchanged. Arrays are memory
+mapped from the npz file, so loading costs little even for large
+eigenvalue arrays.
+
+Parsers storing different arrays of the same file use caches of
+different names, e.g., "vasprun.xml.expat.npz". Names of values of None
+are stored too, so a cache lacking a value expected by its reader is
+missed instead of being taken as complete.
+
+"""
+import hashlib
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+# Size of blocks at head and tail of source file used for digest
+_DIGEST_BLOCK_SIZE = 1 << 20
+
+
+def get_sidecar_filename(filename, name=None):
+    if name is None:
+        return "%s.npz" % filename
+    else:
+        return "%s.%s.npz" % (filename, name)
+
+
+def read_sidecar(filename, mmap_mode="c", name=None, keys=None):
+    """Return arrays cached for file or None if cache is missing or stale.
+
+    Parameters
+    ----------
+    filename : str
+        Source file, e.g., vasprun.xml.
+    mmap_mode : str or None
+        Mode of np.memmap. With the default "c", arrays are writable and
+        changes are not written back. Arrays are read in memory with None.
+    name : str, optional
+        Name of cache distinguishing parsers of the same file.
+    keys : sequence of str, optional
+        Names of values required. The cache is missed when any of them
+        was not stored.
+
+    Returns
+    -------
+    dict or None
+        Arrays by their names. Values stored as None are None.
+
+    """
+    sidecar = get_sidecar_filename(filename, name)
+    if not os.path.exists(sidecar) or not os.path.exists(filename):
+        return None
+    try:
+        arrays = _load_npz(sidecar, mmap_mode)
+    except (OSError, ValueError, zipfile.BadZipFile, struct.error):
+        return None
+    if "_source" not in arrays:
+        return None
+    if str(arrays.pop("_source")) != _get_source_key(filename):
+        return None
+    if "_none" in arrays:
+        for key in arrays.pop("_none"):
+            arrays[str(key)] = None
+    if keys is not None:
+        for key in keys:
+            if key not in arrays:
+                return None
+    return arrays
+
+
+def write_sidecar(filename, arrays, name=None):
+    """Write arrays parsed from file to its cache.
+
+    Only names of values of None are stored. Failure of writing, e.g.,
+    in a read only directory, is ignored.
+
+    """
+    sidecar = get_sidecar_filename(filename, name)
+    data = dict([(k, np.asarray(v)) for k, v in arrays.items() if v is not None])
+    data["_none"] = np.array([k for k, v in arrays.items() if v is None], dtype=str)
+    data["_source"] = np.array(_get_source_key(filename))
+    tmp_filename = "%s.%d.tmp" % (sidecar, os.getpid())
+    try:
+        with open(tmp_filename, "wb") as f:
+            np.savez(f, **data)
+        os.replace(tmp_filename, sidecar)
+        return True
+    except OSError:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        return False
+
+
+def _get_source_key(filename):
+    st = os.stat(filename)
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        sha1.update(f.read(_DIGEST_BLOCK_SIZE))
+        if st.st_size > _DIGEST_BLOCK_SIZE:
+            f.seek(max(st.st_size - _DIGEST_BLOCK_SIZE, _DIGEST_BLOCK_SIZE))
+            sha1.update(f.read())
+    return "%d %d %s" % (st.st_size, st.st_mtime_ns, sha1.hexdigest())
+
+
+def _load_npz(filename, mmap_mode):
+    """Load arrays of npz file written by np.savez.
+
+    Members of npz are stored without compression, so each array is
+    memory mapped at its offset in the zip file.
+
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, "rb") as f:
+        for info in zf.infolist():
+            name = info.filename[:-4]  # .npy
+            if info.compress_type != zipfile.ZIP_STORED or mmap_mode is None:
+                with zf.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            # Local file header has variable length name and extra field.
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            npy_offset = info.header_offset + 30 + name_length + extra_length
+            f.seek(npy_offset)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject or not shape or 0 in shape:
+                f.seek(npy_offset)
+                arrays[name] = np.lib.format.read_array(f)
+            else:
+                arrays[name] = np.memmap(
+                    filename,
+                    dtype=dtype,
+                    mode=mmap_mode,
+                    offset=f.tell(),
+                    shape=shape,
+                    order="F" if fortran_order else "C",
+                )
+    return arrays
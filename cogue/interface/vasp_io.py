@@ -1,13 +1,25 @@
+import hashlib
 import numbers
 import os
+import re
 import sys
 import xml.etree.cElementTree as etree
+from xml.parsers.expat import ExpatError
 
 import numpy as np
 from phonopy.interface.vasp import VasprunxmlExpat as PhonopyVasprunExpat
 
 from cogue.crystal.atom import atomic_symbols, atomic_weights
 from cogue.crystal.cell import Cell
+from cogue.interface.compression import find_file, open_file
+from cogue.interface.sidecar import read_sidecar, write_sidecar
+
+# POTCAR bytes by (COGUE_POTCAR_PATH, species) and file path by SHA-1
+_potcar_cache = {}
+_potcar_blobs = {}
+
+# Floats written by fortran formats of OUTCAR
+_float_pattern = re.compile(r"[-+]?\d*\.\d+(?:[eE][-+]?\d+)?")
 
 
 class VaspCell(Cell):
@@ -287,18 +299,64 @@ def write_poscar_yaml(cell, filename=None):
 
 
 def write_potcar(names, filename="POTCAR"):
+    """Write POTCAR concatenating pseudopotentials of species.
+
+    Concatenated POTCAR bytes are kept in memory for each set of
+    species so that pseudopotential files are read only once in a
+    process. The file is hardlinked to the first POTCAR written with
+    the same content (identified by SHA-1), and is written only when
+    hardlink is not possible, e.g., across file systems. Therefore
+    POTCARs of tasks must not be modified in place.
+
+    """
+    potcar = get_potcar_bytes(names)
+    if potcar is None:
+        return False
+
+    digest = hashlib.sha1(potcar).hexdigest()
+    if os.path.lexists(filename):
+        os.remove(filename)
+    if digest in _potcar_blobs:
+        try:
+            if os.path.getsize(_potcar_blobs[digest]) == len(potcar):
+                os.link(_potcar_blobs[digest], filename)
+                return True
+        except OSError:
+            pass
+    with open(filename, "wb") as w:
+        w.write(potcar)
+    _potcar_blobs[digest] = os.path.abspath(filename)
+    return True
+
+
+def get_potcar_bytes(names):
+    """Return concatenated POTCAR of species as bytes.
+
+    Consecutive duplicates of species are concatenated once. None is
+    returned if COGUE_POTCAR_PATH is not set.
+
+    """
     if "COGUE_POTCAR_PATH" in os.environ:
         potcarpath = os.environ["COGUE_POTCAR_PATH"]
     else:
         print("COGUE_POTCAR_PATH is not set correctly.")
-        return False
+        return None
+
+    species = tuple([s for i, s in enumerate(names) if i == 0 or not s == names[i - 1]])
+    key = (potcarpath, species)
+    if key not in _potcar_cache:
+        potcar = b""
+        for s in species:
+            with open("%s/%s" % (potcarpath, s), "rb") as f:
+                potcar += f.read()
+        _potcar_cache[key] = potcar
+    return _potcar_cache[key]
 
-    with open(filename, "w") as w:
-        for i, s in enumerate(names):
-            if i == 0 or not s == names[i - 1]:
-                with open("%s/%s" % (potcarpath, s)) as f:
-                    for line in f:
-                        w.write(line)
+
+def clear_potcar_cache():
+    """Forget POTCARs kept in memory and files to be hardlinked."""
+    _potcar_cache.clear()
+    _potcar_blobs.clear()
 
 
 def get_enmax_from_potcar(names):
@@ -793,48 +851,272 @@ def write_kpoints(
 
 
 class Outcar:
+    """Parser of OUTCAR
+
+    OUTCAR is read line by line in one pass and only blocks of the
+    fields requested are converted to numbers. Forces and stress of
+    ionic steps are given in the same units and shapes as those of
+    Vasprunxml, so OUTCAR can be read in place of vasprun.xml for these
+    values.
+
+    """
+
+    _all_fields = (
+        "forces",
+        "stress",
+        "energies",
+        "born_charges",
+        "epsilon",
+        "elastic_constants",
+    )
+    _step_fields = ("forces", "stress", "energies")
+
     def __init__(self, filename="OUTCAR"):
         self._filename = filename
+        self._forces = None
+        self._stress = None
+        self._energies = None
+        self._born_charges = None
+        self._epsilon = None
         self._elastic_constants = None
 
+        self._log = ""
+
+    def get_forces(self):
+        return self._forces
+
+    def get_stress(self):
+        return self._stress
+
+    def get_energies(self):
+        return self._energies
+
+    def get_born_charges(self):
+        return self._born_charges
+
+    def get_epsilon(self):
+        return self._epsilon
+
     def get_elastic_constants(self):
         return self._elastic_constants
 
+    @property
+    def log(self):
+        log = self._log
+        self._log = ""
+        return log
+
     def parse_elastic_constants(self):
-        with open(self._filename) as outcar:
-            hooked = False
-            for line in outcar:
-                if line.strip() == "TOTAL ELASTIC MODULI (kBar)":
-                    hooked = True
-                    break
-
-            if hooked:
-                next(outcar)
-                next(outcar)
-                ec = []
-                for i in range(6):
-                    pos = 8
-                    line = next(outcar)
-                    for j in range(6):
-                        try:
-                            elem = float(line[pos : (pos + 12)])
-                        except ValueError:
-                            return False
-
-                        ec.append(elem)
-                        pos += 12
-
-                self._elastic_constants = np.array(
-                    np.reshape(ec, (6, 6)), dtype="double", order="C"
-                )
-                return True
+        return self.parse(fields=("elastic_constants",))
+
+    def parse(self, fields=None, steps="all"):
+        """Parse OUTCAR.
+
+        Parameters
+        ----------
+        fields : tuple of str, optional
+            Some of "forces", "stress", "energies", "born_charges",
+            "epsilon" and "elastic_constants". Parsing fails when any of
+            them is not found. All fields found are parsed when None.
+        steps : str, optional
+            "all" or "last". With "last", only values of the last ionic
+            step are kept. Arrays of values per ionic step keep their
+            first axis of length one.
+
+        Returns
+        -------
+        bool
+            True when parsing succeeded.
+
+        Notes
+        -----
+        forces : ndarray
+            Forces in eV/Angstrom, shape=(steps, atoms, 3).
+        stress : ndarray
+            Stress in kBar, shape=(steps, 3, 3).
+        energies : ndarray
+            Free energy (TOTEN), energy without entropy and energy of
+            sigma->0 in eV, shape=(steps, 3).
+        born_charges : ndarray
+            Born effective charges including local field effects,
+            shape=(atoms, 3, 3).
+        epsilon : ndarray
+            Dielectric tensor including local field effects, shape=(3, 3).
+        elastic_constants : ndarray
+            Total elastic moduli in kBar, shape=(6, 6).
+
+        """
+        if fields is None:
+            is_required = False
+            fields = self._all_fields
+        else:
+            is_required = True
+        for field in fields:
+            if field not in self._all_fields:
+                print("Field %s can not be parsed from OUTCAR." % field)
+                raise RuntimeError
+        if steps not in ("all", "last"):
+            print('steps has to be "all" or "last".')
+            raise RuntimeError
+
+        filename = find_file(self._filename)
+        if filename is None:
+            self._log += "    [Outcar] %s not found\n" % self._filename
+            return False
+
+        # Lists of values of blocks found. Only the last one is used for
+        # fields other than values per ionic step.
+        values = dict([(field, []) for field in fields])
+
+        def append(field, value):
+            if steps == "last" or field not in self._step_fields:
+                values[field][:] = [value]
             else:
-                return False
+                values[field].append(value)
+
+        try:
+            with open_file(filename, "r") as outcar:
+                for line in outcar:
+                    if "TOTAL-FORCE" in line:
+                        if "forces" in values:
+                            append("forces", self._parse_forces(outcar))
+                    elif line.lstrip().startswith("in kB"):
+                        if "stress" in values:
+                            append("stress", self._parse_stress(line))
+                    elif "FREE ENERGIE OF THE ION-ELECTRON SYSTEM" in line:
+                        if "energies" in values:
+                            append("energies", self._parse_energies(outcar))
+                    elif "BORN EFFECTIVE CHARGES" in line:
+                        if "born_charges" in values:
+                            append("born_charges", self._parse_born_charges(outcar))
+                    elif "MACROSCOPIC STATIC DIELECTRIC TENSOR" in line:
+                        if "epsilon" in values and "IONIC" not in line:
+                            next(outcar)
+                            append("epsilon", self._parse_rows(outcar, 3, 3))
+                    elif "TOTAL ELASTIC MODULI" in line:
+                        if "elastic_constants" in values:
+                            next(outcar)
+                            next(outcar)
+                            append("elastic_constants", self._parse_rows(outcar, 6, 6))
+        except:  # noqa E722
+            self._log += "    [Outcar] Failed parse of %s\n" % "/".join(fields)
+            return False
+
+        for field in fields:
+            if not values[field]:
+                if is_required:
+                    self._log += "    [Outcar] %s not found\n" % field
+                    return False
+            elif field in self._step_fields:
+                setattr(self, "_" + field, np.array(values[field], dtype="double"))
+            else:
+                setattr(self, "_" + field, values[field][-1])
+        return True
+
+    def _parse_forces(self, outcar):
+        next(outcar)
+        rows = []
+        for line in outcar:
+            if line.lstrip().startswith("---"):
+                break
+            floats = _parse_floats(line)
+            if len(floats) != 6:
+                raise ValueError("Broken line of forces.")
+            rows.append(floats[3:])
+        return rows
+
+    def _parse_stress(self, line):
+        xx, yy, zz, xy, yz, zx = self._check_length(_parse_floats(line), 6)
+        return [[xx, xy, zx], [xy, yy, yz], [zx, yz, zz]]
+
+    def _parse_energies(self, outcar):
+        toten = None
+        for line in outcar:
+            if "TOTEN" in line:
+                toten = self._check_length(_parse_floats(line), 1)[0]
+            elif "energy(sigma->0)" in line and toten is not None:
+                return [toten] + self._check_length(_parse_floats(line), 2)
+        raise ValueError("Energies not found.")
+
+    def _parse_born_charges(self, outcar):
+        next(outcar)
+        born_charges = []
+        for line in outcar:
+            if not line.lstrip().startswith("ion"):
+                break
+            born_charges.append(self._parse_rows(outcar, 3, 3))
+        return np.array(born_charges, dtype="double")
+
+    def _parse_rows(self, outcar, num_rows, num_cols):
+        rows = [
+            self._check_length(_parse_floats(next(outcar)), num_cols)
+            for i in range(num_rows)
+        ]
+        return np.array(rows, dtype="double")
+
+    def _check_length(self, floats, length):
+        if len(floats) != length:
+            raise ValueError("Unexpected number of values.")
+        return floats
+
+
+def _parse_floats(line):
+    """Return floats in line.
+
+    Numbers without space between them, e.g., "-1234.5678-123.4567",
+    which appear in fixed width columns of OUTCAR, are separated.
+    Integers such as indices of atoms are ignored.
+
+    """
+    return [float(x) for x in _float_pattern.findall(line)]
 
 
 class Vasprunxml(object):
-    def __init__(self, filename="vasprun.xml"):
+    """Parser of vasprun.xml by ElementTree
+
+    With cache=True, results of parsing all fields (see parse) are
+    written to "vasprun.xml.npz" and read from it in later parses as
+    long as vasprun.xml is unchanged (see cogue.interface.sidecar).
+
+    """
+
+    _all_fields = ("calculation", "eigenvalues", "efermi", "parameters")
+    _cached_attributes = (
+        "forces",
+        "stress",
+        "lattice",
+        "points",
+        "energies",
+        "eigenvalues_spin1",
+        "eigenvalues_spin2",
+        "occupancies_spin1",
+        "occupancies_spin2",
+        "kpoints",
+        "kpoint_weights",
+        "born_charges",
+        "epsilon",
+        "nbands",
+        "efermi",
+    )
+    # Elements parsed for each field of parse(fields=...) given by path
+    # of tags below the root and "name" attribute (None matches any).
+    _field_elements = {
+        "forces": [(("calculation", "varray"), "forces")],
+        "stress": [(("calculation", "varray"), "stress")],
+        "lattice": [(("calculation", "structure", "crystal", "varray"), "basis")],
+        "points": [(("calculation", "structure", "varray"), "positions")],
+        "energies": [(("calculation", "energy"), None)],
+        "born_charges": [(("calculation", "array"), "born_charges")],
+        "epsilon": [(("calculation", "varray"), "epsilon")],
+        "eigenvalues": [(("calculation", "eigenvalues"), None), (("kpoints",), None)],
+        "efermi": [(("calculation", "dos", "i"), "efermi")],
+        "nbands": [(("parameters", "separator", "i"), "NBANDS")],
+    }
+    _step_fields = ("forces", "stress", "lattice", "points", "energies")
+
+    def __init__(self, filename="vasprun.xml", cache=True):
         self._filename = filename
+        self._cache = cache
         self._forces = None
         self._stress = None
         self._lattice = None
@@ -907,212 +1189,575 @@ class Vasprunxml(object):
         self._log = ""
         return log
 
-    def parse_calculation(self):
-        forces = []
-        stress = []
-        lattice = []
-        points = []
-        energies = []
-        born_charges = []
-        epsilon = []
-
-        try:
-            for event, element in etree.iterparse(self._filename):
+    def parse(self, fields=None, steps="all"):
+        """Parse calculations, eigenvalues, k-points, Fermi energy and NBANDS.
+
+        vasprun.xml is read by one streaming pass. Elements are released
+        as soon as they are parsed, so memory use does not grow with
+        size of the file.
+
+        Parameters
+        ----------
+        fields : tuple of str, optional
+            Some of "forces", "stress", "lattice", "points", "energies",
+            "born_charges", "epsilon", "eigenvalues" (with occupancies and
+            k-points), "efermi" and "nbands". Only elements of these
+            fields are built and the others are skipped by the parser.
+            Attributes of fields not given are left untouched. All fields
+            are parsed when None.
+        steps : str, optional
+            "all" or "last". With "last", only values of the last ionic
+            step are kept, so memory use does not depend on the number
+            of ionic steps. Arrays of values per ionic step keep their
+            first axis of length one, e.g., get_forces()[-1].
 
-                if element.tag != "calculation":
-                    continue
-
-                for varray in element.findall("./varray"):
-                    self._parse_forces_and_stress(varray, forces, stress)
+        """
+        if fields is None and steps == "all":
+            return self._parse(self._all_fields)
+        if fields is None:
+            fields = tuple(self._field_elements)
+        return self._parse_selected(tuple(fields), steps)
 
-                for varray in element.findall("./structure/varray"):
-                    self._parse_points(varray, points)
+    def parse_calculation(self):
+        return self._parse(("calculation",))
 
-                for varray in element.findall("./structure/crystal/varray"):
-                    self._parse_lattice(varray, lattice)
+    def parse_parameters(self):
+        return self._parse(("parameters",))
 
-                for energy in element.findall("./energy"):
-                    self._parse_energies(energy, energies)
+    def parse_efermi(self):
+        return self._parse(("efermi",))
 
-                for array in element.findall("./array"):
-                    if array.attrib["name"] == "born_charges":
-                        self._parse_born_charges(array, born_charges)
+    def parse_eigenvalues(self):
+        return self._parse(("eigenvalues",))
 
-                for varray in element.findall("./varray"):
-                    if varray.attrib["name"] == "epsilon":
-                        self._parse_vectors(varray, epsilon)
+    def _parse(self, fields):
+        """Parse fields in one pass of iterparse.
 
-            self._forces = np.array(forces)
-            self._stress = np.array(stress)
-            self._lattice = np.array(lattice)
-            self._points = np.array(points)
-            self._energies = np.array(energies)
-            if born_charges:
-                self._born_charges = np.array(born_charges)
-            if epsilon:
-                self._epsilon = np.array(epsilon)
+        Parameters
+        ----------
+        fields : tuple of str
+            Some of "calculation", "eigenvalues" (with k-points),
+            "efermi" and "parameters".
 
+        """
+        filename = self._get_filename()
+        calculation = _get_empty_calculation()
+        if self._cache and self._read_cache(filename):
             return True
 
-        except:  # noqa E722
-            self._log += "    [Vasprunxml] Failed parse_calculation\n"
-            return False
+        eigenvalues = {"spin1": [], "spin2": [], "occ1": [], "occ2": []}
+        kpoints = None
+        weights = None
+        efermi = None
+        nbands = None
 
-    def parse_parameters(self):
         try:
-            for event, element in etree.iterparse(self._filename):
-
-                if element.tag != "parameters":
-                    continue
-
-                for separator in element.findall("./separator"):
-                    if separator.attrib["name"] == "electronic":
-                        for i in separator.findall("./i"):
-                            if i.attrib["name"] == "NBANDS":
-                                self._nbands = int(i.text)
-            return True
+            with open_file(filename) as f:
+                for event, element in etree.iterparse(f):
+                    tag = element.tag
+                    if tag == "calculation":
+                        if "calculation" in fields:
+                            self._parse_calculation_element(element, calculation)
+                        if "eigenvalues" in fields:
+                            for e in element.findall("./eigenvalues"):
+                                self._parse_eigenvalues_element(e, eigenvalues)
+                    elif tag == "kpoints":
+                        if "eigenvalues" in fields:
+                            kpoints, weights = self._parse_kpoints_element(element)
+                    elif tag == "dos":
+                        for i in element.findall("./i"):
+                            if i.attrib["name"] == "efermi":
+                                efermi = float(i.text)
+                    elif tag == "parameters":
+                        for separator in element.findall("./separator"):
+                            if separator.attrib["name"] == "electronic":
+                                for i in separator.findall("./i"):
+                                    if i.attrib["name"] == "NBANDS":
+                                        nbands = int(i.text)
+                    elif tag != "projected":
+                        continue
+                    element.clear()
         except:  # noqa E722
-            self._log += "    [Vasprunxml] Failed parse_parameters\n"
+            self._log += "    [Vasprunxml] Failed parse_%s\n" % "/".join(fields)
             return False
 
-    def parse_efermi(self):
-        try:
-            for event, element in etree.iterparse(self._filename):
-
-                if element.tag != "dos":
-                    continue
-
-                for i in element.findall("./i"):
-                    if i.attrib["name"] == "efermi":
-                        efermi = float(i.text)
-
-            self._efermi = efermi
-            return True
-        except:  # noqa E722
+        if "efermi" in fields and efermi is None:
             self._log += "    [Vasprunxml] Failed parse_efermi\n"
             return False
+        if "eigenvalues" in fields and kpoints is None:
+            self._log += "    [Vasprunxml] Failed parse_kpoints\n"
+            return False
 
-    def parse_eigenvalues(self):
-        spin1 = []
-        spin2 = []
-        occ1 = []
-        occ2 = []
-        try:
-            for event, element in etree.iterparse(self._filename):
+        if "calculation" in fields:
+            self._set_calculation(calculation)
+        if "eigenvalues" in fields:
+            self._set_eigenvalues(eigenvalues, kpoints, weights)
+        if "efermi" in fields:
+            self._efermi = efermi
+        if "parameters" in fields:
+            self._nbands = nbands
+        if self._cache and fields == self._all_fields:
+            write_sidecar(
+                filename,
+                {k: getattr(self, "_" + k) for k in self._cached_attributes},
+            )
+        return True
 
-                if element.tag != "eigenvalues":
-                    continue
+    def _parse_selected(self, fields, steps):
+        """Parse fields building only their elements.
 
-                for array in element.findall("./array/set/set"):
+        See parse for the parameters.
 
-                    if array.attrib["comment"] == "spin 1":
-                        self._parse_eigenvalues_spin(array, spin1, occ1)
+        """
+        for field in fields:
+            if field not in self._field_elements:
+                print("Field %s can not be parsed from vasprun.xml." % field)
+                raise RuntimeError
+        if steps not in ("all", "last"):
+            print('steps has to be "all" or "last".')
+            raise RuntimeError
+
+        filename = self._get_filename()
+        if self._cache and self._read_cache_selected(filename, fields, steps):
+            return True
 
-                    if array.attrib["comment"] == "spin 2":
-                        self._parse_eigenvalues_spin(array, spin2, occ2)
+        selections = {}
+        for field in fields:
+            for path, name in self._field_elements[field]:
+                selections[(path, name)] = field
+
+        # Values of fields in calculation elements. With steps="last",
+        # values of the latest calculation having each field.
+        calculations = []
+        step = {}
+        values = {}
+
+        def handle(field, element):
+            if field is None:
+                if steps == "last":
+                    if not calculations:
+                        calculations.append({})
+                    calculations[0].update(step)
+                else:
+                    calculations.append(step.copy())
+                step.clear()
+            elif field in self._step_fields:
+                if field == "energies":
+                    step[field] = _parse_rows(element.findall("./i"))
+                elif field in ("lattice", "points"):
+                    step[field] = _parse_rows(element.findall("./v")).T
+                else:
+                    step[field] = _parse_rows(element.findall("./v"))
+            elif field == "born_charges":
+                step[field] = []
+                self._parse_born_charges(element, step[field])
+            elif field == "epsilon":
+                step[field] = []
+                self._parse_vectors(element, step[field])
+            elif field == "eigenvalues" and element.tag == "kpoints":
+                values["kpoints"] = self._parse_kpoints_element(element)
+            elif field == "eigenvalues":
+                step[field] = {"spin1": [], "spin2": [], "occ1": [], "occ2": []}
+                self._parse_eigenvalues_element(element, step[field])
+            elif field == "efermi":
+                values[field] = float(element.text)
+            elif field == "nbands":
+                values[field] = int(element.text)
+
+        parser = etree.XMLParser(target=_SelectiveTreeBuilder(selections, handle))
+        try:
+            with open_file(filename) as f:
+                while True:
+                    data = f.read(1 << 16)
+                    if not data:
+                        break
+                    parser.feed(data)
+                parser.close()
+        except:  # noqa E722
+            self._log += "    [Vasprunxml] Failed parse of %s\n" % "/".join(fields)
+            return False
 
-            if spin1:
-                self._eigenvalues_spin1 = np.array(spin1)
-                self._occupancies_spin1 = np.array(occ1)
-            if spin2:
-                self._eigenvalues_spin2 = np.array(spin2)
-                self._occupancies_spin2 = np.array(occ2)
+        if "efermi" in fields and "efermi" not in values:
+            self._log += "    [Vasprunxml] Failed parse_efermi\n"
+            return False
+        if "eigenvalues" in fields and "kpoints" not in values:
+            self._log += "    [Vasprunxml] Failed parse_kpoints\n"
+            return False
 
-            return self._parse_kpoints()
+        for field in fields:
+            if field in self._step_fields:
+                setattr(
+                    self,
+                    "_" + field,
+                    np.array([c[field] for c in calculations if field in c]),
+                )
+            elif field in ("born_charges", "epsilon"):
+                rows = [r for c in calculations if field in c for r in c[field]]
+                if rows:
+                    setattr(self, "_" + field, np.array(rows))
+            elif field == "eigenvalues":
+                eigenvalues = {"spin1": [], "spin2": [], "occ1": [], "occ2": []}
+                for c in calculations:
+                    if field in c:
+                        for key in eigenvalues:
+                            eigenvalues[key].extend(c[field][key])
+                self._set_eigenvalues(eigenvalues, *values["kpoints"])
+            elif field == "efermi":
+                self._efermi = values[field]
+            elif field == "nbands":
+                self._nbands = values.get(field)
+        return True
+
+    def _get_filename(self):
+        """Return path of vasprun.xml or of its compressed version."""
+        filename = find_file(self._filename)
+        if filename is None:
+            return self._filename
+        else:
+            return filename
 
-        except:  # noqa E722
-            self._log += "    [Vasprunxml] Failed parse_eigenvalues\n"
+    def _read_cache(self, filename):
+        arrays = read_sidecar(filename, keys=self._cached_attributes)
+        if arrays is None:
+            return False
+        for key in self._cached_attributes:
+            if arrays[key] is None:
+                setattr(self, "_" + key, None)
+            elif arrays[key].ndim == 0:
+                setattr(self, "_" + key, arrays[key].item())
+            else:
+                setattr(self, "_" + key, arrays[key])
+        return True
+
+    def _read_cache_selected(self, filename, fields, steps):
+        keys = []
+        for field in fields:
+            if field == "eigenvalues":
+                keys += [
+                    "eigenvalues_spin1",
+                    "eigenvalues_spin2",
+                    "occupancies_spin1",
+                    "occupancies_spin2",
+                    "kpoints",
+                    "kpoint_weights",
+                ]
+            else:
+                keys.append(field)
+        arrays = read_sidecar(filename, keys=keys)
+        if arrays is None:
             return False
+        for key in keys:
+            if arrays[key] is None:
+                setattr(self, "_" + key, None)
+            elif arrays[key].ndim == 0:
+                setattr(self, "_" + key, arrays[key].item())
+            elif steps == "last" and key in self._step_fields:
+                setattr(self, "_" + key, arrays[key][-1:])
+            elif steps == "last" and key.startswith(("eigenvalues", "occupancies")):
+                # Eigenvalues of calculations are concatenated along k-points.
+                setattr(self, "_" + key, arrays[key][-len(arrays["kpoints"]) :])
+            else:
+                setattr(self, "_" + key, arrays[key])
+        return True
+
+    def _set_calculation(self, calculation):
+        self._forces = np.array(calculation["forces"])
+        self._stress = np.array(calculation["stress"])
+        self._lattice = np.array(calculation["lattice"])
+        self._points = np.array(calculation["points"])
+        self._energies = np.array(calculation["energies"])
+        if calculation["born_charges"]:
+            self._born_charges = np.array(calculation["born_charges"])
+        if calculation["epsilon"]:
+            self._epsilon = np.array(calculation["epsilon"])
+
+    def _set_eigenvalues(self, eigenvalues, kpoints, weights):
+        if eigenvalues["spin1"]:
+            self._eigenvalues_spin1 = np.array(eigenvalues["spin1"])
+            self._occupancies_spin1 = np.array(eigenvalues["occ1"])
+        if eigenvalues["spin2"]:
+            self._eigenvalues_spin2 = np.array(eigenvalues["spin2"])
+            self._occupancies_spin2 = np.array(eigenvalues["occ2"])
+        self._kpoints = np.array(kpoints)
+        self._kpoint_weights = np.array(weights)
+
+    def _parse_calculation_element(self, element, calculation):
+        for varray in element.findall("./varray"):
+            self._parse_forces_and_stress(
+                varray, calculation["forces"], calculation["stress"]
+            )
 
-    def _parse_kpoints(self):
-        try:
-            for event, element in etree.iterparse(self._filename):
+        for varray in element.findall("./structure/varray"):
+            self._parse_points(varray, calculation["points"])
 
-                if element.tag != "kpoints":
-                    continue
+        for varray in element.findall("./structure/crystal/varray"):
+            self._parse_lattice(varray, calculation["lattice"])
 
-                kpoints = []
-                weights = []
-                for varray in element.findall("./varray"):
-                    if varray.attrib["name"] == "kpointlist":
-                        for v in varray.findall("./v"):
-                            kpoints.append([float(x) for x in v.text.split()])
+        for energy in element.findall("./energy"):
+            self._parse_energies(energy, calculation["energies"])
 
-                    if varray.attrib["name"] == "weights":
-                        for v in varray.findall("./v"):
-                            weights.append(float(v.text))
+        for array in element.findall("./array"):
+            if array.attrib["name"] == "born_charges":
+                self._parse_born_charges(array, calculation["born_charges"])
 
-            self._kpoints = np.array(kpoints)
-            self._kpoint_weights = np.array(weights)
-            return True
+        for varray in element.findall("./varray"):
+            if varray.attrib["name"] == "epsilon":
+                self._parse_vectors(varray, calculation["epsilon"])
 
-        except:  # noqa E722
-            self._log += "    [Vasprunxml] Failed parse_kpoints\n"
-            return False
+    def _parse_eigenvalues_element(self, element, eigenvalues):
+        for array in element.findall("./array/set/set"):
+            if array.attrib["comment"] == "spin 1":
+                self._parse_eigenvalues_spin(
+                    array, eigenvalues["spin1"], eigenvalues["occ1"]
+                )
+            if array.attrib["comment"] == "spin 2":
+                self._parse_eigenvalues_spin(
+                    array, eigenvalues["spin2"], eigenvalues["occ2"]
+                )
+
+    def _parse_kpoints_element(self, element):
+        kpoints = []
+        weights = []
+        for varray in element.findall("./varray"):
+            if varray.attrib["name"] == "kpointlist":
+                kpoints = _parse_rows(varray.findall("./v"))
+
+            if varray.attrib["name"] == "weights":
+                weights = _parse_rows(varray.findall("./v")).ravel()
+        return kpoints, weights
 
     def _parse_eigenvalues_spin(self, array, eigenvals, occupancies):
-        for kset in array.findall("./set"):
-            eigs = []
-            occs = []
-            for r in kset.findall("./r"):
-                vals = r.text.split()
-                eigs.append(float(vals[0]))
-                occs.append(float(vals[1]))
-            eigenvals.append(eigs)
-            occupancies.append(occs)
+        ksets = array.findall("./set")
+        if not ksets:
+            return
+        rows = [r for kset in ksets for r in kset if r.tag == "r"]
+        values = _parse_rows(rows).reshape(len(ksets), -1, 2)
+        eigenvals.extend(values[:, :, 0])
+        occupancies.extend(values[:, :, 1])
 
     def _parse_forces_and_stress(self, varray, forces, stress):
         # force
         if varray.attrib["name"] == "forces":
-            forces_geomopt = []
-            for v in varray.findall("./v"):
-                forces_geomopt.append([float(x) for x in v.text.strip().split()])
-            forces.append(forces_geomopt)
+            forces.append(_parse_rows(varray.findall("./v")))
 
         # stress
         if varray.attrib["name"] == "stress":
-            stress_geomopt = []
-            for v in varray.findall("./v"):
-                stress_geomopt.append([float(x) for x in v.text.strip().split()])
-            stress.append(stress_geomopt)
+            stress.append(_parse_rows(varray.findall("./v")))
 
     def _parse_points(self, varray, points):
         # points
         if varray.attrib["name"] == "positions":
-            points_geomopt = []
-            for v in varray.findall("./v"):
-                points_geomopt.append([float(x) for x in v.text.strip().split()])
-            points.append(np.transpose(points_geomopt))
+            points.append(_parse_rows(varray.findall("./v")).T)
 
     def _parse_lattice(self, varray, lattice):
         if varray.attrib["name"] == "basis":
-            lattice_geomopt = []
-            for v in varray.findall("./v"):
-                lattice_geomopt.append(
-                    np.transpose([float(x) for x in v.text.strip().split()])
-                )
-            lattice.append(np.transpose(lattice_geomopt))
+            lattice.append(_parse_rows(varray.findall("./v")).T)
 
     def _parse_energies(self, energy, energies):
-        energies_geomopt = []
-        for v in energy.findall("./i"):
-            energies_geomopt.append([float(x) for x in v.text.strip().split()])
-        energies.append(energies_geomopt)
+        energies.append(_parse_rows(energy.findall("./i")))
 
     def _parse_born_charges(self, array, born_charges):
-        for ion_set in array.findall("./set"):
-            tensor = []
-            for v in ion_set.findall("./v"):
-                tensor.append([float(x) for x in v.text.strip().split()])
-            born_charges.append(tensor)
+        ion_sets = array.findall("./set")
+        if ion_sets:
+            rows = [v for ion_set in ion_sets for v in ion_set.findall("./v")]
+            born_charges.extend(_parse_rows(rows).reshape(len(ion_sets), -1, 3))
 
     def _parse_vectors(self, varray, vectors):
-        for v in varray.findall("./v"):
-            vectors.append([float(x) for x in v.text.strip().split()])
+        vectors.extend(_parse_rows(varray.findall("./v")))
+
+
+class VasprunxmlTail(Vasprunxml):
+    """Incremental reader of vasprun.xml being written by VASP
+
+    Each call of ``update`` reads only the bytes appended after the
+    previous call and parses calculation elements completed in them.
+    The byte offset and the state of the XML parser are kept between
+    calls, so a running relaxation can be followed without reading the
+    file again from the start. The file is read from the start when it
+    was replaced or truncated, e.g., by a new run of VASP.
+
+    """
+
+    def __init__(self, filename="vasprun.xml"):
+        Vasprunxml.__init__(self, filename, cache=False)
+        self._reset()
+
+    def __getstate__(self):
+        # Parser can not be pickled. The file is read again after unpickling.
+        state = self.__dict__.copy()
+        state["_parser"] = None
+        state["_offset"] = 0
+        state["_file_id"] = None
+        state["_calculation"] = _get_empty_calculation()
+        return state
+
+    def get_offset(self):
+        return self._offset
+
+    def get_num_calculations(self):
+        return len(self._calculation["energies"])
+
+    def update(self):
+        """Parse calculations appended after the previous call.
+
+        Returns
+        -------
+        int
+            Number of calculations newly parsed.
+
+        """
+        try:
+            st = os.stat(self._filename)
+        except OSError:
+            return 0
+        file_id = (st.st_dev, st.st_ino)
+        if file_id != self._file_id or st.st_size < self._offset:
+            self._reset()
+            self._file_id = file_id
+        if st.st_size == self._offset or self._is_broken:
+            return 0
+
+        if self._parser is None:
+            self._parser = etree.XMLPullParser(events=("end",))
+        with open(self._filename, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+        self._offset += len(data)
+
+        num_calculations = self.get_num_calculations()
+        try:
+            self._parser.feed(data)
+            for event, element in self._parser.read_events():
+                if element.tag == "calculation":
+                    self._parse_calculation_element(element, self._calculation)
+                    element.clear()
+                elif element.tag in ("dos", "projected"):
+                    element.clear()
+        except:  # noqa E722
+            self._log += "    [VasprunxmlTail] Failed to parse appended data\n"
+            self._is_broken = True
+
+        self._set_calculation(self._calculation)
+        return self.get_num_calculations() - num_calculations
+
+    def _reset(self):
+        self._parser = None
+        self._offset = 0
+        self._file_id = None
+        self._is_broken = False
+        self._calculation = _get_empty_calculation()
+
+
+def _get_empty_calculation():
+    return {
+        "forces": [],
+        "stress": [],
+        "lattice": [],
+        "points": [],
+        "energies": [],
+        "born_charges": [],
+        "epsilon": [],
+    }
+
+
+class _SelectiveTreeBuilder(object):
+    """Target of XMLParser building only selected elements
+
+    Elements are matched by path of tags below the root and "name"
+    attribute. Selected elements are built with their subtrees and the
+    others are dropped without making element objects.
+
+    Parameters
+    ----------
+    selections : dict
+        Keys are pairs of path (tuple of tags) and name (None matches any).
+        Values are passed to handler with the element built.
+    handler : callable
+        Called as handler(value, element) when each selected element ends
+        and as handler(None, None) at end of each calculation element.
+
+    """
+
+    def __init__(self, selections, handler):
+        self._selections = selections
+        self._handler = handler
+        self._max_depth = max([len(path) for path, name in selections]) + 1
+        self._path = []
+        self._builder = None
+        self._value = None
+        self._depth = 0
+
+    def start(self, tag, attrib):
+        if self._builder is not None:
+            self._depth += 1
+            self._builder.start(tag, attrib)
+            return
+        self._path.append(tag)
+        if len(self._path) > self._max_depth:
+            return
+        path = tuple(self._path[1:])
+        key = (path, attrib.get("name"))
+        if key not in self._selections:
+            key = (path, None)
+        if key in self._selections:
+            self._builder = etree.TreeBuilder()
+            self._builder.start(tag, attrib)
+            self._value = self._selections[key]
+            self._depth = 0
+
+    def data(self, data):
+        if self._builder is not None:
+            self._builder.data(data)
+
+    def end(self, tag):
+        if self._builder is not None:
+            self._builder.end(tag)
+            if self._depth > 0:
+                self._depth -= 1
+                return
+            element = self._builder.close()
+            self._builder = None
+            self._handler(self._value, element)
+        elif len(self._path) == 2 and tag == "calculation":
+            self._handler(None, None)
+        self._path.pop()
+
+    def close(self):
+        return None
+
+
+def _parse_rows(elements):
+    """Return numbers in texts of elements as rows of float64 array.
+
+    Texts are joined and converted by one call of numpy instead of
+    making a Python float of each number.
+
+    """
+    if not elements:
+        return np.zeros((0, 0), dtype="double")
+    data = np.fromstring(" ".join([e.text for e in elements]), dtype="double", sep=" ")
+    num_cols = len(elements[0].text.split())
+    if data.size != len(elements) * num_cols:
+        raise ValueError("Numbers in rows could not be read.")
+    return data.reshape(len(elements), num_cols)
 
 
 class VasprunxmlExpat(PhonopyVasprunExpat):
-    def __init__(self, fileptr):
+    _cached_attributes = (
+        "all_forces",
+        "all_stress",
+        "all_points",
+        "all_lattice",
+        "all_energies",
+        "born",
+        "epsilon",
+        "efermi",
+        "symbols",
+    )
+    # Cache is named differently from that of Vasprunxml storing other arrays.
+    _sidecar_name = "expat"
+
+    def __init__(self, fileptr, cache=True):
         """Parsing vasprun.xml by Expat
 
         Args:
@@ -1121,11 +1766,50 @@ class VasprunxmlExpat(PhonopyVasprunExpat):
 
                import io
                io.open(filename, "rb")
+           cache: When True and fileptr is a file, results of a successful
+               parse are cached in "vasprun.xml.expat.npz" next to the
+               file and are read from it later while the file is
+               unchanged.
 
         """
 
         PhonopyVasprunExpat.__init__(self, fileptr)
         self._log = ""
+        self._filename = None
+        if cache and isinstance(getattr(fileptr, "name", None), str):
+            self._filename = fileptr.name
+
+    def parse(self):
+        if self._filename is not None:
+            arrays = read_sidecar(
+                self._filename, name=self._sidecar_name, keys=self._cached_attributes
+            )
+            if arrays is not None:
+                for key in self._cached_attributes:
+                    if arrays[key] is None:
+                        setattr(self, "_" + key, None)
+                    elif key == "symbols":
+                        self._symbols = [str(x) for x in arrays[key]]
+                    elif arrays[key].ndim == 0:
+                        setattr(self, "_" + key, arrays[key].item())
+                    else:
+                        setattr(self, "_" + key, arrays[key])
+                return True
+
+        # Newer phonopy returns None and raises at broken file.
+        try:
+            is_success = PhonopyVasprunExpat.parse(self)
+        except ExpatError:
+            is_success = False
+        if is_success is None:
+            is_success = True
+        if is_success and self._filename is not None:
+            write_sidecar(
+                self._filename,
+                {k: getattr(self, "_" + k, None) for k in self._cached_attributes},
+                name=self._sidecar_name,
+            )
+        return is_success
 
     @property
     def log(self):
@@ -1137,5 +1821,11 @@ class VasprunxmlExpat(PhonopyVasprunExpat):
         cells = []
         if len(self._all_points) == len(self._all_lattice):
             for p, l in zip(self._all_points, self._all_lattice):
-                cells.append(Cell(lattice=l.T, points=p.T, symbols=self._symbols))
+                cells.append(
+                    Cell(
+                        lattice=np.transpose(l),
+                        points=np.transpose(p),
+                        symbols=self._symbols,
+                    )
+                )
         return cells
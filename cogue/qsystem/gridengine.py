@@ -5,6 +5,10 @@
 
 2. The job is submitted to queueing system if number of submitted
    jobs are less then specified max number of jobs. [submitted]
+   Queued jobs fitting in free slots are submitted together by
+   flush() at the end of each cycle. With use_job_array=True, jobs
+   running the same script are submitted as one array job (qsub -t)
+   and the job-ID of each element is (job-ID, task-ID).
    --> Task-ID is removed from self._tid_queue.
    --> Job-ID is mapped to the task-ID by self._tid2jobid.
 
@@ -21,17 +25,27 @@
 __all__ = ["queue", "job"]
 
 import sys
+from xml.etree import ElementTree
 
 from cogue.qsystem.job import JobBase
-from cogue.qsystem.queue import LocalQueueBase, RemoteQueueBase
+from cogue.qsystem.queue import LocalQueueBase, RemoteQueueBase, qstat_cache
 
 
 def queue(
-    max_jobs=None, ssh_shell=None, temporary_dir=None, name=None, sleep_time=None
+    max_jobs=None,
+    ssh_shell=None,
+    temporary_dir=None,
+    name=None,
+    sleep_time=None,
+    use_job_array=False,
+    streaming=False,
+    compress=False,
+    max_transfers=4,
+    dedup_files=("POTCAR",),
 ):
     """Return queue."""
     if ssh_shell is None:
-        return LocalQueue(max_jobs=max_jobs)
+        return LocalQueue(max_jobs=max_jobs, use_job_array=use_job_array)
     elif temporary_dir is not None:
         return RemoteQueue(
             ssh_shell,
@@ -39,6 +53,11 @@ def queue(
             max_jobs=max_jobs,
             name=name,
             sleep_time=sleep_time,
+            use_job_array=use_job_array,
+            streaming=streaming,
+            compress=compress,
+            max_transfers=max_transfers,
+            dedup_files=dedup_files,
         )
 
 
@@ -71,36 +90,73 @@ class Qstat:
     """Qstat mix-in."""
 
     def qstat(self):
-        """qstatout.
+        """Update job states by output of 'qstat -xml'.
 
-        Text of output of 'qstat'
+        The output is shared with the other queues using the same shell
+        through qstat_cache.
 
         """
-        qstat_out = self._shell.run(["qstat"]).output.split(b"\n")
-        self._qstatus = {}
-
-        # subprocess.check_out is new in python 2.7
-        # for line in subprocess.check_output(["qstat"]).split('\n'):
-        for line in qstat_out:
-            if len(line.split()) > 5:
-                jobid = line.split()[0]
-                if jobid.isdigit():
-                    jobid = int(jobid)
-                    s = line[40:44].strip()
-                    self._qstatus[jobid] = s
-                    if s == "r":
-                        self._qstatus[jobid] = "Running"
-                    elif s == "qw":
-                        self._qstatus[jobid] = "Pending"
+        qstat_out = qstat_cache.run(self._shell, ["qstat", "-xml"], caller=self)
+        self._set_qstatus(_parse_qstat_xml(qstat_out))
+
+
+def _parse_qstat_xml(qstat_out):
+    """Return dict of job-id to state parsed from 'qstat -xml'.
+
+    Job-ids of array job elements are (job-id, task-id). None is
+    returned when the output is not parsable.
+
+    """
+    try:
+        root = ElementTree.fromstring(qstat_out)
+    except ElementTree.ParseError:
+        return None
+
+    qstatus = {}
+    for job_list in root.iter("job_list"):
+        jobid = int(job_list.findtext("JB_job_number"))
+        s = job_list.findtext("state", "").strip()
+        if s == "r":
+            s = "Running"
+        elif s == "qw":
+            s = "Pending"
+        tasks = job_list.findtext("tasks")
+        if tasks:
+            for task_id in _parse_ja_task_ids(tasks):
+                qstatus[(jobid, task_id)] = s
+        else:
+            qstatus[jobid] = s
+    return qstatus
+
+
+def _parse_ja_task_ids(text):
+    """Return task-IDs of array job like "5", "1-100:1" or "3,5,7"."""
+    task_ids = []
+    for field in text.strip().split(","):
+        if "-" in field:
+            first, last = field.split("-")
+            step = 1
+            if ":" in last:
+                last, step = last.split(":")
+            task_ids += list(range(int(first), int(last) + 1, int(step)))
+        else:
+            task_ids.append(int(field))
+    return task_ids
 
 
 def _parse_jobid(qsub_out):
-    return int(qsub_out.split()[2])
+    # "Your job 123 (...)" or "Your job-array 123.1-10:1 (...)"
+    return int(qsub_out.split()[2].split(b".")[0])
 
 
 class LocalQueue(LocalQueueBase, Qstat):
-    def __init__(self, max_jobs=None, qsub_command="qsub"):
-        LocalQueueBase.__init__(self, max_jobs=max_jobs, qsub_command=qsub_command)
+    def __init__(self, max_jobs=None, qsub_command="qsub", use_job_array=False):
+        LocalQueueBase.__init__(
+            self,
+            max_jobs=max_jobs,
+            qsub_command=qsub_command,
+            use_job_array=use_job_array,
+        )
 
     def _get_jobid(self, qsub_out):
         return _parse_jobid(qsub_out)
@@ -115,6 +171,11 @@ class RemoteQueue(RemoteQueueBase, Qstat):
         name=None,
         sleep_time=None,
         qsub_command="qsub",
+        use_job_array=False,
+        streaming=False,
+        compress=False,
+        max_transfers=4,
+        dedup_files=("POTCAR",),
     ):
         RemoteQueueBase.__init__(
             self,
@@ -124,6 +185,11 @@ class RemoteQueue(RemoteQueueBase, Qstat):
             name=name,
             sleep_time=sleep_time,
             qsub_command=qsub_command,
+            use_job_array=use_job_array,
+            streaming=streaming,
+            compress=compress,
+            max_transfers=max_transfers,
+            dedup_files=dedup_files,
         )
 
     def _get_jobid(self, qsub_out):
@@ -204,12 +270,70 @@ class Job(JobBase):
         """
 
         w = open(filename, "w")
+        self._write_header(w, self._jobname)
+        w.write("\n")
+
+        w.write(self._script)
+
+        w.close()
+
+    def get_output_files(self):
+        return [name for name in (self._stdout, self._stderr) if name]
+
+    def get_array_key(self):
+        return (
+            self._script,
+            self._shell,
+            self._cwd,
+            self._q,
+            self._l,
+            self._pe,
+            self._stdout,
+            self._stderr,
+        )
+
+    def write_array_script(self, filename, dirs, jobname=None):
+        """
+        #$ -S /bin/zsh
+        #$ -cwd
+        #$ -N NaCl
+        #$ -t 1-2
+        ...
+
+        cd "$SGE_O_WORKDIR/$(sed -n "${SGE_TASK_ID}p" << 'EOF'
+        .
+        ../c00012
+        EOF
+        )"
+        mpirun vasp5212mpi
+        """
+
+        if jobname is None:
+            jobname = self._jobname
+
+        w = open(filename, "w")
+        self._write_header(w, jobname, num_tasks=len(dirs), with_output=False)
+        w.write("\n")
+        w.write('cd "$SGE_O_WORKDIR/$(sed -n "${SGE_TASK_ID}p" << \'EOF\'\n')
+        for directory in dirs:
+            w.write("%s\n" % directory)
+        w.write('EOF\n)"\n')
+        # Standard output and error are written in each directory.
+        self._write_redirection(w)
+
+        w.write(self._script)
+
+        w.close()
+
+    def _write_header(self, w, jobname, num_tasks=None, with_output=True):
         w.write("#$ -S %s\n" % self._shell)
 
         if self._cwd:
             w.write("#$ -cwd\n")
 
-        w.write("#$ -N %s\n" % self._jobname)
+        w.write("#$ -N %s\n" % jobname)
+        if num_tasks:
+            w.write("#$ -t 1-%d\n" % num_tasks)
 
         if self._q:
             w.write("#$ -q %s\n" % self._q)
@@ -217,13 +341,16 @@ class Job(JobBase):
             w.write("#$ -l %s\n" % self._l)
         if self._pe:
             w.write("#$ -pe %s\n" % self._pe)
-        if self._stderr:
+        if self._stderr and with_output:
             w.write("#$ -e %s\n" % self._stderr)
-        if self._stdout:
+        if self._stdout and with_output:
             w.write("#$ -o %s\n" % self._stdout)
 
-        w.write("\n")
-
-        w.write(self._script)
-
-        w.close()
+    def _write_redirection(self, w):
+        redirection = ""
+        if self._stdout:
+            redirection += " >%s" % self._stdout
+        if self._stderr:
+            redirection += " 2>%s" % self._stderr
+        if redirection:
+            w.write("exec%s\n" % redirection)
@@ -1,3 +1,16 @@
+def get_jobid_str(jobid):
+    """Return job-id as text.
+
+    Job-id of an element of array job is a tuple of (job-id, task-id)
+    and is shown as "job-id[task-id]".
+
+    """
+    if isinstance(jobid, tuple):
+        return "%d[%d]" % jobid
+    else:
+        return "%d" % jobid
+
+
 class JobBase:
     def __init__(self):
         self._jobname = None
@@ -11,9 +24,25 @@ class JobBase:
 
     def set_status(self, status, jobid=None):
         if jobid:
-            self._status = "%s (job-id:%d)" % (status, jobid)
+            self._status = "%s (job-id:%s)" % (status, get_jobid_str(jobid))
         else:
             self._status = status
 
     def get_status(self):
         return self._status
+
+    def get_output_files(self):
+        """Return names of files of standard output and error."""
+        return []
+
+    def get_array_key(self):
+        """Return key to find jobs that can be submitted as an array job.
+
+        Jobs having the same key run the same script with the same
+        resources in different directories. None means the job can not
+        be a part of array job. Classes returning a key implement
+        write_array_script(filename, dirs, jobname=None) writing the
+        script of the array job running in ``dirs``.
+
+        """
+        return None
@@ -5,6 +5,10 @@
 
 2. The job is submitted to queueing system if number of submitted
    jobs are less then specified max number of jobs. [submitted]
+   Queued jobs fitting in free slots are submitted together by
+   flush() at the end of each cycle. With use_job_array=True, jobs
+   running the same script are submitted as one array job
+   (-J name[1-N]) and the job-ID of each element is (job-ID, index).
    --> Task-ID is removed from self._tid_queue.
    --> Job-ID is mapped to the task-ID by self._tid2jobid.
 
@@ -20,17 +24,27 @@
 
 __all__ = ["queue", "job"]
 
+import json
 import sys
 
 from cogue.qsystem.job import JobBase
-from cogue.qsystem.queue import LocalQueueBase, RemoteQueueBase
+from cogue.qsystem.queue import LocalQueueBase, RemoteQueueBase, qstat_cache
 
 
 def queue(
-    max_jobs=None, ssh_shell=None, temporary_dir=None, name=None, sleep_time=None
+    max_jobs=None,
+    ssh_shell=None,
+    temporary_dir=None,
+    name=None,
+    sleep_time=None,
+    use_job_array=False,
+    streaming=False,
+    compress=False,
+    max_transfers=4,
+    dedup_files=("POTCAR",),
 ):
     if ssh_shell is None:
-        return LocalQueue(max_jobs=max_jobs)
+        return LocalQueue(max_jobs=max_jobs, use_job_array=use_job_array)
     elif temporary_dir is not None:
         return RemoteQueue(
             ssh_shell,
@@ -38,6 +52,11 @@ def queue(
             max_jobs=max_jobs,
             name=name,
             sleep_time=sleep_time,
+            use_job_array=use_job_array,
+            streaming=streaming,
+            compress=compress,
+            max_transfers=max_transfers,
+            dedup_files=dedup_files,
         )
 
 
@@ -65,25 +84,50 @@ def job(
 
 class Qstat:
     def qstat(self):
-        """qstatout
+        """Update job states by output of 'bjobs -o ... -json'
 
-        Text of output of 'qjobs'
+        The output is shared with the other queues using the same shell
+        through qstat_cache.
 
         """
-        qstat_out = self._shell.run(["qjobs"]).output.split(b"\n")
-        self._qstatus = {}
-
-        for line in qstat_out[1:]:
-            if len(line.split()) > 6:
-                jobid = line.split()[0]
-                if jobid.isdigit():
-                    jobid = int(jobid)
-                    s = line.split()[2]
-                    self._qstatus[jobid] = s
-                    if s == "RUN":
-                        self._qstatus[jobid] = "Running"
-                    elif s == "PEND":
-                        self._qstatus[jobid] = "Pending"
+        qstat_out = qstat_cache.run(
+            self._shell, ["bjobs", "-o", "jobid stat jobindex", "-json"], caller=self
+        )
+        self._set_qstatus(_parse_bjobs_json(qstat_out))
+
+
+def _parse_bjobs_json(qstat_out):
+    """Return dict of job-id to state parsed from 'bjobs -json'.
+
+    Job-ids of array job elements are (job-id, index). Empty output and
+    the message of no job, e.g., "No unfinished job found", give an
+    empty dict. None is returned when the output is not parsable.
+
+    """
+    if not qstat_out.strip() or b"No unfinished job found" in qstat_out:
+        return {}
+    try:
+        records = json.loads(qstat_out)["RECORDS"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    qstatus = {}
+    for record in records:
+        jobid = record.get("JOBID", "")
+        if not jobid.isdigit():
+            continue
+        jobid = int(jobid)
+        s = record.get("STAT", "")
+        if s == "RUN":
+            s = "Running"
+        elif s == "PEND":
+            s = "Pending"
+        index = record.get("JOBINDEX", "")
+        if index.isdigit() and int(index) > 0:
+            qstatus[(jobid, int(index))] = s
+        else:
+            qstatus[jobid] = s
+    return qstatus
 
 
 def _parse_jobid(qsub_out):
@@ -91,8 +135,13 @@ def _parse_jobid(qsub_out):
 
 
 class LocalQueue(LocalQueueBase, Qstat):
-    def __init__(self, max_jobs=None, qsub_command="qsub"):
-        LocalQueueBase.__init__(self, max_jobs=max_jobs, qsub_command=qsub_command)
+    def __init__(self, max_jobs=None, qsub_command="qsub", use_job_array=False):
+        LocalQueueBase.__init__(
+            self,
+            max_jobs=max_jobs,
+            qsub_command=qsub_command,
+            use_job_array=use_job_array,
+        )
 
     def _get_jobid(self, qsub_out):
         return _parse_jobid(qsub_out)
@@ -107,6 +156,11 @@ class RemoteQueue(RemoteQueueBase, Qstat):
         name=None,
         sleep_time=None,
         qsub_command="qsub",
+        use_job_array=False,
+        streaming=False,
+        compress=False,
+        max_transfers=4,
+        dedup_files=("POTCAR",),
     ):
         RemoteQueueBase.__init__(
             self,
@@ -116,6 +170,11 @@ class RemoteQueue(RemoteQueueBase, Qstat):
             name=name,
             sleep_time=sleep_time,
             qsub_command=qsub_command,
+            use_job_array=use_job_array,
+            streaming=streaming,
+            compress=compress,
+            max_transfers=max_transfers,
+            dedup_files=dedup_files,
         )
 
     def _get_jobid(self, qsub_out):
@@ -198,19 +257,78 @@ class Job(JobBase):
         """
 
         w = open(filename, "w")
+        self._write_header(w, self._jobname)
+        w.write("\n")
+
+        w.write(self._script)
+
+        w.close()
+
+    def get_output_files(self):
+        return [name for name in (self._stdout, self._stderr) if name]
+
+    def get_array_key(self):
+        return (
+            self._script,
+            self._shell,
+            self._q,
+            self._A,
+            self._W,
+            self._stdout,
+            self._stderr,
+        )
+
+    def write_array_script(self, filename, dirs, jobname=None):
+        """
+        #!/bin/bash
+        #QSUB -q gr10260f
+        ...
+        #QSUB -J togo[1-2]
+        ...
+
+        cd "$LS_SUBCWD/$(sed -n "${LSB_JOBINDEX}p" << 'EOF'
+        .
+        ../c00012
+        EOF
+        )"
+        module switch impi/4.0.3
+        mpiexec.hydra vasp5.3.5
+        """
+
+        if jobname is None:
+            jobname = self._jobname
+
+        w = open(filename, "w")
+        self._write_header(w, "%s[1-%d]" % (jobname, len(dirs)), with_output=False)
+        w.write("\n")
+        w.write('cd "$LS_SUBCWD/$(sed -n "${LSB_JOBINDEX}p" << \'EOF\'\n')
+        for directory in dirs:
+            w.write("%s\n" % directory)
+        w.write('EOF\n)"\n')
+        # Standard output and error are written in each directory.
+        self._write_redirection(w)
+
+        w.write(self._script)
+
+        w.close()
+
+    def _write_header(self, w, jobname, with_output=True):
         w.write("#!%s\n" % self._shell)
         w.write("#QSUB -q %s\n" % self._q)
         w.write("#QSUB -W %s\n" % self._W)
         w.write("#QSUB -A %s\n" % self._A)
         w.write("#QSUB -rn\n")
-        w.write("#QSUB -J %s\n" % self._jobname)
-        if self._stderr:
+        w.write("#QSUB -J %s\n" % jobname)
+        if self._stderr and with_output:
             w.write("#QSUB -e %s\n" % self._stderr)
-        if self._stdout:
+        if self._stdout and with_output:
             w.write("#QSUB -o %s\n" % self._stdout)
 
-        w.write("\n")
-
-        w.write(self._script)
-
-        w.close()
+    def _write_redirection(self, w):
+        redirection = ""
+        if self._stdout:
+            redirection += " >%s" % self._stdout
+        if self._stderr:
+            redirection += " 2>%s" % self._stderr
+        if redirection:
+            w.write("exec%s\n" % redirection)
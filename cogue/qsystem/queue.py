@@ -1,13 +1,57 @@
 """Queue classes."""
 import datetime
+import fnmatch
+import hashlib
 import os
 import shlex
 import shutil
 import sys
 import tarfile
+import threading
 import time
 import traceback
-from subprocess import check_output
+import weakref
+
+from cogue.qsystem.job import get_jobid_str
+from cogue.qsystem.ssh import get_session, get_shell_key
+from cogue.qsystem.transfer import TransferPool
+
+# Line printed before output of each qsub in batch submission script
+_QSUB_MARKER = "##cogue-tid"
+
+
+def _get_shasum(filename):
+    """Return SHA-1 digest in hex as shasum command prints."""
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest().encode()
+
+
+def _extract_tar(tar_filename, path):
+    """Extract tar file refusing members out of path."""
+    with tarfile.open(tar_filename) as tar:
+
+        def is_within_directory(directory, target):
+
+            abs_directory = os.path.abspath(directory)
+            abs_target = os.path.abspath(target)
+
+            prefix = os.path.commonprefix([abs_directory, abs_target])
+
+            return prefix == abs_directory
+
+        def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
+
+            for member in tar.getmembers():
+                member_path = os.path.join(path, member.name)
+                if not is_within_directory(path, member_path):
+                    raise Exception("Attempted Path Traversal in Tar File")
+
+            tar.extractall(path, members, numeric_owner=numeric_owner)
+
+        safe_extract(tar, path=path)
 
 
 def get_time():
@@ -15,6 +59,61 @@ def get_time():
     return datetime.datetime.today().strftime("%H:%M:%S")
 
 
+class QstatCache:
+    """Snapshot of output of job listing commands shared in process
+
+    Queues using the same host and command, e.g., those of AutoCalcs
+    running in one process, share snapshots. A queue calls run once per
+    cycle and reuses the latest snapshot when it was taken after the one
+    the queue used in its previous cycle. Otherwise the command is run,
+    and the new snapshot is reused by the other queues in their cycles.
+    So each cycle sees states newer than those of its previous cycle,
+    and queues polling at the same time run the command once. Snapshots
+    are discarded by clear() when jobs are submitted, since they do not
+    contain the new jobs.
+
+    """
+
+    def __init__(self):
+        """Init method."""
+        self._snapshots = {}
+        self._num_snapshots = 0
+        self._used = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def run(self, shell, command, caller=None):
+        """Return output of command run by shell.
+
+        Parameters
+        ----------
+        caller : object, optional
+            Queue calling in each cycle. Without it, a snapshot is reused
+            until cleared.
+
+        """
+        key = (get_shell_key(shell), tuple(command))
+        with self._lock:
+            if caller is None:
+                used = {}
+            else:
+                used = self._used.setdefault(caller, {})
+            snapshot = self._snapshots.get(key)
+            if snapshot is None or snapshot[0] <= used.get(key, 0):
+                self._num_snapshots += 1
+                output = shell.run(command, allow_error=True).output
+                snapshot = (self._num_snapshots, output)
+                self._snapshots[key] = snapshot
+            used[key] = snapshot[0]
+            return snapshot[1]
+
+    def clear(self):
+        """Clear snapshots."""
+        self._snapshots = {}
+
+
+qstat_cache = QstatCache()
+
+
 class EmptyQueue:
     """EmptyQueue class."""
 
@@ -30,10 +129,26 @@ class EmptyQueue:
         """Submit."""
         pass
 
+    def flush(self):
+        """Flush."""
+        return []
+
     def qstat(self):
         """Qstat."""
         pass
 
+    def get_changed_tids(self):
+        """Return tids whose job state changed."""
+        return set()
+
+    def get_jobid(self, tid):
+        """Return job-id."""
+        return None
+
+    def reattach(self, task, jobid):
+        """Reattach."""
+        pass
+
     def set_max_jobs(self, max_jobs):
         """Set max jobs."""
         pass
@@ -46,52 +161,275 @@ class EmptyQueue:
 class QueueBase:
     """Queue base class."""
 
-    def __init__(self, max_jobs=None):
+    def __init__(self, max_jobs=None, use_job_array=False):
         """Init method."""
         self._max_jobs = max_jobs
+        self._use_job_array = use_job_array
         self._qstatus = None
         self._tid_queue = []
+        self._tid2task = {}
         self._tid2jobid = {}
+        self._tid2qstatus = {}
+        self._qstatus_lines = None
         self._shell = None
         self._shell_type = None
 
     def register(self, task):
         """Register."""
         if task.get_traverse() is False:
-            self._tid_queue.append(task.get_tid())
+            tid = task.get_tid()
+            self._tid_queue.append(tid)
+            self._tid2task[tid] = task
             job = task.get_job()
             job.set_status("preparing")
 
+    def get_jobid(self, tid):
+        """Return job-id of task or None if not submitted."""
+        if tid in self._tid2jobid:
+            return self._tid2jobid[tid]
+        else:
+            return None
+
+    def reattach(self, task, jobid):
+        """Reattach task to job submitted before restart of controller."""
+        tid = task.get_tid()
+        self._tid2jobid[tid] = jobid
+        self._tid2task[tid] = task
+        task.get_job().set_status("submitted", jobid)
+
     def write_qstatus(self, name):
-        """Write qstatus."""
-        with open("%s.qstat" % name, "w") as f_qstat:
-            f_qstat.write("%8s %8s %8s\n" % ("tid", "jobid", "status"))
-            for tid in self._tid_queue:
-                f_qstat.write("%8d %8s %8s\n" % (tid, "None", "Queued"))
+        """Write qstatus.
 
-            for tid in self._tid2jobid:
-                jobid = self._tid2jobid[tid]
-                if jobid in self._qstatus:
-                    f_qstat.write("%8d %8d %8s\n" % (tid, jobid, self._qstatus[jobid]))
+        The file is rewritten only when its contents change, and it is
+        replaced atomically.
 
-    def submit(self):
-        """Submit."""
-        pass
+        """
+        lines = ["%8s %8s %8s\n" % ("tid", "jobid", "status")]
+        for tid in self._tid_queue:
+            lines.append("%8d %8s %8s\n" % (tid, "None", "Queued"))
+
+        for tid in self._tid2jobid:
+            jobid = self._tid2jobid[tid]
+            if self._qstatus is None:
+                lines.append("%8d %8s %8s\n" % (tid, get_jobid_str(jobid), "Unknown"))
+            elif jobid in self._qstatus:
+                lines.append(
+                    "%8d %8s %8s\n" % (tid, get_jobid_str(jobid), self._qstatus[jobid])
+                )
+
+        if lines == self._qstatus_lines:
+            return
+        self._qstatus_lines = lines
+        filename = "%s.qstat" % name
+        with open("%s.tmp" % filename, "w") as f_qstat:
+            f_qstat.writelines(lines)
+        os.replace("%s.tmp" % filename, filename)
+
+    def submit(self, task):
+        """Update job status of task by the latest qstat.
+
+        Jobs are not submitted here but queued until flush is called.
+
+        """
+        if task.get_traverse() is not False:
+            return
+
+        self._set_job_status(task.get_job(), task.get_tid())
+
+    def flush(self):
+        """Submit queued jobs that fit in the free slots at once.
+
+        The number of free slots is computed once, and the jobs are
+        submitted in the order of registration by one shell process (one
+        SSH session for remote queues). Jobs whose submission failed stay
+        in the queue and are retried at the next call.
+
+        When job array is used, jobs having the same array key (see
+        JobBase.get_array_key) are submitted as one array job, and the
+        job-id of each of them is (job-id, task-id).
+
+        Returns
+        -------
+        list of int
+            Task-IDs of submitted jobs.
+
+        """
+        tids = self._tid_queue[: self._get_num_free_slots()]
+        if not tids:
+            return []
+
+        tasks = [self._tid2task[tid] for tid in tids]
+        for task in tasks:
+            task.get_job().set_status("ready")
+
+        arrays = []
+        if self._use_job_array:
+            arrays, tasks = self._group_array_tasks(tasks)
+        submitted_tasks = []
+        jobids = []
+        for array_tasks in arrays:
+            submitted_tasks += array_tasks
+            jobids += self._submit_array(array_tasks)
+        if tasks:
+            submitted_tasks += tasks
+            jobids += self._submit_tasks(tasks)
+
+        qstat_cache.clear()
+        submitted = []
+        for task, jobid in zip(submitted_tasks, jobids):
+            tid = task.get_tid()
+            job = task.get_job()
+            if jobid is None:
+                job.set_status("preparing")
+            else:
+                self._tid2jobid[tid] = jobid
+                self._tid_queue.remove(tid)
+                job.set_status("submitted", jobid)
+                submitted.append(tid)
+        return sorted(submitted)
+
+    def get_changed_tids(self):
+        """Return tids whose job state can have changed.
+
+        Jobs whose state in the latest qstat differs from that seen at
+        the previous call, including jobs that left the queueing system,
+        are returned.
+
+        """
+        changed = set()
+        if self._qstatus is not None:
+            for tid, jobid in self._tid2jobid.items():
+                s = self._qstatus.get(jobid)
+                if tid not in self._tid2qstatus or self._tid2qstatus[tid] != s:
+                    self._tid2qstatus[tid] = s
+                    changed.add(tid)
+            for tid in list(self._tid2qstatus):
+                if tid not in self._tid2jobid:
+                    del self._tid2qstatus[tid]
+
+        return changed
 
     def set_max_jobs(self, max_jobs):
         """Set max jobs."""
         self._max_jobs = max_jobs
 
+    def _set_qstatus(self, qstatus):
+        """Set job states parsed from output of qstat.
+
+        Unparsable output (None) is ignored to keep the previous states,
+        otherwise all jobs would be recognized as finished. Before the
+        first parsable output, states of jobs are unknown and are not
+        updated, and qstat is retried in the next cycle.
+
+        """
+        if qstatus is None:
+            date = datetime.datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+            print("%s: Output of qstat could not be parsed." % date)
+        else:
+            self._qstatus = qstatus
+
+    def _get_work_dir(self, task):
+        """Return directory where files of task are located."""
+        work_dir = task.get_work_dir()
+        if work_dir is None:
+            return "."
+        else:
+            return work_dir
+
+    def _group_array_tasks(self, tasks):
+        """Return groups of tasks for array jobs and the other tasks."""
+        key2tasks = {}
+        for task in tasks:
+            key = task.get_job().get_array_key()
+            if key is not None:
+                key2tasks.setdefault(key, []).append(task)
+
+        arrays = []
+        in_array = set()
+        for array_tasks in key2tasks.values():
+            if len(array_tasks) > 1:
+                arrays.append(array_tasks)
+                in_array.update([task.get_tid() for task in array_tasks])
+        singles = [task for task in tasks if task.get_tid() not in in_array]
+        return arrays, singles
+
+    def _write_array_script(self, tasks, filename, dirs):
+        """Write script of array job with name common to the jobs."""
+        jobnames = [task.get_job().get_jobname() for task in tasks]
+        jobname = os.path.commonprefix(jobnames).rstrip("-_")
+        if not jobname:
+            jobname = jobnames[0]
+        tasks[0].get_job().write_array_script(filename, dirs, jobname=jobname)
+
+    def _get_array_jobids(self, jobid, num_tasks):
+        if jobid is None:
+            return [None] * num_tasks
+        else:
+            return [(jobid, i + 1) for i in range(num_tasks)]
+
+    def _get_num_free_slots(self):
+        if self._max_jobs:
+            return max(self._max_jobs - len(self._tid2jobid), 0)
+        else:
+            return len(self._tid_queue)
+
+    def _get_qsub_script(
+        self, tids, dirs, commands=None, job_script="job.sh", dir_commands=None
+    ):
+        """Return shell script to submit jobs in directories at once.
+
+        ``commands`` are run in each directory before qsub, followed by
+        ``dir_commands`` given for each directory. The script exits with
+        0 so that failure of one submission does not make the others be
+        submitted again.
+
+        """
+        lines = []
+        for i, (tid, directory) in enumerate(zip(tids, dirs)):
+            line = "(cd %s && " % shlex.quote(directory)
+            line_commands = list(commands or [])
+            if dir_commands:
+                line_commands += dir_commands[i]
+            if line_commands:
+                line += " && ".join(line_commands) + " && "
+            line += "echo '%s %d' && %s %s)" % (
+                _QSUB_MARKER,
+                tid,
+                self._qsub_command,
+                job_script,
+            )
+            lines.append(line)
+        lines.append("exit 0")
+        return "\n".join(lines)
+
+    def _parse_qsub_script_output(self, output, tids):
+        """Return job-ids parsed from output of qsub script.
+
+        None is returned for the jobs whose submission failed.
+
+        """
+        tid2out = {}
+        tid = None
+        for line in output.split(b"\n"):
+            if line.startswith(_QSUB_MARKER.encode()):
+                tid = int(line.split()[1])
+                tid2out[tid] = b""
+            elif tid is not None:
+                tid2out[tid] += line + b"\n"
+
+        jobids = []
+        for tid in tids:
+            try:
+                jobids.append(self._get_jobid(tid2out[tid]))
+            except (KeyError, IndexError, ValueError):
+                date = datetime.datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+                print("%s: submission of tid-%05d failed." % (date, tid))
+                jobids.append(None)
+        return jobids
+
     def _set_job_status(self, job, tid):
-        if "preparing" in job.get_status():
-            if tid == self._tid_queue[0]:
-                will_submit = True
-                if self._max_jobs:
-                    if len(self._tid2jobid) > self._max_jobs:
-                        will_submit = False
-
-                if will_submit:
-                    job.set_status("ready")
+        if "preparing" in job.get_status() or self._qstatus is None:
+            return
         else:
             jobid = self._tid2jobid[tid]
             if jobid in self._qstatus:
@@ -99,13 +437,14 @@ class QueueBase:
                     job.set_status("running", jobid)
             else:
                 del self._tid2jobid[tid]
+                del self._tid2task[tid]
                 job.set_status("done")
 
 
 class LocalQueueBase(QueueBase):
     """LocalQueue base class."""
 
-    def __init__(self, max_jobs=None, qsub_command="qsub"):
+    def __init__(self, max_jobs=None, qsub_command="qsub", use_job_array=False):
         """Init method."""
         try:
             import spur
@@ -113,34 +452,63 @@ class LocalQueueBase(QueueBase):
             print("You need to install spur.")
             exit(1)
 
-        QueueBase.__init__(self, max_jobs=max_jobs)
+        QueueBase.__init__(self, max_jobs=max_jobs, use_job_array=use_job_array)
         self._qsub_command = qsub_command
         self._shell = spur.LocalShell()
 
-    def submit(self, task):
-        """Submit."""
-        if task.get_traverse() is not False:
-            return
-
-        job = task.get_job()
-        tid = task.get_tid()
-        self._set_job_status(job, tid)
-        if "ready" in job.get_status():
-            job.write_script()
-            if task.get_traverse():
-                jobid = None
-            else:
-                qsub_out = self._shell.run(
-                    shlex.split(self._qsub_command + " " + "job.sh"), cwd=os.getcwd()
-                ).output
-                jobid = self._get_jobid(qsub_out)
-            self._tid2jobid[tid] = jobid
-            self._tid_queue.pop(0)
-            job.set_status("submitted", jobid)
+    def _submit_tasks(self, tasks):
+        tids = [task.get_tid() for task in tasks]
+        dirs = [os.path.abspath(self._get_work_dir(task)) for task in tasks]
+        for task, work_dir in zip(tasks, dirs):
+            task.get_job().write_script(os.path.join(work_dir, "job.sh"))
+        qsub_out = self._shell.run(
+            ["sh", "-c", self._get_qsub_script(tids, dirs)]
+        ).output
+        return self._parse_qsub_script_output(qsub_out, tids)
+
+    def _submit_array(self, tasks):
+        tids = [task.get_tid() for task in tasks]
+        dirs = [os.path.abspath(self._get_work_dir(task)) for task in tasks]
+        for task, work_dir in zip(tasks, dirs):
+            task.get_job().write_script(os.path.join(work_dir, "job.sh"))
+        self._write_array_script(
+            tasks,
+            os.path.join(dirs[0], "array-job.sh"),
+            [os.path.relpath(d, dirs[0]) for d in dirs],
+        )
+        qsub_out = self._shell.run(
+            [
+                "sh",
+                "-c",
+                self._get_qsub_script(tids[:1], dirs[:1], job_script="array-job.sh"),
+            ]
+        ).output
+        jobid = self._parse_qsub_script_output(qsub_out, tids[:1])[0]
+        return self._get_array_jobids(jobid, len(tasks))
 
 
 class RemoteQueueBase(QueueBase):
-    """RemoreQueue base class."""
+    """RemoreQueue base class.
+
+    Files are transferred as cogue.tar by default. With streaming=True,
+    tar stream is made and extracted on the fly by python3 on the remote
+    side, and no archive file is written on either side.
+
+    After job finished, only files declared by the task (see
+    TaskBase.get_collect_files) and the files of standard output and
+    error of the job are brought back, and files identical to the local
+    ones are skipped. With compress=True, they are gzipped in flight.
+
+    Transfers of files of many tasks run concurrently up to
+    ``max_transfers`` (see TransferPool). Files of jobs that are found
+    finished by qstat are collected together at that time.
+
+    Files named in ``dedup_files`` are sent once for each content to
+    blobs/<SHA-1> in the remote working directory and are hardlinked
+    from there into the task directories. Such files must not be
+    modified by jobs.
+
+    """
 
     def __init__(
         self,
@@ -150,11 +518,24 @@ class RemoteQueueBase(QueueBase):
         name=None,
         sleep_time=None,
         qsub_command="qsub",
+        use_job_array=False,
+        streaming=False,
+        compress=False,
+        max_transfers=4,
+        dedup_files=("POTCAR",),
     ):
         """Init method."""
-        QueueBase.__init__(self, max_jobs=max_jobs)
+        QueueBase.__init__(self, max_jobs=max_jobs, use_job_array=use_job_array)
         self._qsub_command = qsub_command
+        self._streaming = streaming
+        self._compress = compress
+        self._transfer_pool = TransferPool(max_workers=max_transfers)
+        self._collected_tids = set()
+        self._dedup_files = dedup_files
+        self._remote_blobs = None
+        self._digests = {}
         self._shell = ssh_shell
+        self._session = get_session(ssh_shell)
         self._name = name
         if sleep_time is None:
             self._sleep_time = 0.1
@@ -172,147 +553,411 @@ class RemoteQueueBase(QueueBase):
             self._working_dir = "%s" % temporary_dir
 
     def submit(self, task):
-        """Submit."""
+        """Update job status and collect files of finished job.
+
+        Files of jobs found finished by qstat have been already collected
+        together.
+
+        """
         if task.get_traverse() is not False:
             return
 
-        job = task.get_job()
-        tid = task.get_tid()
-        self._set_job_status(job, tid)
+        QueueBase.submit(self, task)
+        if "done" in task.get_job().get_status():
+            tid = task.get_tid()
+            if tid in self._collected_tids:
+                self._collected_tids.remove(tid)
+            else:
+                self._collect([task])
+
+    def _submit_tasks(self, tasks):
+        """Send files of tasks and submit them in one SSH session."""
+        tids = [task.get_tid() for task in tasks]
+        remote_dirs = ["%s/c%05d" % (self._working_dir, tid) for tid in tids]
+        link_commands = self._send(tasks, remote_dirs)
+
+        script = self._get_qsub_script(
+            tids,
+            remote_dirs,
+            commands=self._get_extract_commands(),
+            dir_commands=link_commands,
+        )
+        qsub_out = self._shell_run(["sh", "-c", script]).output
+        return self._parse_qsub_script_output(qsub_out, tids)
+
+    def _submit_array(self, tasks):
+        """Send files of tasks and submit them as an array job."""
+        tids = [task.get_tid() for task in tasks]
+        remote_dirs = ["%s/c%05d" % (self._working_dir, tid) for tid in tids]
+        self._write_array_script(
+            tasks,
+            os.path.join(self._get_work_dir(tasks[0]), "array-job.sh"),
+            ["."] + ["../c%05d" % tid for tid in tids[1:]],
+        )
+        link_commands = self._send(tasks, remote_dirs)
+
+        lines = []
+        for remote_dir, commands in zip(remote_dirs[1:], link_commands[1:]):
+            commands = (self._get_extract_commands() or []) + commands
+            if commands:
+                lines.append(
+                    "(cd %s && %s)" % (shlex.quote(remote_dir), " && ".join(commands))
+                )
+        lines.append(
+            self._get_qsub_script(
+                tids[:1],
+                remote_dirs[:1],
+                commands=self._get_extract_commands(),
+                job_script="array-job.sh",
+                dir_commands=link_commands[:1],
+            )
+        )
+        qsub_out = self._shell_run(["sh", "-c", "\n".join(lines)]).output
+        jobid = self._parse_qsub_script_output(qsub_out, tids[:1])[0]
+        return self._get_array_jobids(jobid, len(tasks))
 
-        if "ready" in job.get_status():
-            self._submit(task)
-        elif "done" in job.get_status():
-            self._collect(task)
+    def get_transfer_pool(self):
+        return self._transfer_pool
 
-    def _submit(self, task):
-        job = task.get_job()
-        tid = task.get_tid()
-        remote_dir = "%s/c%05d" % (self._working_dir, tid)
-        task_log = task.get_log()
+    def _set_qstatus(self, qstatus):
+        QueueBase._set_qstatus(self, qstatus)
+        self._collect_finished()
 
-        job.write_script()
-        self._shell_run(["mkdir", "-p", remote_dir])
+    def _get_extract_commands(self):
+        if self._streaming:
+            return None
+        else:
+            return ["tar xf cogue.tar", "rm cogue.tar"]
+
+    def _send(self, tasks, remote_dirs):
+        """Send files of tasks to remote directories.
+
+        Remote directories are made by one command, and files of tasks
+        are sent concurrently by the transfer pool.
+
+        Returns
+        -------
+        list of list of str
+            Commands to be run in each remote directory after extraction
+            to hardlink files that were not sent from remote blobs.
+
+        """
+        self._shell_run(["mkdir", "-p"] + remote_dirs)
+        task_blobs = self._send_blobs(tasks)
+        transfers = []
+        link_commands = []
+        for task, remote_dir, blobs in zip(tasks, remote_dirs, task_blobs):
+            work_dir = self._get_work_dir(task)
+            task.get_job().write_script(os.path.join(work_dir, "job.sh"))
+            if self._streaming:
+                transfers.append(self._get_stream_upload(task, remote_dir, blobs))
+            else:
+                transfers.append(self._get_tar_upload(task, remote_dir, blobs))
+            link_commands.append(
+                [
+                    "(ln -f ../blobs/%s %s 2>/dev/null || cp ../blobs/%s %s)"
+                    % (digest, shlex.quote(name), digest, shlex.quote(name))
+                    for name, digest in sorted(blobs.items())
+                ]
+            )
+        self._run_transfers(tasks, transfers)
+
+        for task in tasks:
+            tar_filename = os.path.join(self._get_work_dir(task), "cogue.tar")
+            if os.path.exists(tar_filename):
+                os.remove(tar_filename)
+
+        return link_commands
+
+    def _send_blobs(self, tasks):
+        """Send files in dedup_files whose contents are not on remote yet.
+
+        Returns
+        -------
+        list of dict
+            Names of files of each task found in remote blobs mapped to
+            their digests. Files whose blobs could not be sent are not
+            included and are sent with the other files.
+
+        """
+        blob_dir = "%s/blobs" % self._working_dir
+        if self._remote_blobs is None:
+            if not self._dedup_files:
+                self._remote_blobs = set()
+                return [{} for task in tasks]
+            script = "mkdir -p %s && ls %s" % ((shlex.quote(blob_dir),) * 2)
+            output = self._shell_run(["sh", "-c", script]).output
+            self._remote_blobs = set(output.decode("utf-8").split())
+
+        task_digests = []
+        filenames = {}
+        for task in tasks:
+            work_dir = self._get_work_dir(task)
+            digests = {}
+            for name in self._dedup_files:
+                filename = os.path.join(work_dir, name)
+                if os.path.isfile(filename):
+                    digests[name] = self._get_digest(filename)
+                    if digests[name] not in self._remote_blobs:
+                        filenames[digests[name]] = filename
+            task_digests.append(digests)
+
+        digests = sorted(filenames)
+        results = self._transfer_pool.run(
+            [self._get_blob_upload(filenames[d], blob_dir, d) for d in digests]
+        )
+        for digest, succeeded in zip(digests, results):
+            if succeeded:
+                self._remote_blobs.add(digest)
+
+        return [
+            dict([(n, d) for n, d in digests.items() if d in self._remote_blobs])
+            for digests in task_digests
+        ]
 
-        with tarfile.open("cogue.tar", "w") as tar:
-            for name in os.listdir("."):
-                tar.add(name)
+    def _get_blob_upload(self, filename, blob_dir, digest):
+        """Return transfer sending file to blobs/<digest> on remote."""
+        size = os.path.getsize(filename)
 
-        for i in range(20):
-            with open("cogue.tar", "rb") as local_file:
-                with self._shell.open(
-                    "%s/%s" % (remote_dir, "cogue.tar"), "wb"
+        def transfer():
+            with open(filename, "rb") as local_file:
+                with self._session.open(
+                    "%s/%s.part" % (blob_dir, digest), "wb"
                 ) as remote_file:
                     shutil.copyfileobj(local_file, remote_file)
-                    time.sleep(self._sleep_time)
-
-            shasum_l = check_output(["shasum", "cogue.tar"]).split()[0]
-            shasum_r = self._shell_run(
-                ["shasum", "cogue.tar"], cwd=remote_dir
-            ).output.split()[0]
-            task_log += "    copy local %s -> remote %s (%s tid-%05d)\n" % (
-                shasum_l[:8],
-                shasum_r[:8],
+            time.sleep(self._sleep_time)
+            if self._get_remote_shasum(blob_dir, "%s.part" % digest) != digest.encode():
+                return False, size
+            self._shell_run(["mv", "%s.part" % digest, digest], cwd=blob_dir)
+            return True, size
+
+        return transfer
+
+    def _get_digest(self, filename):
+        """Return SHA-1 digest of file, computed once for each inode."""
+        st = os.stat(filename)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        if key not in self._digests:
+            self._digests[key] = _get_shasum(filename).decode()
+        return self._digests[key]
+
+    def _collect_finished(self):
+        """Collect files of jobs that left queueing system concurrently."""
+        if self._qstatus is None:
+            return
+        tasks = []
+        for tid, jobid in self._tid2jobid.items():
+            if jobid in self._qstatus or tid in self._collected_tids:
+                continue
+            if tid in self._tid2task:
+                tasks.append(self._tid2task[tid])
+        self._collect(tasks)
+
+    def _collect(self, tasks):
+        transfers = []
+        for task in tasks:
+            tid = task.get_tid()
+            self._collected_tids.add(tid)
+            remote_dir = "%s/c%05d" % (self._working_dir, tid)
+            if self._streaming:
+                transfers.append(self._get_stream_download(task, remote_dir))
+            else:
+                transfers.append(self._get_tar_download(task, remote_dir))
+        self._run_transfers(tasks, transfers)
+
+    def _run_transfers(self, tasks, transfers):
+        results = self._transfer_pool.run(transfers)
+        for task, succeeded in zip(tasks, results):
+            task_log = "    %s (%s tid-%05d)\n" % (
+                self._transfer_pool.get_last_summary(),
                 get_time(),
-                tid,
+                task.get_tid(),
             )
-
-            if shasum_r == shasum_l:
-                break
-            else:
-                err_log = (
-                    "    copying to remote, waiting for 10s..."
-                    " (%s tid-%05d)\n" % (get_time(), tid)
+            if not succeeded:
+                task_log += "    transfer failed, gave up (%s tid-%05d)\n" % (
+                    get_time(),
+                    task.get_tid(),
                 )
-                sys.stderr.write(err_log)
-                task_log += err_log
-                time.sleep(10)
-
-        os.remove("cogue.tar")
-        self._shell_run(["tar", "xvf", "cogue.tar"], cwd=remote_dir)
-        self._shell_run(["rm", "cogue.tar"], cwd=remote_dir)
-
-        if task.get_traverse():
-            jobid = None
-        else:
-            qsub_out = self._shell_run(
-                shlex.split(self._qsub_command + " " + "job.sh"), cwd=remote_dir
-            ).output
-            jobid = self._get_jobid(qsub_out)
-        self._tid2jobid[tid] = jobid
-        self._tid_queue.pop(0)
-        job.set_status("submitted", jobid)
-
-        task.set_log(task_log)
-
-    def _collect(self, task):
-        tid = task.get_tid()
-        remote_dir = "%s/c%05d" % (self._working_dir, tid)
-        task_log = task.get_log()
+            task.set_log(task.get_log() + task_log)
+        return results
 
+    def _get_tar_upload(self, task, remote_dir, exclude=()):
+        """Return transfer sending files of task as cogue.tar."""
+        work_dir = self._get_work_dir(task)
+        tar_filename = os.path.join(work_dir, "cogue.tar")
         names = [
-            filename.decode("utf-8")
-            for filename in self._shell_run(["/bin/ls"], cwd=remote_dir).output.split()
+            name
+            for name in os.listdir(work_dir)
+            if name != "cogue.tar" and name not in exclude
         ]
-        self._shell_run(["tar", "cvf", "cogue.tar"] + names, cwd=remote_dir)
+        with tarfile.open(tar_filename, "w") as tar:
+            for name in names:
+                tar.add(os.path.join(work_dir, name), arcname=name)
+        shasum_l = _get_shasum(tar_filename)
+        size = os.path.getsize(tar_filename)
+
+        def transfer():
+            with open(tar_filename, "rb") as local_file:
+                with self._session.open(
+                    "%s/%s" % (remote_dir, "cogue.tar"), "wb"
+                ) as remote_file:
+                    shutil.copyfileobj(local_file, remote_file)
+            time.sleep(self._sleep_time)
+            shasum_r = self._get_remote_shasum(remote_dir)
+            return self._log_transfer(task, "copy", shasum_l, "->", shasum_r), size
+
+        return transfer
 
-        for i in range(20):
-            with open("cogue.tar", "wb") as local_file:
-                with self._shell.open(
+    def _get_tar_download(self, task, remote_dir):
+        """Return transfer bringing back files of task as cogue.tar."""
+        tid = task.get_tid()
+        work_dir = self._get_work_dir(task)
+        tar_filename = os.path.join(work_dir, "cogue.tar")
+        if self._compress:
+            tar_options = "czf"
+        else:
+            tar_options = "cf"
+        collect_names = []
+
+        def transfer():
+            if not collect_names:
+                collect_names.append(self._get_collect_names(task, remote_dir))
+            names = collect_names[0]
+            if not names:
+                return True, 0
+
+            # Archive is made outside and moved in not to include itself.
+            result = self._session.run_script(
+                [
+                    (
+                        "rm -f cogue.tar && tar %s ../c%05d.tar -- %s && "
+                        "mv ../c%05d.tar cogue.tar && shasum cogue.tar"
+                        % (
+                            tar_options,
+                            tid,
+                            " ".join([shlex.quote(name) for name in names]),
+                            tid,
+                        ),
+                        remote_dir,
+                    )
+                ]
+            )[0]
+            shasum_r = (result.output.split() or [b""])[0]
+            with open(tar_filename, "wb") as local_file:
+                with self._session.open(
                     "%s/%s" % (remote_dir, "cogue.tar"), "rb"
                 ) as remote_file:
                     shutil.copyfileobj(remote_file, local_file)
-                    time.sleep(self._sleep_time)
-
-            shasum_r = self._shell_run(
-                ["shasum", "cogue.tar"], cwd=remote_dir
-            ).output.split()[0]
-
-            shasum_l = check_output(["shasum", "cogue.tar"]).split()[0]
-            task_log += "    copy local %s <- remote %s (%s tid-%05d)\n" % (
-                shasum_l[:8],
-                shasum_r[:8],
-                get_time(),
-                tid,
+            time.sleep(self._sleep_time)
+            shasum_l = _get_shasum(tar_filename)
+            size = os.path.getsize(tar_filename)
+            if not self._log_transfer(task, "copy", shasum_l, "<-", shasum_r):
+                return False, size
+
+            _extract_tar(tar_filename, work_dir)
+            os.remove(tar_filename)
+            self._session.remove("%s/%s" % (remote_dir, "cogue.tar"))
+            return True, size
+
+        return transfer
+
+    def _get_stream_upload(self, task, remote_dir, exclude=()):
+        """Return transfer sending files of task by streaming tar."""
+        work_dir = self._get_work_dir(task)
+
+        def transfer():
+            digest_l, digest_r, size = self._session.put_dir(
+                work_dir, remote_dir, exclude=("cogue.tar",) + tuple(exclude)
             )
+            return self._log_transfer(task, "stream", digest_l, "->", digest_r), size
 
-            if shasum_r == shasum_l:
-                break
-            else:
-                err_log = (
-                    "    copying from remote, waiting for 10s..."
-                    " (%s tid-%05d)\n" % (get_time(), tid)
-                )
-                sys.stderr.write(err_log)
-                task_log += err_log
-                time.sleep(10)
-
-        with tarfile.open("cogue.tar") as tar:
-
-            def is_within_directory(directory, target):
-
-                abs_directory = os.path.abspath(directory)
-                abs_target = os.path.abspath(target)
-
-                prefix = os.path.commonprefix([abs_directory, abs_target])
-
-                return prefix == abs_directory
+        return transfer
 
-            def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
+    def _get_stream_download(self, task, remote_dir):
+        """Return transfer bringing back files of task by streaming tar."""
+        work_dir = self._get_work_dir(task)
+        collect_names = []
 
-                for member in tar.getmembers():
-                    member_path = os.path.join(path, member.name)
-                    if not is_within_directory(path, member_path):
-                        raise Exception("Attempted Path Traversal in Tar File")
+        def transfer():
+            if not collect_names:
+                collect_names.append(self._get_collect_names(task, remote_dir))
+            names = collect_names[0]
+            if not names:
+                return True, 0
 
-                tar.extractall(path, members, numeric_owner=numeric_owner)
-
-            safe_extract(tar)
-
-        os.remove("cogue.tar")
-        self._shell_run(["rm", "cogue.tar"], cwd=remote_dir)
+            digest_l, digest_r, size = self._session.get_dir(
+                remote_dir, work_dir, names=names, compress=self._compress
+            )
+            return self._log_transfer(task, "stream", digest_l, "<-", digest_r), size
+
+        return transfer
+
+    def _get_remote_shasum(self, remote_dir, filename="cogue.tar"):
+        result = self._session.run_script([(["shasum", filename], remote_dir)])[0]
+        return (result.output.split() or [b""])[0]
+
+    def _log_transfer(self, task, method, digest_l, direction, digest_r):
+        """Write digests of both sides in task log and return if they agree."""
+        task_log = "    %s local %s %s remote %s (%s tid-%05d)\n" % (
+            method,
+            digest_l[:8],
+            direction,
+            digest_r[:8],
+            get_time(),
+            task.get_tid(),
+        )
+        verified = digest_l == digest_r
+        if not verified:
+            err_log = "    %s failed, retrying... (%s tid-%05d)\n" % (
+                method,
+                get_time(),
+                task.get_tid(),
+            )
+            sys.stderr.write(err_log)
+            task_log += err_log
+        task.set_log(task.get_log() + task_log)
+        return verified
+
+    def _get_collect_names(self, task, remote_dir):
+        """Return names of remote files to be collected.
+
+        Remote files matching the patterns of the task are listed with
+        their checksums by one command, and those having the same
+        checksums as the local files are excluded.
+
+        """
+        patterns = task.get_collect_files()
+        if patterns is None:
+            patterns = ["*"]
+        else:
+            patterns = list(patterns) + task.get_job().get_output_files()
+        excludes = list(task.get_collect_excludes()) + ["cogue.tar"]
+        result = self._session.run_script(
+            [("shasum -- %s 2>/dev/null" % " ".join(patterns), remote_dir)]
+        )[0]
+
+        work_dir = self._get_work_dir(task)
+        names = []
+        num_unchanged = 0
+        for line in result.output.decode("utf-8").splitlines():
+            if len(line.split(None, 1)) < 2:
+                continue
+            shasum_r, name = line.split(None, 1)
+            name = name.lstrip("*")
+            if name in names or any([fnmatch.fnmatch(name, x) for x in excludes]):
+                continue
+            filename = os.path.join(work_dir, name)
+            if os.path.isfile(filename) and _get_shasum(filename) == shasum_r.encode():
+                num_unchanged += 1
+            else:
+                names.append(name)
 
-        task.set_log(task_log)
+        task.set_log(
+            task.get_log()
+            + "    collect %d files, %d unchanged (%s tid-%05d)\n"
+            % (len(names), num_unchanged, get_time(), task.get_tid())
+        )
+        return names
 
     def _shell_run(self, command, cwd=None):
         import spur
@@ -320,10 +965,7 @@ class RemoteQueueBase(QueueBase):
         shell_done = False
         for i in range(10):
             try:
-                if cwd is None:
-                    return self._shell.run(command)
-                else:
-                    return self._shell.run(command, cwd=cwd)
+                return self._session.run(command, cwd=cwd)
                 time.sleep(self._sleep_time)
                 shell_done = True
             except spur.results.RunProcessError:
@@ -0,0 +1,381 @@
+"""Connection layer of remote queues."""
+import hashlib
+import os
+import shlex
+import subprocess
+import tarfile
+import threading
+
+# Lines printed around output of each command in batch script
+_BEGIN_MARKER = b"##cogue-begin"
+_END_MARKER = b"##cogue-end"
+
+# Remote ends of streaming transfer run by python3. The digest is
+# computed over the whole stream including the padding of tar.
+_RECEIVE_SCRIPT = """
+import hashlib, sys, tarfile
+class Reader:
+    def __init__(self):
+        self.sha1 = hashlib.sha1()
+    def read(self, size):
+        data = sys.stdin.buffer.read(size)
+        self.sha1.update(data)
+        return data
+reader = Reader()
+with tarfile.open(fileobj=reader, mode="r|") as tar:
+    if hasattr(tarfile, "data_filter"):
+        tar.extraction_filter = tarfile.data_filter
+    tar.extractall(".")
+while reader.read(65536):
+    pass
+print(reader.sha1.hexdigest())
+"""
+
+_SEND_SCRIPT = """
+import hashlib, sys, tarfile
+class Writer:
+    def __init__(self):
+        self.sha1 = hashlib.sha1()
+    def write(self, data):
+        self.sha1.update(data)
+        sys.stdout.buffer.write(data)
+writer = Writer()
+with tarfile.open(fileobj=writer, mode="w|" + sys.argv[1]) as tar:
+    for name in sys.argv[2:]:
+        tar.add(name)
+sys.stdout.buffer.flush()
+sys.stderr.write(writer.sha1.hexdigest() + "\\n")
+"""
+
+_sessions = {}
+
+
+def get_session(shell):
+    """Return session shared by shells connecting to the same host.
+
+    Sessions are pooled by host, port and user name so that remote
+    queues to one host use one SSH transport and one SFTP channel.
+
+    """
+    key = get_shell_key(shell)
+    if key not in _sessions:
+        _sessions[key] = SshSession(shell)
+    return _sessions[key]
+
+
+def get_shell_key(shell):
+    """Return key identifying host of shell."""
+    return (
+        type(shell).__name__,
+        getattr(shell, "_hostname", None),
+        getattr(shell, "_port", None),
+        getattr(shell, "_username", None),
+    )
+
+
+class BatchResult:
+    """Result of a command run in batch script."""
+
+    def __init__(self, return_code, output):
+        """Init method."""
+        self.return_code = return_code
+        self.output = output
+
+
+class SshSession:
+    """Remote shell reusing one transport and SFTP channels
+
+    spur opens a channel of the SSH transport for each command, which is
+    cheap, but a new SFTP session for each opened file, which costs
+    round-trips. An SFTP client is opened once for each thread here,
+    so that concurrent transfers do not wait for each other, and
+    reopened only after it is broken. run_script runs several commands
+    in one remote shell process.
+
+    Parameters
+    ----------
+    shell : spur.SshShell or spur.LocalShell
+        For shells other than spur.SshShell, e.g., LocalShell used for
+        testing, files are opened by the shell.
+
+    """
+
+    def __init__(self, shell):
+        """Init method."""
+        self._shell = shell
+        self._local = threading.local()
+        self._sftp_clients = []
+        self._lock = threading.Lock()
+
+    def get_shell(self):
+        return self._shell
+
+    def run(self, command, cwd=None, allow_error=False):
+        """Run command as spur shell does."""
+        if cwd is None:
+            return self._shell.run(command, allow_error=allow_error)
+        else:
+            return self._shell.run(command, cwd=cwd, allow_error=allow_error)
+
+    def run_script(self, commands):
+        """Run commands in one remote shell process.
+
+        Parameters
+        ----------
+        commands : list of (list of str or str, str or None)
+            Pairs of command and working directory. Command is given by
+            arguments or by a line of shell script. Working directory of
+            None means home directory.
+
+        Returns
+        -------
+        list of BatchResult
+            Return code and standard output of each command. Return code
+            is None when the command was not reached.
+
+        """
+        lines = []
+        for i, (command, cwd) in enumerate(commands):
+            if isinstance(command, str):
+                line = command
+            else:
+                line = " ".join([shlex.quote(arg) for arg in command])
+            if cwd is not None:
+                line = "cd %s && %s" % (shlex.quote(cwd), line)
+            lines.append(
+                "echo '%s %d'; (%s); printf '\\n%s %d %%d\\n' $?"
+                % (_BEGIN_MARKER.decode(), i, line, _END_MARKER.decode(), i)
+            )
+        output = self._shell.run(["sh", "-c", "\n".join(lines)], allow_error=True)
+        return _parse_script_output(output.output, len(commands))
+
+    def open(self, name, mode="r"):
+        """Open remote file on the shared SFTP channel."""
+        if not hasattr(self._shell, "_open_sftp_client"):
+            return self._shell.open(name, mode)
+
+        for i in range(2):
+            try:
+                return self._get_sftp().open(name, mode)
+            except (EOFError, OSError):
+                if i > 0:
+                    raise
+                self._close_sftp()
+
+    def remove(self, name):
+        """Remove remote file."""
+        if not hasattr(self._shell, "_open_sftp_client"):
+            self.run(["rm", "-f", name])
+        else:
+            try:
+                self._get_sftp().remove(name)
+            except FileNotFoundError:
+                pass
+
+    def put_dir(self, local_dir, remote_dir, exclude=()):
+        """Send files in local directory by streaming tar.
+
+        The tar stream is written to standard input of python3 on the
+        remote side, which extracts it on the fly. No archive file is
+        made on either side.
+
+        Returns
+        -------
+        tuple
+            SHA-1 digests in hex (bytes) of the stream sent and received,
+            and number of bytes sent.
+
+        """
+        process = self._exec(
+            "cd %s && python3 -c %s"
+            % (shlex.quote(remote_dir), shlex.quote(_RECEIVE_SCRIPT))
+        )
+        writer = _HashWriter(process.stdin)
+        with tarfile.open(fileobj=writer, mode="w|") as tar:
+            for name in sorted(os.listdir(local_dir)):
+                if name not in exclude:
+                    tar.add(os.path.join(local_dir, name), arcname=name)
+        process.close_stdin()
+        output = process.stdout.read()
+        process.wait()
+        return writer.get_digest(), (output.split() or [b""])[0], writer.num_bytes
+
+    def get_dir(self, remote_dir, local_dir, names=None, compress=False):
+        """Receive files in remote directory by streaming tar.
+
+        Parameters
+        ----------
+        names : list of str
+            Names of files to receive. All files when None.
+        compress : bool
+            Stream is gzipped when True.
+
+        Returns
+        -------
+        tuple
+            SHA-1 digests in hex (bytes) of the stream received and sent,
+            and number of bytes received.
+
+        """
+        if names is None:
+            names = ["*"]
+        else:
+            names = [shlex.quote(name) for name in names]
+        if compress:
+            mode = "gz"
+        else:
+            mode = "''"
+        process = self._exec(
+            "cd %s && python3 -c %s %s %s"
+            % (
+                shlex.quote(remote_dir),
+                shlex.quote(_SEND_SCRIPT),
+                mode,
+                " ".join(names),
+            )
+        )
+        process.close_stdin()
+        reader = _HashReader(process.stdout)
+        abs_dir = os.path.abspath(local_dir)
+        with tarfile.open(fileobj=reader, mode="r|*") as tar:
+            for member in tar:
+                member_path = os.path.abspath(os.path.join(abs_dir, member.name))
+                if os.path.commonpath([abs_dir, member_path]) != abs_dir:
+                    raise Exception("Attempted Path Traversal in Tar File")
+                tar.extract(member, abs_dir)
+        while reader.read(65536):
+            pass
+        error = process.stderr.read()
+        process.wait()
+        return reader.get_digest(), (error.split() or [b""])[-1], reader.num_bytes
+
+    def _exec(self, command):
+        """Start command with pipes of standard input and output."""
+        if hasattr(self._shell, "_get_ssh_transport"):
+            return _ChannelProcess(self._shell._get_ssh_transport(), command)
+        else:
+            return _LocalProcess(command)
+
+    def close(self):
+        with self._lock:
+            sftp_clients = self._sftp_clients
+            self._sftp_clients = []
+        for sftp in sftp_clients:
+            try:
+                sftp.close()
+            except (EOFError, OSError):
+                pass
+        self._local = threading.local()
+
+    def _get_sftp(self):
+        sftp = getattr(self._local, "sftp", None)
+        if sftp is None:
+            sftp = self._shell._open_sftp_client()
+            self._local.sftp = sftp
+            with self._lock:
+                self._sftp_clients.append(sftp)
+        return sftp
+
+    def _close_sftp(self):
+        sftp = getattr(self._local, "sftp", None)
+        if sftp is not None:
+            with self._lock:
+                if sftp in self._sftp_clients:
+                    self._sftp_clients.remove(sftp)
+            try:
+                sftp.close()
+            except (EOFError, OSError):
+                pass
+            self._local.sftp = None
+
+
+def _parse_script_output(output, num_commands):
+    results = [BatchResult(None, b"") for i in range(num_commands)]
+    index = None
+    lines = []
+    for line in output.split(b"\n"):
+        if line.startswith(_BEGIN_MARKER):
+            index = int(line.split()[1])
+            lines = []
+        elif line.startswith(_END_MARKER) and index is not None:
+            results[index] = BatchResult(int(line.split()[2]), b"\n".join(lines))
+            index = None
+        elif index is not None:
+            lines.append(line)
+    return results
+
+
+class _HashWriter:
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._sha1 = hashlib.sha1()
+        self.num_bytes = 0
+
+    def write(self, data):
+        self._sha1.update(data)
+        self.num_bytes += len(data)
+        self._fileobj.write(data)
+        return len(data)
+
+    def get_digest(self):
+        return self._sha1.hexdigest().encode()
+
+
+class _HashReader:
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._sha1 = hashlib.sha1()
+        self.num_bytes = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._sha1.update(data)
+        self.num_bytes += len(data)
+        return data
+
+    def get_digest(self):
+        return self._sha1.hexdigest().encode()
+
+
+class _ChannelProcess:
+    """Command run on a channel of SSH transport."""
+
+    def __init__(self, transport, command):
+        self._channel = transport.open_session()
+        self._channel.exec_command(command)
+        self.stdin = self._channel.makefile("wb")
+        self.stdout = self._channel.makefile("rb")
+        self.stderr = self._channel.makefile_stderr("rb")
+
+    def close_stdin(self):
+        self.stdin.flush()
+        self._channel.shutdown_write()
+
+    def wait(self):
+        return_code = self._channel.recv_exit_status()
+        self._channel.close()
+        return return_code
+
+
+class _LocalProcess:
+    """Command run locally, used in place of remote one."""
+
+    def __init__(self, command):
+        self._process = subprocess.Popen(
+            ["sh", "-c", command],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.stdin = self._process.stdin
+        self.stdout = self._process.stdout
+        self.stderr = self._process.stderr
+
+    def close_stdin(self):
+        self.stdin.close()
+
+    def wait(self):
+        return_code = self._process.wait()
+        self.stdout.close()
+        self.stderr.close()
+        return return_code
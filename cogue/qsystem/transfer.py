@@ -0,0 +1,103 @@
+"""Concurrent file transfer of remote queues."""
+import concurrent.futures
+import datetime
+import sys
+import threading
+import time
+import traceback
+
+
+class TransferPool:
+    """Run file transfers concurrently with bounded number of threads
+
+    Each transfer is a callable doing one attempt of copy and its
+    verification, and returning a pair of whether the copy was verified
+    and the number of bytes copied. Attempts that are not verified or
+    raise exceptions are repeated up to ``max_retries`` times with
+    ``retry_wait`` seconds interval.
+
+    Parameters
+    ----------
+    max_workers : int
+        Number of transfers running at the same time.
+    max_retries : int
+        Number of attempts of each transfer.
+    retry_wait : float
+        Interval between attempts in seconds.
+
+    """
+
+    def __init__(self, max_workers=4, max_retries=20, retry_wait=10):
+        """Init method."""
+        self._max_workers = max_workers
+        self._max_retries = max_retries
+        self._retry_wait = retry_wait
+        self._lock = threading.Lock()
+        self._num_bytes = 0
+        self._batch_bytes = 0
+        self._duration = 0.0
+        self._last_summary = None
+
+    def set_max_workers(self, max_workers):
+        self._max_workers = max_workers
+
+    def run(self, transfers):
+        """Run transfers and return list of whether each one succeeded."""
+        if not transfers:
+            return []
+
+        self._batch_bytes = 0
+        start = time.time()
+        if self._max_workers > 1 and len(transfers) > 1:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(self._max_workers, len(transfers))
+            ) as executor:
+                results = list(executor.map(self._run_with_retry, transfers))
+        else:
+            results = [self._run_with_retry(transfer) for transfer in transfers]
+        duration = time.time() - start
+
+        with self._lock:
+            self._num_bytes += self._batch_bytes
+            self._duration += duration
+        self._last_summary = "%d transfers, %s in %.1f s (%s/s)" % (
+            len(transfers),
+            _get_size_str(self._batch_bytes),
+            duration,
+            _get_size_str(self._batch_bytes / max(duration, 1e-6)),
+        )
+        return results
+
+    def get_throughput(self):
+        """Return bytes per second averaged over all transfers."""
+        if self._duration > 0:
+            return self._num_bytes / self._duration
+        else:
+            return None
+
+    def get_last_summary(self):
+        """Return text summarizing the latest call of run."""
+        return self._last_summary
+
+    def _run_with_retry(self, transfer):
+        for i in range(self._max_retries):
+            try:
+                verified, num_bytes = transfer()
+                with self._lock:
+                    self._batch_bytes += num_bytes
+                if verified:
+                    return True
+            except Exception:
+                sys.stderr.write(traceback.format_exc())
+            date = datetime.datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+            print("%s: transfer failed (%d)." % (date, i + 1))
+            if i < self._max_retries - 1:
+                time.sleep(self._retry_wait)
+        return False
+
+
+def _get_size_str(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return "%.1f %s" % (num_bytes, unit)
+        num_bytes /= 1024.0
@@ -4,7 +4,27 @@ import os
 
 
 class TaskBase:
-    """Task base class."""
+    """Task base class.
+
+    Files of task are read and written in its working directory given
+    by ``set_work_dir``. When it is not set, the current directory is
+    used. ``begin`` and ``next`` of tasks whose ``_requires_cwd`` is
+    True are called by AutoCalc in the working directory.
+
+    Remote queues bring back only the files matching ``_collect_files``
+    (all files when None) and not matching ``_collect_excludes`` after
+    job finished. They are glob patterns of file names.
+
+    Tasks whose ``_requires_monitoring`` is True are visited by AutoCalc
+    in every cycle while their jobs are running, also in event-driven
+    mode, so that they can follow outputs of the running jobs.
+
+    """
+
+    _requires_cwd = True
+    _requires_monitoring = False
+    _collect_files = None
+    _collect_excludes = ()
 
     def __init__(self):
         """Init method."""
@@ -16,6 +36,7 @@ class TaskBase:
         self._task_type = None
         self._directory = None
         self._tasks = None
+        self._work_dir = None
 
     def __iter__(self):
         return self
@@ -26,6 +47,10 @@ class TaskBase:
     def begin(self):
         pass
 
+    def resume(self):
+        """Begin task whose job was submitted before restart of AutoCalc."""
+        self.begin()
+
     def __next__(self):
         return self.next()
 
@@ -41,6 +66,30 @@ class TaskBase:
     def get_directory(self):
         return self._directory
 
+    def set_work_dir(self, work_dir):
+        self._work_dir = work_dir
+
+    def get_work_dir(self):
+        return self._work_dir
+
+    def requires_cwd(self):
+        return self._requires_cwd
+
+    def requires_monitoring(self):
+        return self._requires_monitoring
+
+    def set_collect_files(self, collect_files):
+        self._collect_files = collect_files
+
+    def get_collect_files(self):
+        return self._collect_files
+
+    def set_collect_excludes(self, collect_excludes):
+        self._collect_excludes = collect_excludes
+
+    def get_collect_excludes(self):
+        return self._collect_excludes
+
     def set_log(self, log):
         self._log = log
 
@@ -80,8 +129,9 @@ class TaskBase:
         return "\n".join(self.get_yaml_lines())
 
     def overwrite_settings(self):
-        if os.path.exists(".coguerc"):
-            with open(".coguerc") as yaml_file:
+        coguerc = self._path(".coguerc")
+        if os.path.exists(coguerc):
+            with open(coguerc) as yaml_file:
                 import yaml
 
                 data = yaml.load(yaml_file)
@@ -97,15 +147,22 @@ class TaskBase:
                     if "status" in data:
                         self._status = data["status"]
                 os.rename(
-                    ".coguerc",
-                    ".coguerc.%s" % datetime.datetime.now().strftime("%Y%m%d%H%M"),
+                    coguerc,
+                    "%s.%s" % (coguerc, datetime.datetime.now().strftime("%Y%m%d%H%M")),
                 )
 
+    def _path(self, filename):
+        """Return path of file in working directory."""
+        if self._work_dir is None:
+            return filename
+        else:
+            return os.path.join(self._work_dir, filename)
+
     def _write_yaml(self, filename=None):
         if filename:
-            w = open(filename)
+            w = open(self._path(filename))
         else:
-            w = open("%s.yaml" % self._task_type, "w")
+            w = open(self._path("%s.yaml" % self._task_type), "w")
         w.write("\n".join(self.get_yaml_lines()))
         w.close()
 
@@ -141,6 +198,8 @@ class TaskElement(TaskBase):
 
 
 class TaskSet(TaskBase):
+    _requires_cwd = False
+
     def __init__(self, directory=None, name=None):
         """Container of tasks
 
@@ -182,7 +182,7 @@ class BandStructureBase(TaskElement):
         self._tasks = tasks
 
     def _write_yaml(self):
-        w = open("%s.yaml" % self._directory, "w")
+        w = open(self._path("%s.yaml" % self._directory), "w")
         if self._lattice_tolerance is not None:
             w.write("lattice_tolerance: %f\n" % self._lattice_tolerance)
         if self._stress_tolerance is not None:
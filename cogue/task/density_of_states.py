@@ -151,7 +151,7 @@ class DensityOfStatesBase(TaskElement):
         self._tasks = [task]
 
     def _write_yaml(self):
-        w = open("%s.yaml" % self._directory, "w")
+        w = open(self._path("%s.yaml" % self._directory), "w")
         if self._lattice_tolerance is not None:
             w.write("lattice_tolerance: %f\n" % self._lattice_tolerance)
         if self._stress_tolerance is not None:
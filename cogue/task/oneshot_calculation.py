@@ -27,6 +27,8 @@ class OneShotCalculationYaml:
 
 
 class OneShotCalculation(TaskElement, OneShotCalculationYaml):
+    _requires_cwd = False  # Files are accessed through self._path.
+
     def __init__(self, directory=None, name=None, traverse=False):
 
         TaskElement.__init__(self)
@@ -50,9 +52,14 @@ class OneShotCalculation(TaskElement, OneShotCalculationYaml):
 
     def next(self):
         self._collect()
+        self._compress_outputs()
         self._write_yaml()
         raise StopIteration
 
+    def _compress_outputs(self):
+        """Compress output files once results are collected."""
+        pass
+
     def get_cell(self):
         return self._cell
 
@@ -82,6 +89,13 @@ class OneShotCalculation(TaskElement, OneShotCalculationYaml):
 
         self._status = "begin"
 
+    def resume(self):
+        # Input files were already prepared and must not be overwritten.
+        if self._job is None:
+            print("set_job has to be executed.")
+            raise RuntimeError
+        self._status = "begin"
+
     def done(self):
         return self._status == "terminate" or self._status == "done"
 
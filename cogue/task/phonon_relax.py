@@ -222,7 +222,7 @@ class PhononRelaxBase(TaskElement):
         self._phr_tasks += self._tasks
 
     def _write_yaml(self):
-        w = open("%s.yaml" % self._directory, "w")
+        w = open(self._path("%s.yaml" % self._directory), "w")
         if self._lattice_tolerance is not None:
             w.write("lattice_tolerance: %f\n" % self._lattice_tolerance)
         if self._stress_tolerance is not None:
@@ -527,7 +527,7 @@ class PhononRelaxElementBase(TaskElement):
         self._space_group_type = sym_dataset["international"]
 
     def _write_yaml(self):
-        w = open("%s.yaml" % self._directory, "w")
+        w = open(self._path("%s.yaml" % self._directory), "w")
         if self._lattice_tolerance is not None:
             w.write("lattice_tolerance: %f\n" % self._lattice_tolerance)
         if self._stress_tolerance is not None:
@@ -1,6 +1,14 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+import numpy as np
+
 import cogue.calculator.vasp as vasp
+from cogue.interface.vasp_io import Vasprunxml
+
+from ..interface.test_vasp_io import _get_outcar_lines
 
 
 class TestVasp(unittest.TestCase):
@@ -16,6 +24,41 @@ class TestVasp(unittest.TestCase):
             pass
         print(self._task.get_properties()["forces"])
 
+    def test_collect_backends(self):
+        """Test vasprun.xml and OUTCAR of the same run give the same properties."""
+        filename = os.path.join(
+            os.path.dirname(__file__), "..", "interface", "vasprun-elastic.xml"
+        )
+        vxml = Vasprunxml(filename, cache=False)
+        self.assertTrue(vxml.parse())
+        tmpdir = tempfile.mkdtemp()
+        try:
+            shutil.copy(filename, os.path.join(tmpdir, "vasprun.xml"))
+            with open(os.path.join(tmpdir, "OUTCAR"), "w") as w:
+                for lines in _get_outcar_lines(vxml, np.zeros((2, 3, 3)), np.eye(3)):
+                    w.write("\n".join(lines) + "\n")
+            for properties in (None, ("forces", "energies", "stress")):
+                collected = []
+                for backend in ("vasprun", "outcar"):
+                    task = vasp.ElectronicStructure(
+                        properties=properties, backend=backend
+                    )
+                    task.set_work_dir(tmpdir)
+                    task._collect()
+                    self.assertEqual(task.get_status(), "done")
+                    collected.append(task.get_properties())
+                for name, atol in (
+                    ("forces", 1e-6),
+                    ("stress", 1e-5),
+                    ("energies", 1e-8),
+                ):
+                    self.assertEqual(collected[0][name].shape, collected[1][name].shape)
+                    np.testing.assert_allclose(
+                        collected[0][name], collected[1][name], atol=atol
+                    )
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,226 @@
+"""Test AutoCalc."""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from cogue.controller.autocalc import AutoCalc
+from cogue.qsystem.job import JobBase
+from cogue.qsystem.queue import QueueBase
+from cogue.task.oneshot_calculation import OneShotCalculation
+
+
+class DummyCalculation(OneShotCalculation):
+    """Task collecting nothing."""
+
+    def __init__(self, directory=None, traverse=True):
+        """Init method."""
+        OneShotCalculation.__init__(self, directory=directory, traverse=traverse)
+        self._task_type = "dummy"
+        self._job = JobBase()
+        self.num_set_status = 0
+        self.num_prepare = 0
+        self.collected_in = None
+
+    def set_status(self):
+        """Count calls."""
+        self.num_set_status += 1
+        OneShotCalculation.set_status(self)
+
+    def _prepare(self):
+        self.num_prepare += 1
+
+    def _collect(self):
+        self.collected_in = (os.getpid(), threading.get_ident())
+        self._status = "done"
+
+
+class DummyQueue(QueueBase):
+    """Queue whose jobs run until removed from ``jobs``."""
+
+    def __init__(self, jobs):
+        """Init method."""
+        QueueBase.__init__(self)
+        self._jobs = jobs
+        self.num_submitted = 0
+
+    def qstat(self):
+        """Qstat."""
+        self._qstatus = dict(self._jobs)
+
+    def _submit_tasks(self, tasks):
+        jobids = []
+        for task in tasks:
+            jobid = 100 + task.get_tid()
+            self._jobs[jobid] = "Running"
+            jobids.append(jobid)
+        self.num_submitted += len(tasks)
+        return jobids
+
+
+class FinishingQueue(DummyQueue):
+    """Queue whose jobs finish after one qstat."""
+
+    def qstat(self):
+        """Qstat."""
+        self._qstatus = dict(self._jobs)
+        self._jobs.clear()
+
+
+class MonitoredCalculation(DummyCalculation):
+    """Task following its running job."""
+
+    _requires_monitoring = True
+
+
+class CountdownQueue(DummyQueue):
+    """Queue whose jobs finish after given number of qstats."""
+
+    def __init__(self, jobs, num_qstats):
+        """Init method."""
+        DummyQueue.__init__(self, jobs)
+        self._num_qstats = num_qstats
+
+    def qstat(self):
+        """Qstat."""
+        self._qstatus = dict(self._jobs)
+        self._num_qstats -= 1
+        if self._num_qstats == 0:
+            self._jobs.clear()
+
+
+class TestAutoCalc(unittest.TestCase):
+    """Test AutoCalc."""
+
+    def setUp(self):
+        """Set up."""
+        self._cwd = os.getcwd()
+        self._tmpdir = tempfile.mkdtemp()
+        os.chdir(self._tmpdir)
+
+    def tearDown(self):
+        """Tear down."""
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tmpdir)
+
+    def _run(self, event_driven):
+        calc = AutoCalc(name="test")
+        tasks = [DummyCalculation(directory="task-%d" % i) for i in range(5)]
+        for i, task in enumerate(tasks):
+            calc.append("set-%d" % i, task)
+        with mock.patch("os.chdir", side_effect=os.chdir) as chdir:
+            calc.run(check_period=0, event_driven=event_driven)
+        self.assertEqual(chdir.call_count, 0)
+        self.assertTrue(all(t.get_status() == "done" for t in tasks))
+        for i, task in enumerate(tasks):
+            self.assertTrue(os.path.exists("test/set-%d/task-%d/dummy.yaml" % (i, i)))
+        return tasks
+
+    def test_run(self):
+        """Test traversal of whole task tree."""
+        self._run(False)
+
+    def test_output_files(self):
+        """Test log, dot and status snapshot files."""
+        calc = AutoCalc(name="test", verbose=2)
+        task = DummyCalculation(directory="task")
+        calc.append("set", task)
+        calc.run(check_period=0)
+        with open("test.log") as f:
+            self.assertIn("--> test/set/task", f.read())
+        with open("test.dot") as f:
+            self.assertTrue(f.read().startswith("digraph test {"))
+        with open("test.status.jsonl") as f:
+            status = [json.loads(line) for line in f]
+        self.assertEqual([s["tid"] for s in status], [0, 1, 2])
+        self.assertEqual(status[2]["directory"], "test/set/task")
+        self.assertTrue(all(s["status"] == "done" for s in status))
+
+    def test_run_event_driven(self):
+        """Test event driven mode visits each finished task once."""
+        tasks = self._run(True)
+        for task in tasks:
+            self.assertEqual(task.num_set_status, 1)
+
+    def test_monitoring(self):
+        """Test running tasks requiring monitoring are visited every cycle."""
+        calc = AutoCalc(name="test")
+        calc.set_queue(CountdownQueue({}, 6))
+        tasks = [
+            DummyCalculation(directory="task-0", traverse=False),
+            MonitoredCalculation(directory="task-1", traverse=False),
+        ]
+        for i, task in enumerate(tasks):
+            calc.append("set-%d" % i, task)
+        calc.run(check_period=0, event_driven=True)
+        self.assertTrue(all(t.get_status() == "done" for t in tasks))
+        # Visited in 4 more cycles of running job
+        self.assertEqual(tasks[1].num_set_status, tasks[0].num_set_status + 4)
+
+    def _run_parallel_collection(self, executor, event_driven):
+        calc = AutoCalc(name="test")
+        calc.set_parallel_collection(max_workers=2, executor=executor)
+        tasks = [
+            DummyCalculation(directory="task-%d" % i, traverse=False) for i in range(4)
+        ]
+        for i, task in enumerate(tasks):
+            calc.append("set-%d" % i, task)
+        calc.set_queue(FinishingQueue({}))
+        calc.run(check_period=0, event_driven=event_driven)
+        self.assertTrue(all(t.get_status() == "done" for t in tasks))
+        return [t.collected_in for t in tasks]
+
+    def test_parallel_collection_thread(self):
+        """Test collection in thread pool."""
+        for event_driven in (False, True):
+            for pid, ident in self._run_parallel_collection("thread", event_driven):
+                self.assertEqual(pid, os.getpid())
+                self.assertNotEqual(ident, threading.get_ident())
+
+    def test_parallel_collection_process(self):
+        """Test collection in process pool."""
+        for pid, _ in self._run_parallel_collection("process", True):
+            self.assertNotEqual(pid, os.getpid())
+
+    def test_state_store(self):
+        """Test resume of submitted jobs after restart."""
+        jobs = {}
+
+        def build():
+            calc = AutoCalc(name="test")
+            calc.set_state_store()
+            tasks = [
+                DummyCalculation(directory="task-%d" % i, traverse=False)
+                for i in range(3)
+            ]
+            for i, task in enumerate(tasks):
+                calc.append("set-%d" % i, task)
+            queue = DummyQueue(jobs)
+            calc.set_queue(queue)
+            return calc, tasks, queue
+
+        # Jobs are submitted, then the controller dies.
+        calc, tasks, queue = build()
+        calc._begin()
+        queue.qstat()
+        calc._deep_run(calc._taskset)
+        calc._submit_queued_tasks()
+        calc._state_store.commit()
+        self.assertEqual(queue.num_submitted, 3)
+        self.assertTrue(all(t.num_prepare == 1 for t in tasks))
+
+        # Jobs finish while the controller is down.
+        jobs.clear()
+        calc, tasks, queue = build()
+        calc.run(check_period=0)
+        self.assertEqual(queue.num_submitted, 0)
+        self.assertTrue(all(t.num_prepare == 0 for t in tasks))
+        self.assertTrue(all(t.get_status() == "done" for t in tasks))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestAutoCalc)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+import unittest
+
+from cogue.controller.poller import AdaptivePoller
+
+
+class TestAdaptivePoller(unittest.TestCase):
+    def test_backoff(self):
+        poller = AdaptivePoller(min_period=1, max_period=5, backoff=2)
+        self.assertEqual(poller.get_period(), 1)
+        poller.notify(0)
+        self.assertEqual(poller.get_period(), 2)
+        poller.notify(0)
+        poller.notify(0)
+        self.assertEqual(poller.get_period(), 5)
+        poller.notify(3)
+        self.assertEqual(poller.get_period(), 1)
+
+    def test_fixed_period(self):
+        poller = AdaptivePoller(min_period=3)
+        poller.notify(0)
+        self.assertEqual(poller.get_period(), 3)
+
+    def test_wake_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            wake_file = os.path.join(tmpdir, "test.wake")
+            poller = AdaptivePoller(
+                min_period=0.1, max_period=60, backoff=100, wake_file=wake_file
+            )
+            poller.notify(0)
+            self.assertEqual(poller.get_period(), 10)
+            open(wake_file, "w").close()
+            t = time.time()
+            poller.wait()
+            self.assertLess(time.time() - t, 1)
+            self.assertFalse(os.path.exists(wake_file))
+            self.assertEqual(poller.get_period(), 0.1)
+
+    def test_poll_rate(self):
+        poller = AdaptivePoller(min_period=0.01)
+        self.assertTrue(poller.get_poll_rate() is None)
+        for i in range(3):
+            poller.wait()
+        self.assertGreater(poller.get_poll_rate(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+
+from cogue.crystal.cell import Cell
+from cogue.crystal.converter import reduce_points
+from cogue.crystal.supercell import _get_simple_supercell
+
+
+def _reduce_points_by_pairs(tmat, cell, tolerance=1e-5):
+    """Reduce overlapping points by comparing all pairs."""
+    points_prim = []
+    indices = []
+    for i, p in enumerate(np.dot(np.linalg.inv(tmat), cell.get_points()).T):
+        for p_prim in points_prim:
+            diff = p_prim - p
+            diff -= diff.round()
+            if np.linalg.norm(np.dot(cell.lattice, diff)) < tolerance:
+                break
+        else:
+            points_prim.append(p - np.floor(p))
+            indices.append(i)
+    return np.transpose(points_prim), indices
+
+
+class TestConverter(unittest.TestCase):
+    def setUp(self):
+        symbols = ["Si", "O", "O", "Si", "O", "O"]
+        lattice = [[4.65, 0, 0], [0, 4.75, 0], [0, 0, 3.25]]
+        points = np.transpose(
+            [
+                [0.0, 0.0, 0.0],
+                [0.3, 0.3, 0.0],
+                [0.7, 0.7, 0.0],
+                [0.5, 0.5, 0.5],
+                [0.2, 0.8, 0.5],
+                [0.8, 0.2, 0.5],
+            ]
+        )
+        self._cell = Cell(
+            lattice=lattice,
+            points=points,
+            symbols=symbols,
+            magmoms=[1, 0, 0, -1, 0, 0],
+        )
+
+    def tearDown(self):
+        pass
+
+    def test_reduce_points(self):
+        smat = np.array([[-1, 1, 1], [1, -1, 1], [2, 1, -1]])
+        # Multiplicities of simple supercell surrounding the supercell
+        frame = [3, 3, 4]
+        surrounding_cell = _get_simple_supercell(frame, self._cell)
+        tmat = smat / np.array(frame, dtype=float)[:, None]
+        cell = reduce_points(tmat, surrounding_cell)
+        points, indices = _reduce_points_by_pairs(tmat, surrounding_cell)
+        self.assertEqual(len(cell.get_symbols()), 6 * abs(np.linalg.det(smat)))
+        np.testing.assert_allclose(cell.get_points(), points)
+        self.assertEqual(
+            cell.get_symbols(), [surrounding_cell.get_symbols()[i] for i in indices]
+        )
+        np.testing.assert_allclose(
+            cell.get_magnetic_moments(),
+            surrounding_cell.get_magnetic_moments()[indices],
+        )
+
+    def test_reduce_points_in_order(self):
+        """Test a point overlapping only with a removed point is kept."""
+        points = np.transpose([[0, 0, 0], [0.6e-5, 0, 0], [1.2e-5, 0, 0], [0.5] * 3])
+        cell = Cell(lattice=np.eye(3), points=points, symbols=["Si"] * 4)
+        reduced = reduce_points(np.eye(3), cell)
+        np.testing.assert_allclose(
+            reduced.get_points(), _reduce_points_by_pairs(np.eye(3), cell)[0]
+        )
+        self.assertEqual(len(reduced.get_symbols()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+
+from cogue.crystal.cell import Cell
+from cogue.crystal.neighbor_list import NeighborList
+
+
+class TestNeighborList(unittest.TestCase):
+    def setUp(self):
+        lattice = np.transpose([[4.0, 0, 0], [1.5, 3.0, 0], [1.0, 0.5, 5.0]])
+        # Points outside of the unit cell are included.
+        points = np.random.RandomState(1).random_sample((3, 30)) * 1.4 - 0.2
+        self._cell = Cell(lattice=lattice, points=points, symbols=["Si"] * 30)
+
+    def tearDown(self):
+        pass
+
+    def _get_reference_pairs(self, cutoff, max_translation):
+        lattice = self._cell.get_lattice()
+        points = self._cell.get_points().T
+        r = range(-max_translation, max_translation + 1)
+        translations = np.array([[i, j, k] for i in r for j in r for k in r])
+        pairs = []
+        for i, p1 in enumerate(points):
+            for j, p2 in enumerate(points):
+                distances = np.sqrt(
+                    (np.dot(p2 + translations - p1, lattice.T) ** 2).sum(axis=1)
+                )
+                for t, d in zip(translations, distances):
+                    if d <= cutoff and (i != j or t.any()):
+                        pairs.append((i, j) + tuple(t) + (d,))
+        return sorted(pairs)
+
+    def _assert_pairs(self, neighbor_list, cutoff, max_translation):
+        pairs, distances, offsets = neighbor_list.get_pairs(cutoff)
+        found = sorted(
+            [tuple(p) + tuple(o) + (d,) for p, d, o in zip(pairs, distances, offsets)]
+        )
+        if cutoff is None:
+            cutoff = neighbor_list.get_cutoff()
+        reference = self._get_reference_pairs(cutoff, max_translation)
+        self.assertEqual(len(found), len(reference))
+        np.testing.assert_allclose(found, reference)
+
+    def test_get_pairs(self):
+        neighbor_list = NeighborList(self._cell, 3.0)
+        self._assert_pairs(neighbor_list, None, 3)
+        self._assert_pairs(neighbor_list, 2.0, 3)
+        self.assertRaises(RuntimeError, neighbor_list.get_pairs, 3.5)
+
+    def test_get_pairs_beyond_cell(self):
+        """Test cutoff longer than the cell, where images are replicated."""
+        self._assert_pairs(NeighborList(self._cell, 7.0), None, 4)
+
+    def test_get_pairs_short_cutoff(self):
+        self._assert_pairs(NeighborList(self._cell, 0.05), None, 2)
+
+    def test_get_neighbors(self):
+        neighbor_list = NeighborList(self._cell, 3.0)
+        pairs, distances, offsets = neighbor_list.get_pairs()
+        for i in (0, 7, 29):
+            indices, d, o = neighbor_list.get_neighbors(i, cutoff=2.5)
+            selected = (pairs[:, 0] == i) & (distances <= 2.5)
+            np.testing.assert_array_equal(indices, pairs[selected, 1])
+            np.testing.assert_array_equal(d, distances[selected])
+            np.testing.assert_array_equal(o, offsets[selected])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+import numpy as np
+
+import cogue.crystal.pair_distance as pair_distance
+from cogue.crystal.cell import Cell
+from cogue.crystal.pair_distance import (
+    get_distance,
+    get_distances,
+    get_pair_distances,
+    get_pair_distances_within,
+)
+
+
+class TestPairDistance(unittest.TestCase):
+    def setUp(self):
+        # Oblique lattice where shortest images are beyond neighboring cells
+        lattice = np.transpose([[4.0, 0, 0], [3.5, 3.0, 0], [2.5, 1.0, 5.0]])
+        points = np.random.RandomState(0).random_sample((3, 20))
+        self._cell = Cell(lattice=lattice, points=points, symbols=["Si"] * 20)
+
+    def tearDown(self):
+        pass
+
+    def _get_reference_distances(self):
+        lattice = self._cell.get_lattice()
+        points = self._cell.get_points().T
+        r = range(-3, 4)
+        translations = np.array([[i, j, k] for i in r for j in r for k in r])
+        distances = np.zeros((len(points), len(points)))
+        for i, p1 in enumerate(points):
+            for j, p2 in enumerate(points):
+                vectors = np.dot(p1 - p2 + translations, lattice.T)
+                distances[i, j] = np.sqrt((vectors**2).sum(axis=1)).min()
+        return distances
+
+    def test_get_pair_distances(self):
+        reference = self._get_reference_distances()
+        np.testing.assert_allclose(get_pair_distances(self._cell), reference)
+        points = self._cell.get_points().T
+        self.assertAlmostEqual(
+            get_distance(self._cell.get_lattice(), points[1], points[7]),
+            reference[1, 7],
+        )
+        np.testing.assert_allclose(
+            get_distances(self._cell.get_lattice(), points[3], points), reference[3]
+        )
+
+    def test_get_pair_distances_by_blocks(self):
+        max_block_size = pair_distance.max_block_size
+        try:
+            pair_distance.max_block_size = 27 * 20 * 3
+            np.testing.assert_allclose(
+                get_pair_distances(self._cell), self._get_reference_distances()
+            )
+        finally:
+            pair_distance.max_block_size = max_block_size
+
+    def test_get_pair_distances_within(self):
+        reference = self._get_reference_distances()
+        pairs, distances = get_pair_distances_within(self._cell, 2.0)
+        i, j = np.nonzero(np.triu(reference <= 2.0, k=1))
+        np.testing.assert_array_equal(pairs, np.transpose([i, j]))
+        np.testing.assert_allclose(distances, reference[i, j])
+
+
+if __name__ == "__main__":
+    unittest.main()
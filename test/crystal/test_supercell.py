@@ -0,0 +1,113 @@
+import unittest
+
+import numpy as np
+
+from cogue.crystal.cell import Cell
+from cogue.crystal.converter import reduce_points
+from cogue.crystal.supercell import (
+    _get_hermite_normal_form,
+    _get_simple_supercell,
+    get_supercell,
+)
+
+
+def _get_sorted_points(points):
+    points = np.array(points).T
+    points = points - np.floor(points + 1e-8)
+    return points[np.lexsort(np.round(points, decimals=6).T[::-1])]
+
+
+class TestSupercell(unittest.TestCase):
+    def setUp(self):
+        symbols = ["Si", "O", "O", "Si", "O", "O"]
+        lattice = [[4.65, 0, 0], [0, 4.75, 0], [0, 0, 3.25]]
+        points = np.transpose(
+            [
+                [0.0, 0.0, 0.0],
+                [0.3, 0.3, 0.0],
+                [0.7, 0.7, 0.0],
+                [0.5, 0.5, 0.5],
+                [0.2, 0.8, 0.5],
+                [0.8, 0.2, 0.5],
+            ]
+        )
+        self._cell = Cell(
+            lattice=lattice,
+            points=points,
+            symbols=symbols,
+            magmoms=[1, 0, 0, -1, 0, 0],
+        )
+
+    def tearDown(self):
+        pass
+
+    def _assert_maps(self, supercell, smat):
+        points = self._cell.get_points().T[supercell.get_unitcell_indices()]
+        np.testing.assert_allclose(
+            np.dot(smat, supercell.get_points()).T,
+            points + supercell.get_lattice_points(),
+            atol=1e-10,
+        )
+        self.assertEqual(
+            supercell.get_symbols(),
+            [self._cell.get_symbols()[i] for i in supercell.get_unitcell_indices()],
+        )
+
+    def test_get_supercell_diagonal(self):
+        smat = np.diag([2, 3, 1])
+        supercell = get_supercell(self._cell, smat)
+        points = []
+        for pos in self._cell.get_points().T:
+            for i in range(1):
+                for j in range(3):
+                    for k in range(2):
+                        points.append((pos + [k, j, i]) / [2, 3, 1])
+        np.testing.assert_array_equal(supercell.get_points(), np.transpose(points))
+        np.testing.assert_allclose(
+            supercell.get_lattice(), np.dot(self._cell.get_lattice(), smat)
+        )
+        np.testing.assert_array_equal(
+            supercell.get_magnetic_moments(), np.repeat([1, 0, 0, -1, 0, 0], 6)
+        )
+        self._assert_maps(supercell, smat)
+
+    def test_get_supercell(self):
+        for smat, frame in (
+            ([[-1, 1, 1], [1, -1, 1], [2, 1, -1]], [3, 3, 4]),
+            ([[-1, 1, 1], [0, -1, 1], [1, 0, 1]], [3, 2, 2]),
+        ):
+            smat = np.array(smat)
+            supercell = get_supercell(self._cell, smat)
+            # Supercell trimmed from simple supercell surrounding it
+            surrounding_cell = _get_simple_supercell(frame, self._cell)
+            tmat = smat / np.array(frame, dtype=float)[:, None]
+            reference = reduce_points(tmat, surrounding_cell)
+            self.assertEqual(
+                len(supercell.get_symbols()), 6 * round(abs(np.linalg.det(smat)))
+            )
+            np.testing.assert_allclose(
+                supercell.get_lattice(), np.dot(self._cell.get_lattice(), smat)
+            )
+            np.testing.assert_allclose(
+                _get_sorted_points(supercell.get_points()),
+                _get_sorted_points(reference.get_points()),
+                atol=1e-10,
+            )
+            self._assert_maps(supercell, smat)
+
+    def test_get_hermite_normal_form(self):
+        for smat in (
+            [[-1, 1, 1], [1, -1, 1], [2, 1, -1]],
+            [[0, 2, 0], [3, 0, 0], [1, 1, 5]],
+            [[4, 0, 0], [0, 4, 0], [0, 0, 4]],
+        ):
+            hnf = _get_hermite_normal_form(smat)
+            self.assertTrue((np.triu(hnf, k=1) == 0).all())
+            self.assertTrue((np.diagonal(hnf) > 0).all())
+            unimodular = np.dot(np.linalg.inv(smat), hnf)
+            np.testing.assert_allclose(unimodular, np.rint(unimodular), atol=1e-10)
+            self.assertAlmostEqual(abs(np.linalg.det(unimodular)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Test reading and writing compressed output files."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cogue.interface.compression import compress_file, find_file, open_file
+from cogue.interface.vasp_io import Outcar, Vasprunxml
+
+
+class TestCompression(unittest.TestCase):
+    """Test reading and writing compressed output files."""
+
+    def setUp(self):
+        """Set up."""
+        self._tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down."""
+        shutil.rmtree(self._tmpdir)
+
+    def test_compress_file(self):
+        """Test file is replaced by compressed one read transparently."""
+        for compression in ("gz", "xz"):
+            filename = os.path.join(self._tmpdir, "OSZICAR")
+            with open(filename, "w") as w:
+                w.write("F= -.10E+02\n" * 1000)
+            os.utime(filename, ns=(0, 1234567890))
+            compressed = compress_file(filename, compression)
+            self.assertEqual(compressed, "%s.%s" % (filename, compression))
+            self.assertFalse(os.path.exists(filename))
+            self.assertEqual(os.stat(compressed).st_mtime_ns, 1234567890)
+            self.assertEqual(find_file(filename), compressed)
+            with open_file(find_file(filename), "r") as f:
+                self.assertEqual(len(f.readlines()), 1000)
+            os.remove(compressed)
+        self.assertIsNone(find_file(filename))
+
+    def test_vasprunxml(self):
+        """Test compressed vasprun.xml gives the same results."""
+        filename = os.path.join(self._tmpdir, "vasprun.xml")
+        shutil.copy(
+            os.path.join(os.path.dirname(__file__), "vasprun-energy.xml"), filename
+        )
+        vxml = Vasprunxml(filename, cache=False)
+        self.assertTrue(vxml.parse())
+        compress_file(filename, "xz")
+        vxml_xz = Vasprunxml(filename)
+        self.assertTrue(vxml_xz.parse())
+        self.assertTrue(os.path.exists(filename + ".xz.npz"))
+        np.testing.assert_array_equal(vxml.get_forces(), vxml_xz.get_forces())
+        np.testing.assert_array_equal(
+            vxml.get_eigenvalues()[0], vxml_xz.get_eigenvalues()[0]
+        )
+
+    def test_outcar(self):
+        """Test elastic constants are read from gzipped OUTCAR."""
+        filename = os.path.join(self._tmpdir, "OUTCAR")
+        elastic_constants = np.arange(36, dtype="double").reshape(6, 6)
+        with open(filename, "w") as w:
+            w.write(" TOTAL ELASTIC MODULI (kBar)\n")
+            w.write(" Direction    XX          YY          ZZ\n")
+            w.write(" " + "-" * 80 + "\n")
+            for x, row in zip(("XX", "YY", "ZZ", "XY", "YZ", "ZX"), elastic_constants):
+                w.write(" %-7s" % x + "".join(["%12.4f" % v for v in row]) + "\n")
+        compress_file(filename, "gz")
+        outcar = Outcar(filename)
+        self.assertTrue(outcar.parse_elastic_constants())
+        np.testing.assert_allclose(outcar.get_elastic_constants(), elastic_constants)
+
+
+if __name__ == "__main__":
+    unittest.main()
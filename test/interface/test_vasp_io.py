@@ -1,12 +1,24 @@
 """Test VASP-io."""
 import io
+import os
+import shutil
+import tempfile
 import unittest
+import xml.etree.ElementTree as etree
 
+import numpy as np
+
+from cogue.interface.sidecar import write_sidecar
 from cogue.interface.vasp_io import (
+    Outcar,
     Vasprunxml,
     VasprunxmlExpat,
+    VasprunxmlTail,
+    _parse_rows,
+    clear_potcar_cache,
     read_poscar_yaml,
     write_poscar,
+    write_potcar,
 )
 
 
@@ -74,6 +86,365 @@ class TestVASPIO(unittest.TestCase):
         print("Epsilon")
         print(vxml.get_epsilon())
 
+    def test_parse_rows(self):
+        """Test rows of varray are converted to array at once."""
+        varray = etree.fromstring(
+            '<varray name="forces"><v> 0.1 -0.2 0.3 </v>'
+            "<v>-1.5e-01 2.0 -3.25</v></varray>"
+        )
+        np.testing.assert_array_equal(
+            _parse_rows(varray.findall("./v")),
+            [[0.1, -0.2, 0.3], [-0.15, 2.0, -3.25]],
+        )
+        varray = etree.fromstring(
+            '<varray name="forces"><v> 0.1 -0.2 0.3 </v>'
+            "<v> 0.4 ******** 0.6 </v></varray>"
+        )
+        self.assertRaises(ValueError, _parse_rows, varray.findall("./v"))
+        varray = etree.fromstring('<varray name="forces"></varray>')
+        self.assertEqual(_parse_rows(varray.findall("./v")).size, 0)
+
+    def test_Vasprunxml_parse(self):
+        """Test one pass of Vasprunxml.parse gives results of each parse."""
+        for name in ("vasprun-energy.xml", "vasprun-elastic.xml"):
+            filename = os.path.join(os.path.dirname(__file__), name)
+            vxml = Vasprunxml(filename, cache=False)
+            self.assertTrue(vxml.parse())
+            vxml_each = Vasprunxml(filename, cache=False)
+            self.assertTrue(vxml_each.parse_calculation())
+            self.assertTrue(vxml_each.parse_eigenvalues())
+            self.assertTrue(vxml_each.parse_efermi())
+            self.assertTrue(vxml_each.parse_parameters())
+            for a, b in (
+                (vxml.get_forces(), vxml_each.get_forces()),
+                (vxml.get_stress(), vxml_each.get_stress()),
+                (vxml.get_lattice(), vxml_each.get_lattice()),
+                (vxml.get_points(), vxml_each.get_points()),
+                (vxml.get_energies(), vxml_each.get_energies()),
+                (vxml.get_eigenvalues()[0], vxml_each.get_eigenvalues()[0]),
+                (vxml.get_occupancies()[0], vxml_each.get_occupancies()[0]),
+                (vxml.get_kpoints()[0], vxml_each.get_kpoints()[0]),
+            ):
+                np.testing.assert_array_equal(a, b)
+            self.assertEqual(vxml.get_efermi(), vxml_each.get_efermi())
+            self.assertEqual(vxml.get_nbands(), vxml_each.get_nbands())
+        filename = os.path.join(os.path.dirname(__file__), "vasprun-stropt.xml")
+        self.assertFalse(Vasprunxml(filename, cache=False).parse())
+
+    def test_Vasprunxml_parse_fields(self):
+        """Test selected fields are parsed as in parse of all fields."""
+        fields = (
+            "forces",
+            "stress",
+            "lattice",
+            "points",
+            "energies",
+            "epsilon",
+            "eigenvalues",
+            "efermi",
+            "nbands",
+        )
+        for name in ("vasprun-energy.xml", "vasprun-elastic.xml"):
+            filename = os.path.join(os.path.dirname(__file__), name)
+            vxml = Vasprunxml(filename, cache=False)
+            self.assertTrue(vxml.parse())
+            vxml_all = Vasprunxml(filename, cache=False)
+            self.assertTrue(vxml_all.parse(fields=fields))
+            vxml_last = Vasprunxml(filename, cache=False)
+            self.assertTrue(vxml_last.parse(fields=fields, steps="last"))
+            for getter in (
+                "get_forces",
+                "get_stress",
+                "get_lattice",
+                "get_points",
+                "get_energies",
+            ):
+                a = getattr(vxml, getter)()
+                np.testing.assert_array_equal(a, getattr(vxml_all, getter)())
+                np.testing.assert_array_equal(a[-1:], getattr(vxml_last, getter)())
+            np.testing.assert_array_equal(vxml.get_epsilon(), vxml_all.get_epsilon())
+            np.testing.assert_array_equal(
+                vxml.get_eigenvalues()[0], vxml_all.get_eigenvalues()[0]
+            )
+            np.testing.assert_array_equal(
+                vxml.get_kpoints()[0], vxml_last.get_kpoints()[0]
+            )
+            num_kpoints = len(vxml.get_kpoints()[0])
+            np.testing.assert_array_equal(
+                vxml.get_occupancies()[0][-num_kpoints:],
+                vxml_last.get_occupancies()[0],
+            )
+            self.assertEqual(vxml.get_efermi(), vxml_last.get_efermi())
+            self.assertEqual(vxml.get_nbands(), vxml_last.get_nbands())
+
+            vxml_forces = Vasprunxml(filename, cache=False)
+            self.assertTrue(vxml_forces.parse(fields=("forces",), steps="last"))
+            self.assertEqual(vxml_forces.get_forces().shape[0], 1)
+            self.assertIsNone(vxml_forces.get_stress())
+            self.assertIsNone(vxml_forces.get_eigenvalues()[0])
+
+        filename = os.path.join(os.path.dirname(__file__), "vasprun-stropt.xml")
+        self.assertFalse(Vasprunxml(filename, cache=False).parse(fields=("efermi",)))
+
+    def test_Vasprunxml_cache(self):
+        """Test results of parse are cached next to vasprun.xml."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "vasprun.xml")
+            shutil.copy(
+                os.path.join(os.path.dirname(__file__), "vasprun-energy.xml"),
+                filename,
+            )
+            vxml = Vasprunxml(filename)
+            self.assertTrue(vxml.parse())
+            self.assertTrue(os.path.exists(filename + ".npz"))
+
+            vxml_cached = Vasprunxml(filename)
+            self.assertTrue(vxml_cached.parse_eigenvalues())
+            self.assertIsInstance(vxml_cached.get_eigenvalues()[0], np.memmap)
+            np.testing.assert_array_equal(
+                vxml.get_eigenvalues()[0], vxml_cached.get_eigenvalues()[0]
+            )
+            np.testing.assert_array_equal(vxml.get_forces(), vxml_cached.get_forces())
+            self.assertEqual(vxml.get_efermi(), vxml_cached.get_efermi())
+            self.assertEqual(vxml.get_nbands(), vxml_cached.get_nbands())
+            self.assertIsNone(vxml_cached.get_born_charges())
+
+            vxml_last = Vasprunxml(filename)
+            self.assertTrue(vxml_last.parse(fields=("forces",), steps="last"))
+            np.testing.assert_array_equal(
+                vxml.get_forces()[-1:], vxml_last.get_forces()
+            )
+            self.assertIsNone(vxml_last.get_stress())
+
+            # Expat parser does not read cache of Vasprunxml.
+            with io.open(filename, "rb") as f:
+                vxml_expat = VasprunxmlExpat(f)
+                self.assertTrue(vxml_expat.parse())
+            self.assertTrue(os.path.exists(filename + ".expat.npz"))
+            self.assertEqual(len(vxml_expat.get_cells()), len(vxml.get_forces()))
+            with io.open(filename, "rb") as f:
+                vxml_expat_cached = VasprunxmlExpat(f)
+                self.assertTrue(vxml_expat_cached.parse())
+            for cell, cell_cached in zip(
+                vxml_expat.get_cells(), vxml_expat_cached.get_cells()
+            ):
+                np.testing.assert_array_equal(
+                    cell.get_points(), cell_cached.get_points()
+                )
+
+            # Cache lacking values is not used.
+            write_sidecar(filename, {"forces": vxml.get_forces()})
+            vxml_partial = Vasprunxml(filename)
+            self.assertTrue(vxml_partial.parse(fields=("stress",)))
+            np.testing.assert_array_equal(vxml.get_stress(), vxml_partial.get_stress())
+            self.assertTrue(vxml_partial.parse())
+            self.assertEqual(vxml.get_efermi(), vxml_partial.get_efermi())
+            with io.open(filename, "rb") as f:
+                write_sidecar(filename, {"all_forces": []}, name="expat")
+                vxml_expat_partial = VasprunxmlExpat(f)
+                self.assertTrue(vxml_expat_partial.parse())
+            self.assertEqual(
+                len(vxml_expat_partial.get_cells()), len(vxml.get_forces())
+            )
+
+            # Cache of modified file is not used.
+            with open(filename, "a") as w:
+                w.write("<broken>")
+            self.assertFalse(Vasprunxml(filename).parse())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_VasprunxmlTail(self):
+        """Test following vasprun.xml growing by chunks."""
+        filename = os.path.join(os.path.dirname(__file__), "vasprun-elastic.xml")
+        vxml = Vasprunxml(filename)
+        self.assertTrue(vxml.parse_calculation())
+        with open(filename, "rb") as f:
+            data = f.read()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            growing = os.path.join(tmpdir, "vasprun.xml")
+            open(growing, "wb").close()
+            tail = VasprunxmlTail(growing)
+            num_calculations = 0
+            for i in range(0, len(data), 7000):
+                with open(growing, "ab") as w:
+                    w.write(data[i : i + 7000])
+                num_calculations += tail.update()
+                self.assertEqual(tail.get_offset(), min(i + 7000, len(data)))
+            self.assertEqual(tail.update(), 0)
+            self.assertEqual(num_calculations, len(vxml.get_forces()))
+            np.testing.assert_array_equal(tail.get_forces(), vxml.get_forces())
+            np.testing.assert_array_equal(tail.get_stress(), vxml.get_stress())
+
+            # New run of VASP truncates the file.
+            with open(growing, "wb") as w:
+                w.write(data[: len(data) // 2])
+            self.assertLess(tail.update(), num_calculations)
+            self.assertEqual(tail.get_offset(), len(data) // 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_Outcar(self):
+        """Test values of OUTCAR are parsed as those of vasprun.xml."""
+        filename = os.path.join(os.path.dirname(__file__), "vasprun-elastic.xml")
+        vxml = Vasprunxml(filename, cache=False)
+        self.assertTrue(vxml.parse())
+        born_charges = np.arange(18, dtype="double").reshape(2, 3, 3) - 9
+        epsilon = np.diag([3.5, 4.5, 5.5])
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outcar_filename = os.path.join(tmpdir, "OUTCAR")
+            with open(outcar_filename, "w") as w:
+                for lines in _get_outcar_lines(vxml, born_charges, epsilon):
+                    w.write("\n".join(lines) + "\n")
+            outcar = Outcar(outcar_filename)
+            self.assertTrue(
+                outcar.parse(
+                    fields=("forces", "stress", "energies", "born_charges", "epsilon")
+                )
+            )
+            np.testing.assert_allclose(
+                outcar.get_forces(), vxml.get_forces(), atol=1e-6
+            )
+            np.testing.assert_allclose(
+                outcar.get_stress(), vxml.get_stress(), atol=1e-5
+            )
+            np.testing.assert_allclose(
+                outcar.get_energies(), vxml.get_energies()[:, :, 0], atol=1e-8
+            )
+            np.testing.assert_allclose(outcar.get_born_charges(), born_charges)
+            np.testing.assert_allclose(outcar.get_epsilon(), epsilon)
+            self.assertFalse(outcar.parse(fields=("elastic_constants",)))
+            self.assertTrue(outcar.parse())
+
+            outcar_last = Outcar(outcar_filename)
+            self.assertTrue(outcar_last.parse(fields=("forces",), steps="last"))
+            np.testing.assert_allclose(
+                outcar_last.get_forces(), vxml.get_forces()[-1:], atol=1e-6
+            )
+            self.assertIsNone(outcar_last.get_stress())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_Outcar_elastic_constants(self):
+        """Test elastic moduli written without space between numbers."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "OUTCAR")
+            elastic_constants = np.arange(36, dtype="double").reshape(6, 6) - 18
+            elastic_constants[0, 1] = -12345.6789
+            with open(filename, "w") as w:
+                w.write(" TOTAL ELASTIC MODULI (kBar)\n")
+                w.write(" Direction    XX          YY          ZZ\n")
+                w.write(" " + "-" * 80 + "\n")
+                for x, row in zip(
+                    ("XX", "YY", "ZZ", "XY", "YZ", "ZX"), elastic_constants
+                ):
+                    w.write(" %-7s" % x + "".join(["%10.4f" % v for v in row]) + "\n")
+            outcar = Outcar(filename)
+            self.assertTrue(outcar.parse_elastic_constants())
+            np.testing.assert_allclose(
+                outcar.get_elastic_constants(), elastic_constants
+            )
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_write_potcar(self):
+        """Test POTCARs of the same species are hardlinked."""
+        tmpdir = tempfile.mkdtemp()
+        potcar_path = os.environ.get("COGUE_POTCAR_PATH")
+        try:
+            os.environ["COGUE_POTCAR_PATH"] = tmpdir
+            for symbol in ("Si", "O"):
+                with open(os.path.join(tmpdir, symbol), "w") as w:
+                    w.write("PAW_PBE %s\n" % symbol)
+            clear_potcar_cache()
+            filenames = [os.path.join(tmpdir, "POTCAR%d" % i) for i in range(3)]
+            write_potcar(["Si", "Si", "O"], filename=filenames[0])
+            os.remove(os.path.join(tmpdir, "Si"))
+            write_potcar(["Si", "O", "O"], filename=filenames[1])
+            write_potcar(["O"], filename=filenames[2])
+            with open(filenames[1]) as f:
+                self.assertEqual(f.read(), "PAW_PBE Si\nPAW_PBE O\n")
+            self.assertTrue(os.path.samefile(filenames[0], filenames[1]))
+            self.assertFalse(os.path.samefile(filenames[0], filenames[2]))
+        finally:
+            clear_potcar_cache()
+            if potcar_path is None:
+                del os.environ["COGUE_POTCAR_PATH"]
+            else:
+                os.environ["COGUE_POTCAR_PATH"] = potcar_path
+            shutil.rmtree(tmpdir)
+
+
+def _get_outcar_lines(vxml, born_charges, epsilon):
+    """Return blocks of OUTCAR lines of values of Vasprunxml."""
+    dashes = " " + "-" * 83
+    for forces, stress, energies, points, lattice in zip(
+        vxml.get_forces(),
+        vxml.get_stress(),
+        vxml.get_energies()[:, :, 0],
+        vxml.get_points(),
+        vxml.get_lattice(),
+    ):
+        yield [
+            "  FORCE on cell =-STRESS in cart. coord.  units (eV):",
+            "  Direction    XX          YY          ZZ          XY          YZ    "
+            "      ZX",
+            "  " + "-" * 86,
+            "  in kB "
+            + "".join(
+                ["%12.5f" % stress[i, j] for i, j in ((0, 0), (1, 1), (2, 2))]
+                + ["%12.5f" % stress[i, j] for i, j in ((0, 1), (1, 2), (2, 0))]
+            ),
+            "  external pressure =        0.00 kB  Pullay stress =        0.00 kB",
+        ]
+        yield [
+            " POSITION                                       TOTAL-FORCE (eV/Angst)",
+            dashes,
+        ] + [
+            "     %8.5f     %8.5f     %8.5f    %13.6f %13.6f %13.6f"
+            % (tuple(np.dot(lattice, p)) + tuple(f))
+            for p, f in zip(points.T, forces)
+        ] + [
+            dashes
+        ]
+        yield [
+            "  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)",
+            "  ---------------------------------------------------",
+            "  free  energy   TOTEN  = %18.8f eV" % energies[0],
+            "",
+            "  energy  without entropy= %17.8f  energy(sigma->0) = %17.8f"
+            % (energies[1], energies[2]),
+        ]
+
+    for title, values in (
+        ("(excluding local field effects)", epsilon * 2),
+        ("(including local field effects in DFT)", epsilon),
+        ("IONIC CONTRIBUTION", epsilon * 3),
+    ):
+        yield [
+            " MACROSCOPIC STATIC DIELECTRIC TENSOR %s" % title,
+            dashes,
+        ] + [
+            "  %12.6f%12.6f%12.6f" % tuple(v) for v in values
+        ] + [dashes]
+
+    lines = [
+        " BORN EFFECTIVE CHARGES (including local field effects) "
+        "(in |e|, cummulative output)",
+        dashes,
+    ]
+    for i, born in enumerate(born_charges):
+        lines.append(" ion %4d" % (i + 1))
+        for j, v in enumerate(born):
+            lines.append("    %d %11.5f %11.5f %11.5f" % ((j + 1,) + tuple(v)))
+    yield lines + [""]
+
 
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(TestVASPIO)
@@ -0,0 +1,453 @@
+"""Test queue."""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import spur
+
+from cogue.qsystem.gridengine import Job, LocalQueue, RemoteQueue, _parse_qstat_xml
+from cogue.qsystem.job import JobBase
+from cogue.qsystem.lsf import _parse_bjobs_json
+from cogue.qsystem.queue import QstatCache, qstat_cache
+from cogue.qsystem.ssh import SshSession
+from cogue.qsystem.transfer import TransferPool
+from cogue.task import TaskElement
+
+
+class DummyJob(JobBase):
+    """Job writing empty script."""
+
+    def write_script(self, filename):
+        """Write script."""
+        with open(filename, "w") as w:
+            w.write("\n")
+
+
+class DummyTask(TaskElement):
+    """Task having a job."""
+
+    def __init__(self, tid, work_dir, job=None):
+        """Init method."""
+        TaskElement.__init__(self)
+        self._traverse = False
+        if job is None:
+            self._job = DummyJob()
+        else:
+            self._job = job
+        self.set_tid(tid)
+        self.set_work_dir(work_dir)
+
+
+class TestLocalQueue(unittest.TestCase):
+    """Test batch submission of LocalQueue."""
+
+    def setUp(self):
+        """Set up."""
+        self._tmpdir = tempfile.mkdtemp()
+        # Fake qsub failing in directory "fail" and printing job-id otherwise.
+        self._qsub = os.path.join(self._tmpdir, "qsub")
+        with open(self._qsub, "w") as w:
+            w.write(
+                "#!/bin/sh\n"
+                "case $(pwd) in */fail) exit 1;; esac\n"
+                "case $1 in array-job.sh)\n"
+                "  echo Your job-array 77.1-3:1 has been submitted; exit 0;; esac\n"
+                "echo Your job $(basename $(pwd) | tr -d t) has been submitted\n"
+            )
+        os.chmod(self._qsub, 0o755)
+
+    def tearDown(self):
+        """Tear down."""
+        shutil.rmtree(self._tmpdir)
+
+    def _get_tasks(self, names, jobs=None):
+        tasks = []
+        for i, name in enumerate(names):
+            work_dir = os.path.join(self._tmpdir, name)
+            os.mkdir(work_dir)
+            if jobs is None:
+                tasks.append(DummyTask(i, work_dir))
+            else:
+                tasks.append(DummyTask(i, work_dir, job=jobs[i]))
+        return tasks
+
+    def test_flush(self):
+        """Test jobs are submitted up to max_jobs at once."""
+        queue = LocalQueue(max_jobs=2, qsub_command=self._qsub)
+        tasks = self._get_tasks(["t10", "t11", "t12"])
+        for task in tasks:
+            queue.register(task)
+        self.assertEqual(queue.flush(), [0, 1])
+        self.assertEqual(queue.get_jobid(0), 10)
+        self.assertEqual(queue.get_jobid(1), 11)
+        self.assertEqual(queue.get_jobid(2), None)
+        self.assertTrue("submitted" in tasks[0].get_job().get_status())
+        self.assertTrue(os.path.exists(os.path.join(self._tmpdir, "t10", "job.sh")))
+        self.assertEqual(queue.flush(), [])
+
+    def test_unparsable_qstat(self):
+        """Test job states are kept unknown until qstat is parsable."""
+        queue = LocalQueue(qsub_command=self._qsub)
+        tasks = self._get_tasks(["t10"])
+        queue.register(tasks[0])
+        queue.flush()
+        queue._set_qstatus(None)
+        queue.submit(tasks[0])
+        self.assertTrue("submitted" in tasks[0].get_job().get_status())
+        queue._set_qstatus({})
+        queue.submit(tasks[0])
+        self.assertEqual(tasks[0].get_job().get_status(), "done")
+
+    def test_flush_failure(self):
+        """Test failed submission stays in queue."""
+        queue = LocalQueue(qsub_command=self._qsub)
+        tasks = self._get_tasks(["fail", "t11"])
+        for task in tasks:
+            queue.register(task)
+        self.assertEqual(queue.flush(), [1])
+        self.assertEqual(queue.get_jobid(1), 11)
+        self.assertEqual(tasks[0].get_job().get_status(), "preparing")
+
+    def test_flush_job_array(self):
+        """Test jobs running the same script are submitted as array job."""
+        queue = LocalQueue(qsub_command=self._qsub, use_job_array=True)
+        job = Job(script="pwd > where\n", jobname="disp", stdout="std.log")
+        jobs = [job.copy("disp-%d" % i) for i in range(3)]
+        jobs.append(Job(script="other\n"))
+        tasks = self._get_tasks(["t10", "t11", "t12", "t13"], jobs=jobs)
+        for task in tasks:
+            queue.register(task)
+        self.assertEqual(queue.flush(), [0, 1, 2, 3])
+        self.assertEqual(
+            [queue.get_jobid(i) for i in range(3)], [(77, i) for i in (1, 2, 3)]
+        )
+        self.assertEqual(queue.get_jobid(3), 13)
+        self.assertEqual(tasks[1].get_job().get_status(), "submitted (job-id:77[2])")
+
+        # Element 2 runs in the directory of the second task.
+        array_script = os.path.join(self._tmpdir, "t10", "array-job.sh")
+        with open(array_script) as f:
+            self.assertIn("#$ -N disp\n", f.read())
+        env = dict(os.environ)
+        env.update({"SGE_TASK_ID": "2", "SGE_O_WORKDIR": os.path.dirname(array_script)})
+        subprocess.check_call(["sh", array_script], env=env)
+        with open(os.path.join(self._tmpdir, "t11", "where")) as f:
+            self.assertEqual(
+                os.path.realpath(f.read().strip()),
+                os.path.realpath(os.path.join(self._tmpdir, "t11")),
+            )
+        self.assertTrue(os.path.exists(os.path.join(self._tmpdir, "t11", "std.log")))
+
+
+class TestRemoteQueue(unittest.TestCase):
+    """Test RemoteQueue with local shell in place of SSH shell."""
+
+    def setUp(self):
+        """Set up."""
+        self._tmpdir = tempfile.mkdtemp()
+        self._qsub = os.path.join(self._tmpdir, "qsub")
+        with open(self._qsub, "w") as w:
+            w.write(
+                "#!/bin/sh\necho Your job $(basename $(pwd) | tr -d c)1 submitted\n"
+            )
+        os.chmod(self._qsub, 0o755)
+
+    def tearDown(self):
+        """Tear down."""
+        shutil.rmtree(self._tmpdir)
+
+    def test_submit_and_collect(self):
+        """Test files go to remote directories and come back."""
+        self._submit_and_collect(False, False)
+        self._submit_and_collect(False, True)
+
+    def test_submit_and_collect_streaming(self):
+        """Test streaming transfer."""
+        self._submit_and_collect(True, False)
+        self._submit_and_collect(True, True)
+
+    def _submit_and_collect(self, streaming, compress):
+        shutil.rmtree(self._tmpdir)
+        self.setUp()
+        remote = os.path.join(self._tmpdir, "remote")
+        queue = RemoteQueue(
+            spur.LocalShell(),
+            remote,
+            sleep_time=0,
+            qsub_command=self._qsub,
+            streaming=streaming,
+            compress=compress,
+        )
+        tasks = []
+        for tid in range(2):
+            work_dir = os.path.join(self._tmpdir, "t%d" % tid)
+            os.mkdir(work_dir)
+            with open(os.path.join(work_dir, "POSCAR"), "w") as w:
+                w.write("%d\n" % tid)
+            tasks.append(DummyTask(tid, work_dir))
+            tasks[-1].set_collect_files(("OUTCAR", "POSCAR"))
+            queue.register(tasks[-1])
+        self.assertEqual(queue.flush(), [0, 1])
+        self.assertEqual(queue.get_jobid(1), 11)
+        for tid in range(2):
+            remote_dir = os.path.join(remote, "c%05d" % tid)
+            self.assertEqual(sorted(os.listdir(remote_dir)), ["POSCAR", "job.sh"])
+            self.assertFalse(
+                os.path.exists(os.path.join(self._tmpdir, "t%d" % tid, "cogue.tar"))
+            )
+            self.assertIn("local", tasks[tid].get_log())
+
+        # Job finished and left OUTCAR.
+        for name in ("OUTCAR", "WAVECAR"):
+            with open(os.path.join(remote, "c00000", name), "w") as w:
+                w.write("done\n")
+        queue._qstatus = {}
+        queue.submit(tasks[0])
+        self.assertTrue("done" in tasks[0].get_job().get_status())
+        with open(os.path.join(self._tmpdir, "t0", "OUTCAR")) as f:
+            self.assertEqual(f.read(), "done\n")
+        self.assertFalse(os.path.exists(os.path.join(self._tmpdir, "t0", "WAVECAR")))
+        self.assertIn("collect 1 files, 1 unchanged", tasks[0].get_log())
+        self.assertFalse(os.path.exists(os.path.join(remote, "c00000", "cogue.tar")))
+
+    def test_dedup_files(self):
+        """Test identical POTCARs are sent once and hardlinked on remote."""
+        for streaming in (False, True):
+            shutil.rmtree(self._tmpdir)
+            self.setUp()
+            remote = os.path.join(self._tmpdir, "remote")
+            queue = RemoteQueue(
+                spur.LocalShell(),
+                remote,
+                sleep_time=0,
+                qsub_command=self._qsub,
+                streaming=streaming,
+            )
+            tasks = []
+            for tid in range(3):
+                work_dir = os.path.join(self._tmpdir, "t%d" % tid)
+                os.mkdir(work_dir)
+                with open(os.path.join(work_dir, "POTCAR"), "w") as w:
+                    w.write("PAW_PBE %d\n" % (tid // 2))
+                tasks.append(DummyTask(tid, work_dir))
+                queue.register(tasks[-1])
+            self.assertEqual(queue.flush(), [0, 1, 2])
+            self.assertEqual(len(os.listdir(os.path.join(remote, "blobs"))), 2)
+            for tid in range(3):
+                remote_dir = os.path.join(remote, "c%05d" % tid)
+                self.assertEqual(sorted(os.listdir(remote_dir)), ["POTCAR", "job.sh"])
+                filename = os.path.join(remote_dir, "POTCAR")
+                with open(filename) as f:
+                    self.assertEqual(f.read(), "PAW_PBE %d\n" % (tid // 2))
+                self.assertEqual(os.stat(filename).st_nlink, 3 - tid // 2)
+
+            # Blobs found on remote are not sent again.
+            work_dir = os.path.join(self._tmpdir, "t3")
+            os.mkdir(work_dir)
+            shutil.copy(os.path.join(self._tmpdir, "t0", "POTCAR"), work_dir)
+            queue.register(DummyTask(3, work_dir))
+            queue._remote_blobs = None
+            self.assertEqual(queue.flush(), [3])
+            self.assertEqual(len(os.listdir(os.path.join(remote, "blobs"))), 2)
+            filename = os.path.join(remote, "c00003", "POTCAR")
+            with open(filename) as f:
+                self.assertEqual(f.read(), "PAW_PBE 0\n")
+            self.assertEqual(os.stat(filename).st_nlink, 4)
+
+    def test_collect_finished(self):
+        """Test files of finished jobs are collected at qstat."""
+        remote = os.path.join(self._tmpdir, "remote")
+        queue = RemoteQueue(
+            spur.LocalShell(),
+            remote,
+            sleep_time=0,
+            qsub_command=self._qsub,
+            max_transfers=2,
+        )
+        tasks = []
+        for tid in range(3):
+            work_dir = os.path.join(self._tmpdir, "t%d" % tid)
+            os.mkdir(work_dir)
+            tasks.append(DummyTask(tid, work_dir))
+            queue.register(tasks[-1])
+        queue.flush()
+        for tid in range(3):
+            with open(os.path.join(remote, "c%05d" % tid, "OUTCAR"), "w") as w:
+                w.write("%d\n" % tid)
+
+        # Job of tid=2 is still running.
+        queue._set_qstatus({21: "Running"})
+        for tid in range(2):
+            self.assertTrue(
+                os.path.exists(os.path.join(self._tmpdir, "t%d" % tid, "OUTCAR"))
+            )
+        self.assertFalse(os.path.exists(os.path.join(self._tmpdir, "t2", "OUTCAR")))
+        self.assertIn("2 transfers", tasks[0].get_log())
+        queue.submit(tasks[0])
+        self.assertTrue("done" in tasks[0].get_job().get_status())
+        self.assertEqual(tasks[0].get_log().count("collect "), 1)
+        self.assertGreater(queue.get_transfer_pool().get_throughput(), 0)
+
+    def test_run_script(self):
+        """Test output and return code of each command of batch script."""
+        session = SshSession(spur.LocalShell())
+        results = session.run_script(
+            [
+                (["echo", "a b"], None),
+                ("printf x; exit 3", self._tmpdir),
+                (["pwd"], "/"),
+            ]
+        )
+        self.assertEqual([r.return_code for r in results], [0, 3, 0])
+        self.assertEqual([r.output for r in results], [b"a b\n", b"x", b"/\n"])
+
+
+class TestTransferPool(unittest.TestCase):
+    """Test TransferPool."""
+
+    def test_retry(self):
+        """Test unverified transfers are retried."""
+        attempts = []
+
+        def transfer():
+            attempts.append(1)
+            return len(attempts) > 2, 10
+
+        pool = TransferPool(max_workers=2, max_retries=5, retry_wait=0)
+        self.assertEqual(pool.run([transfer, lambda: (True, 5)]), [True, True])
+        self.assertEqual(len(attempts), 3)
+        self.assertIn("2 transfers, 35.0 B", pool.get_last_summary())
+
+    def test_give_up(self):
+        """Test transfer failing with exception is given up."""
+
+        def transfer():
+            raise OSError
+
+        pool = TransferPool(max_retries=2, retry_wait=0)
+        with mock.patch("sys.stderr"):
+            self.assertEqual(pool.run([transfer]), [False])
+
+
+QSTAT_XML = b"""<?xml version='1.0'?>
+<job_info xmlns:xsd="qstat.xsd">
+  <queue_info>
+    <job_list state="running">
+      <JB_job_number>77</JB_job_number>
+      <JB_name>disp</JB_name>
+      <state>r</state>
+      <queue_name>all.q@node1</queue_name>
+      <slots>1</slots>
+      <tasks>4</tasks>
+    </job_list>
+    <job_list state="running">
+      <JB_job_number>78</JB_job_number>
+      <JB_name>job</JB_name>
+      <state>r</state>
+      <slots>1</slots>
+    </job_list>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>77</JB_job_number>
+      <JB_name>disp</JB_name>
+      <state>qw</state>
+      <slots>1</slots>
+      <tasks>5-9:2</tasks>
+    </job_list>
+  </job_info>
+</job_info>
+"""
+
+BJOBS_JSON = b"""{
+  "COMMAND":"bjobs",
+  "JOBS":2,
+  "RECORDS":[
+    {"JOBID":"77", "STAT":"PEND", "JOBINDEX":"3"},
+    {"JOBID":"78", "STAT":"RUN", "JOBINDEX":"0"}
+  ]
+}
+"""
+
+
+class CountingShell:
+    """Shell counting calls of run."""
+
+    def __init__(self, output=b""):
+        """Init method."""
+        self.num_run = 0
+        self._output = output
+
+    def run(self, command, allow_error=False):
+        """Run."""
+        self.num_run += 1
+        return mock.Mock(output=self._output)
+
+
+class TestQstat(unittest.TestCase):
+    """Test parsers of output of qstat and the cache."""
+
+    def test_gridengine(self):
+        """Test qstat -xml."""
+        qstatus = _parse_qstat_xml(QSTAT_XML)
+        self.assertEqual(
+            qstatus,
+            {
+                (77, 4): "Running",
+                78: "Running",
+                (77, 5): "Pending",
+                (77, 7): "Pending",
+                (77, 9): "Pending",
+            },
+        )
+        self.assertEqual(_parse_qstat_xml(b"error: commlib error"), None)
+
+    def test_lsf(self):
+        """Test bjobs -json."""
+        qstatus = _parse_bjobs_json(BJOBS_JSON)
+        self.assertEqual(qstatus, {(77, 3): "Pending", 78: "Running"})
+        self.assertEqual(_parse_bjobs_json(b"No unfinished job found\n"), {})
+        self.assertEqual(_parse_bjobs_json(b""), {})
+        self.assertEqual(_parse_bjobs_json(b"Cannot connect to LSF"), None)
+
+    def test_cache(self):
+        """Test snapshot is shared until cleared."""
+        cache = QstatCache()
+        shell = CountingShell()
+        cache.run(shell, ["qstat", "-xml"])
+        cache.run(CountingShell(), ["qstat", "-xml"])
+        self.assertEqual(shell.num_run, 1)
+        cache.clear()
+        cache.run(shell, ["qstat", "-xml"])
+        self.assertEqual(shell.num_run, 2)
+
+    def test_cache_per_cycle(self):
+        """Test queues polling in each cycle share one qstat."""
+        shell = CountingShell(output=QSTAT_XML)
+        queues = [LocalQueue(), LocalQueue()]
+        for queue in queues:
+            queue._shell = shell
+        qstat_cache.clear()
+        for i in range(3):
+            for queue in queues:
+                queue.qstat()
+            self.assertEqual(shell.num_run, i + 1)
+        self.assertEqual(queues[1]._qstatus[78], "Running")
+
+        # The latest snapshot is reused by the queue that did not use it.
+        queues[0].qstat()
+        queues[0].qstat()
+        queues[1].qstat()
+        self.assertEqual(shell.num_run, 5)
+
+        # Snapshot is discarded at submission.
+        qstat_cache.clear()
+        queues[1].qstat()
+        self.assertEqual(shell.num_run, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()